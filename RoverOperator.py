@@ -4,20 +4,116 @@ import time
 import websockets
 import asyncio
 import argparse
+import os
+import struct
+
+from mine_import import read_mine_files
+
+# Binary map format served by GET /map (see encode_map in fast_api_server.py)
+MAP_HEADER = struct.Struct('<4sBBHIIQ')
+MAP_ENCODING_BITS = 1
+MAP_ENCODING_RUNS = 2
+
+# Cells shown around the rover during real-time control
+VIEW_RADIUS = 10
+
+def decode_map(payload):
+    """Decodes a binary GET /map body into a list of rows."""
+    magic, _, encoding, _, height, width, _ = MAP_HEADER.unpack_from(payload)
+    if magic != b"RVMP":
+        raise ValueError("Not a binary map")
+    body = payload[MAP_HEADER.size:]
+    cells = height * width
+    if encoding == MAP_ENCODING_BITS:
+        bits = bin(int.from_bytes(body, 'big'))[2:].zfill(len(body) * 8)[:cells]
+    elif encoding == MAP_ENCODING_RUNS:
+        runs = []
+        value = shift = 0
+        for byte in body:
+            value |= (byte & 0x7f) << shift
+            shift += 7
+            if not byte & 0x80:
+                runs.append(value)
+                value = shift = 0
+        bits = ''.join(('1' if i % 2 else '0') * run for i, run in enumerate(runs))
+    else:
+        raise ValueError(f"Unknown map encoding {encoding}")
+    return [[int(c) for c in bits[y * width:(y + 1) * width]] for y in range(height)]
+
+def read_scenario(path):
+    """Reads a scenario file, one directive per line ('#' starts a comment):
+
+        map H W                      map size
+        mine X Y SERIAL              one mine
+        mines MAP_FILE SERIAL_FILE   mines from a map file and serial list (see mine_import)
+        rover COMMANDS               one rover
+        dispatch                     dispatch the scenario's rovers once they are created
+    """
+    scenario = {"height": None, "width": None, "mines": [], "rovers": [], "dispatch": False}
+    base = os.path.dirname(path)
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            words = line.split('#', 1)[0].split()
+            if not words:
+                continue
+            try:
+                directive, args = words[0], words[1:]
+                if directive == 'map' and len(args) == 2:
+                    scenario["height"], scenario["width"] = int(args[0]), int(args[1])
+                elif directive == 'mine' and len(args) == 3:
+                    scenario["mines"].append((int(args[0]), int(args[1]), args[2]))
+                elif directive == 'mines' and len(args) == 2:
+                    height, width, mines = read_mine_files(os.path.join(base, args[0]), os.path.join(base, args[1]))
+                    scenario["height"], scenario["width"] = height, width
+                    scenario["mines"].extend(mines)
+                elif directive == 'rover' and len(args) <= 1:
+                    scenario["rovers"].append(args[0] if args else "")
+                elif directive == 'dispatch' and not args:
+                    scenario["dispatch"] = True
+                else:
+                    raise ValueError(f"can't read {line.strip()!r}")
+            except ValueError as e:
+                raise ValueError(f"{path}, line {number}: {e}")
+    return scenario
 
 class RoverOperator:
     def __init__(self, base_url="http://localhost:8000"):
         self.base_url = base_url
         self.session = requests.Session()
+        self.map_etag = None
+        self.map_cache = None
         
-    def get_map(self):
-        response = self.session.get(f"{self.base_url}/map")
+    def get_map(self, binary=True):
+        # Conditional request: the server answers 304 if the map hasn't changed since the last fetch
+        headers = {"If-None-Match": self.map_etag} if self.map_etag else {}
+        if binary:
+            headers["Accept"] = "application/octet-stream"
+        response = self.session.get(f"{self.base_url}/map", headers=headers)
+        if response.status_code == 304:
+            return self.map_cache
         if response.status_code == 200:
-            return response.json()
+            if response.headers.get("content-type", "").startswith("application/octet-stream"):
+                grid = decode_map(response.content)
+            else:
+                grid = response.json()
+            self.map_etag = response.headers.get("ETag")
+            self.map_cache = grid
+            return grid
         else:
             print(f"Error getting map: {response.status_code}")
             return None
             
+    def get_map_window(self, x, y, width, height):
+        # Only the requested region is sent, whatever the size of the world
+        params = {"x": x, "y": y, "width": width, "height": height}
+        response = self.session.get(f"{self.base_url}/map", params=params,
+                                    headers={"Accept": "application/octet-stream"})
+        if response.status_code == 200:
+            return decode_map(response.content)
+        else:
+            print(f"Error getting map window: {response.status_code} - {response.text}")
+            return None
+            
     def update_map(self, height, width):
         data = {"height": height, "width": width}
         response = self.session.put(f"{self.base_url}/map", json=data)
@@ -54,6 +150,21 @@ class RoverOperator:
             print(f"Error creating mine: {response.status_code} - {response.text}")
             return None
             
+    def bulk_create_mines(self, mines, height=None, width=None, replace=False):
+        # One request for any number of (x, y, serial) mines; the server adds all of them or none
+        params = {"replace": str(replace).lower()}
+        if height is not None:
+            params.update(height=height, width=width)
+        data = [{"x": x, "y": y, "serial_number": serial} for x, y, serial in mines]
+        response = self.session.post(f"{self.base_url}/mines/bulk", params=params, json=data)
+        if response.status_code == 201:
+            result = response.json()
+            print(f"Created {result['created']} mines on a {result['height']}x{result['width']} map")
+            return result
+        else:
+            print(f"Error creating mines: {response.status_code} - {response.text}")
+            return None
+
     def update_mine(self, mine_id, x=None, y=None, serial_number=None):
         data = {}
         if x is not None:
@@ -96,6 +207,20 @@ class RoverOperator:
             print(f"Error getting rover {rover_id}: {response.status_code}")
             return None
             
+    def get_rover_path(self, rover_id, start=0, stop=None, max_points=None):
+        # Cells the rover moved through, oldest first; max_points thins out long paths
+        params = {"start": start}
+        if stop is not None:
+            params["stop"] = stop
+        if max_points is not None:
+            params["max_points"] = max_points
+        response = self.session.get(f"{self.base_url}/rovers/{rover_id}/path", params=params)
+        if response.status_code == 200:
+            return response.json()
+        else:
+            print(f"Error getting path for rover {rover_id}: {response.status_code}")
+            return None
+            
     def create_rover(self, commands):
         data = {"commands": commands}
         response = self.session.post(f"{self.base_url}/rovers", json=data)
@@ -106,6 +231,51 @@ class RoverOperator:
             print(f"Error creating rover: {response.status_code} - {response.text}")
             return None
             
+    def bulk_create_rovers(self, commands_list):
+        # One request for any number of rovers; returns their IDs
+        data = [{"commands": commands} for commands in commands_list]
+        response = self.session.post(f"{self.base_url}/rovers/bulk", json=data)
+        if response.status_code == 201:
+            ids = response.json()["ids"]
+            print(f"Created {len(ids)} rovers")
+            return ids
+        else:
+            print(f"Error creating rovers: {response.status_code} - {response.text}")
+            return None
+
+    def dispatch_rovers(self, rover_ids):
+        response = self.session.post(f"{self.base_url}/rovers/dispatch", json={"rover_ids": rover_ids})
+        if response.status_code == 200:
+            print(f"Dispatched {len(rover_ids)} rovers")
+            return response.json()
+        else:
+            print(f"Error dispatching rovers: {response.status_code} - {response.text}")
+            return None
+
+    def run_scenario(self, path):
+        """Sets the world up from a scenario file (see read_scenario) in a few bulk requests.
+
+        The scenario's map and mines replace the current ones; its rovers are added.
+        """
+        scenario = read_scenario(path)
+        if scenario["height"] is not None or scenario["mines"]:
+            if self.bulk_create_mines(scenario["mines"], scenario["height"], scenario["width"], replace=True) is None:
+                return False
+        rover_ids = []
+        if scenario["rovers"]:
+            rover_ids = self.bulk_create_rovers(scenario["rovers"])
+            if rover_ids is None:
+                return False
+        if scenario["dispatch"] and rover_ids:
+            rovers = self.dispatch_rovers(rover_ids)
+            if rovers is None:
+                return False
+            statuses = {}
+            for rover in rovers:
+                statuses[rover['status']] = statuses.get(rover['status'], 0) + 1
+            print("Results: " + ", ".join(f"{count} {status}" for status, count in sorted(statuses.items())))
+        return True
+
     def update_rover(self, rover_id, commands):
         data = {"commands": commands}
         response = self.session.put(f"{self.base_url}/rovers/{rover_id}", json=data)
@@ -134,7 +304,8 @@ class RoverOperator:
             print(f"Error dispatching rover {rover_id}: {response.status_code} - {response.text}")
             return None
     
-    def display_map(self, grid=None, rover_pos=None):
+    def display_map(self, grid=None, rover_pos=None, origin=(0, 0)):
+        # origin is the map coordinate of grid[0][0] when grid is a window
         if grid is None:
             grid = self.get_map()
             
@@ -147,7 +318,7 @@ class RoverOperator:
             row = ""
             for x in range(len(grid[y])):
                 # Check if rover is at this position
-                if rover_pos and rover_pos['x'] == x and rover_pos['y'] == y:
+                if rover_pos and rover_pos['x'] == x + origin[0] and rover_pos['y'] == y + origin[1]:
                     row += "R "
                 elif grid[y][x] == 1:
                     row += "M "  # Mine
@@ -179,25 +350,14 @@ class RoverOperator:
                 if grid[y][x] == 1:
                     path_map[y][x] = 'M'
                     
-        # Simulate rover movement to draw path
-        x, y = 0, 0  # Start at (0,0)
-        direction_idx = 2  # Start facing South
-        
-        path_map[y][x] = '*'  # Start position
-        
-        for cmd in rover['executed_commands']:
-            if cmd == 'L':
-                direction_idx = (direction_idx - 1) % 4
-            elif cmd == 'R':
-                direction_idx = (direction_idx + 1) % 4
-            elif cmd == 'M':
-                dx, dy = [(0, -1), (1, 0), (0, 1), (-1, 0)][direction_idx]
-                new_x, new_y = x + dx, y + dy
-                
-                if 0 <= new_x < len(grid[0]) and 0 <= new_y < len(grid):
-                    x, y = new_x, new_y
-                    if path_map[y][x] != 'M':  # Don't overwrite mines
-                        path_map[y][x] = '*'
+        # The server keeps the path, so nothing is re-simulated here
+        path = self.get_rover_path(rover_id)
+        if not path:
+            return
+        for x, y in path['points']:
+            # Skip cells cut off by a resize since, and don't overwrite mines
+            if y < len(path_map) and x < len(path_map[0]) and path_map[y][x] != 'M':
+                path_map[y][x] = '*'
                         
         # Display the path map
         print(f"Path for Rover {rover_id}:")
@@ -221,10 +381,12 @@ class RoverOperator:
                     print(f"Initial position: ({rover['position']['x']}, {rover['position']['y']})")
             
             while True:
-                # Get map to display current state
-                grid = self.get_map()
-                if grid and 'position' in rover:
-                    self.display_map(grid, rover['position'])
+                # Get the region around the rover to display current state
+                if rover and 'position' in rover:
+                    origin = (max(rover['position']['x'] - VIEW_RADIUS, 0), max(rover['position']['y'] - VIEW_RADIUS, 0))
+                    grid = self.get_map_window(origin[0], origin[1], 2 * VIEW_RADIUS + 1, 2 * VIEW_RADIUS + 1)
+                    if grid:
+                        self.display_map(grid, rover['position'], origin)
                 
                 # Get command from user
                 command = input("Enter command: ").upper()
@@ -266,9 +428,12 @@ class RoverOperator:
 def main():
     parser = argparse.ArgumentParser(description='Rover Operator CLI')
     parser.add_argument('--url', default='http://localhost:8000', help='Base URL of the server')
+    parser.add_argument('--scenario', help='Set up the world from a scenario file and exit (see read_scenario)')
     args = parser.parse_args()
     
     operator = RoverOperator(args.url)
+    if args.scenario:
+        raise SystemExit(0 if operator.run_scenario(args.scenario) else 1)
     
     while True:
         print("\n==== Rover Operator Menu ====")
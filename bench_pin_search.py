@@ -0,0 +1,62 @@
+"""Compares PIN search throughput of the original find_pin loop and PinSearchEngine.
+
+Usage: python bench_pin_search.py [--count N] [--repeat R] [--serial S]
+"""
+import argparse
+import hashlib
+import time
+
+from pin_search import PinSearchEngine
+
+def legacy_search(serial, start, stop, difficulty):
+    """The original find_pin loop: a new string, encode, full hash and hexdigest per PIN."""
+    prefix = '0' * difficulty
+    for pin in range(start, stop):
+        temp_key = serial + str(pin)
+        hash_hex = hashlib.sha256(temp_key.encode()).hexdigest()
+        if hash_hex.startswith(prefix):
+            return pin
+    return None
+
+def engine_search(serial, start, stop, difficulty):
+    return PinSearchEngine(serial, difficulty).search(start, stop)
+
+def best_rate(search, serial, count, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        # Difficulty 64 never matches, so every candidate gets hashed
+        search(serial, 0, count, 64)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return count / best
+
+def check_agreement(serials, difficulty, stop):
+    for serial in serials:
+        expected = legacy_search(serial, 0, stop, difficulty)
+        actual = engine_search(serial, 0, stop, difficulty)
+        if expected != actual:
+            raise SystemExit(f"Mismatch for {serial!r}: legacy {expected}, engine {actual}")
+
+def main():
+    parser = argparse.ArgumentParser(description='PIN search benchmark')
+    parser.add_argument('--count', type=int, default=200000, help='PINs hashed per run')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per implementation (best is kept)')
+    parser.add_argument('--serial', default='b1l3qy2l9g', help='Serial number to search')
+    args = parser.parse_args()
+
+    with open('mines.txt') as f:
+        serials = f.read().split()
+    for difficulty in (1, 2, 3, 4):
+        check_agreement(serials, difficulty, 100001)
+    print("Results agree with the original search for difficulties 1-4")
+
+    legacy = best_rate(legacy_search, args.serial, args.count, args.repeat)
+    engine = best_rate(engine_search, args.serial, args.count, args.repeat)
+    print(f"{'implementation':<16}{'hashes/s':>14}")
+    print(f"{'legacy':<16}{legacy:>14,.0f}")
+    print(f"{'engine':<16}{engine:>14,.0f}")
+    print(f"speedup: {engine / legacy:.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import fast_api_server
+from fast_api_server import DataStore
+
+@pytest.fixture
+def reset_world():
+    """Returns a function emptying the app's world."""
+    def reset():
+        db = fast_api_server.db
+        state = DataStore().snapshot()
+        state["map_version"] = db.map_version + 1  # Forward, so no cached map body is served again
+        db.load_snapshot(state)
+    return reset
+
+@pytest.fixture
+def client(monkeypatch, reset_world):
+    """The app on an empty world, with the consistency check on and easy PINs on the thread pool."""
+    monkeypatch.setattr(fast_api_server.db, "check_consistency", True)
+    monkeypatch.setattr(fast_api_server.pin_pool, "difficulty", 2)
+    monkeypatch.setattr(fast_api_server.pin_pool, "max_workers", 0)
+    with TestClient(fast_api_server.app) as client:
+        reset_world()
+        yield client
@@ -1,16 +1,346 @@
-import hashlib
+import asyncio
+import bisect
+import codecs
+import math
+import dbm
 import json
+import multiprocessing
 import os
+import re
+import struct
+import time
+import traceback
+import uuid
+from array import array
+from collections import OrderedDict, deque
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager, nullcontext
 from enum import Enum
 from typing import List, Optional, Dict, Any, Union
 
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, status, Request
+import numpy as np
+from fastapi import Depends, FastAPI, HTTPException, Query, WebSocket, WebSocketDisconnect, status, Request
+from fastapi.exceptions import RequestValidationError
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi.responses import FileResponse, HTMLResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+
+import pin_search
+from mine_import import MineFileError, MineLayoutParser
+from pin_search import NO_PIN_FOUND, search_pin_range
+from file_store import FileJournal
+from shared_store import SQLiteJournal
+
+# PIN search settings (overridable through the environment)
+PIN_POOL_SIZE = int(os.environ.get("ROVER_PIN_POOL_SIZE", os.cpu_count() or 1))
+PIN_QUEUE_SIZE = int(os.environ.get("ROVER_PIN_QUEUE_SIZE", "64"))
+PIN_CACHE_SIZE = int(os.environ.get("ROVER_PIN_CACHE_SIZE", "10000"))
+PIN_CACHE_FILE = os.environ.get("ROVER_PIN_CACHE_FILE")  # Optional on-disk store, survives restarts
+PIN_DIFFICULTY = int(os.environ.get("ROVER_PIN_DIFFICULTY", "6"))  # Leading zero hex digits required
+PIN_SEARCH_LIMIT = int(os.environ.get("ROVER_PIN_SEARCH_LIMIT", "100000"))  # Largest PIN tried
+PIN_CHUNK_SIZE = int(os.environ.get("ROVER_PIN_CHUNK_SIZE", "25000"))  # Parallel search chunk, 0 = sequential only
+PIN_PREFETCH_CONCURRENCY = int(os.environ.get("ROVER_PIN_PREFETCH_CONCURRENCY", "2"))  # Speculative searches at once
+
+# Map storage: "dense" (a byte per cell), "sparse" (only mine coordinates) or "auto"
+MAP_MODE = os.environ.get("ROVER_MAP_MODE", "auto")
+DENSE_MAP_MAX_CELLS = int(os.environ.get("ROVER_DENSE_MAP_MAX_CELLS", str(16 * 1024 * 1024)))  # "auto" goes sparse above this
+MAP_TILE_SIZE = int(os.environ.get("ROVER_MAP_TILE_SIZE", "32"))  # Cells per side of a /map/tiles tile
+MAP_CHANGE_LOG_SIZE = int(os.environ.get("ROVER_MAP_CHANGE_LOG_SIZE", "10000"))  # Cell changes kept for /map/changes
+
+# Streamed dispatches send a chunk after this many events (or sooner, while a PIN is computed)
+DISPATCH_STREAM_BATCH = int(os.environ.get("ROVER_DISPATCH_STREAM_BATCH", "64"))
+
+# Spectator updates are coalesced into one per tick; a subscriber that falls further behind
+# than this many map changes is told to resync instead
+SPECTATOR_TICK_MS = int(os.environ.get("ROVER_SPECTATOR_TICK_MS", "100"))
+SPECTATOR_MAX_CHANGES = int(os.environ.get("ROVER_SPECTATOR_MAX_CHANGES", "1000"))
+
+# Scheduler for enqueued rovers: all of them advance by TICK_STEPS commands every tick,
+# and rovers left over when a tick runs out of budget go first in the next one
+TICK_MS = int(os.environ.get("ROVER_TICK_MS", "100"))
+TICK_STEPS = int(os.environ.get("ROVER_TICK_STEPS", "1"))
+TICK_BUDGET_MS = int(os.environ.get("ROVER_TICK_BUDGET_MS", "50"))
+
+# POST /simulate results kept for the current map version
+SIMULATION_CACHE_SIZE = int(os.environ.get("ROVER_SIMULATION_CACHE_SIZE", "1024"))
+
+# SQLite database shared by all worker processes (uvicorn --workers N); unset keeps the world in-process
+SHARED_DB = os.environ.get("ROVER_SHARED_DB")
+SHARED_SNAPSHOT_OPS = int(os.environ.get("ROVER_SHARED_SNAPSHOT_OPS", "10000"))  # Journal ops between snapshots
+
+# Directory that keeps a single process's world across restarts (op log plus snapshots); unset = in memory only.
+# Ignored when ROVER_SHARED_DB is set
+DATA_DIR = os.environ.get("ROVER_DATA_DIR")
+DATA_FSYNC = os.environ.get("ROVER_DATA_FSYNC", "interval")  # always, interval (once a second) or never
+DATA_SNAPSHOT_OPS = int(os.environ.get("ROVER_DATA_SNAPSHOT_OPS", "100000"))  # Logged ops between snapshots
+
+# Paging of GET /mines and GET /rovers: the largest limit, and how many records one page may look at
+MAX_PAGE_SIZE = int(os.environ.get("ROVER_MAX_PAGE_SIZE", "10000"))
+PAGE_SCAN_LIMIT = int(os.environ.get("ROVER_PAGE_SCAN_LIMIT", "100000"))
+
+# Encoded GET /map, /mines and /rovers bodies kept until the data they show changes; 0 = build every time
+RESPONSE_CACHE_BYTES = int(os.environ.get("ROVER_RESPONSE_CACHE_BYTES", str(256 * 1024 * 1024)))
+
+# Re-check DataStore invariants after every mutation (slow, meant for tests)
+CHECK_CONSISTENCY = os.environ.get("ROVER_CHECK_CONSISTENCY", "") == "1"
+
+class PinSearchPool:
+    """Runs PIN searches in worker processes so they never block the event loop.
+
+    Searches larger than one chunk are split into consecutive nonce ranges that run
+    on several workers at once. The smallest qualifying PIN is always returned, so
+    results match the sequential pin_search.find_pin.
+    """
+
+    def __init__(self, max_workers, max_pending, difficulty=PIN_DIFFICULTY,
+                 limit=PIN_SEARCH_LIMIT, chunk_size=PIN_CHUNK_SIZE):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.difficulty = difficulty
+        self.limit = limit
+        self.chunk_size = chunk_size
+        self.executor = None
+        self.slots = None
+        self.found_at = None
+        self.free_slots = []
+
+    def start(self):
+        if self.executor is None and self.max_workers > 0:
+            # Cancellation slots for searches in flight; extra ones cover slots still held by
+            # abandoned chunks that are finishing up in a worker
+            self.found_at = multiprocessing.Array('q', [NO_PIN_FOUND] * (2 * self.max_pending), lock=False)
+            self.free_slots = list(range(2 * self.max_pending))
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                initializer=pin_search._init_pin_worker,
+                initargs=(self.found_at,),
+            )
+        # Created here rather than in __init__ so it binds to the running loop
+        self.slots = asyncio.Semaphore(self.max_pending)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+
+    async def find_pin(self, serial, workers=None):
+        """Searches serial's PIN, keeping at most workers chunks in flight (default: every worker)."""
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.max_pending)
+        # Bounded queue: callers wait for a free slot instead of piling up work in the pool
+        async with self.slots:
+            loop = asyncio.get_running_loop()
+            if self.executor is None or self.chunk_size <= 0 or self.limit < self.chunk_size:
+                # Without a process pool (pool size 0 or outside the app lifespan) use the default thread pool
+                return await loop.run_in_executor(
+                    self.executor, pin_search.find_pin, serial, self.difficulty, self.limit)
+            # No free slot only costs early cancellation, the result is the same
+            slot = self.free_slots.pop() if self.free_slots else None
+            if slot is not None:
+                self.found_at[slot] = NO_PIN_FOUND
+            return await self._find_pin_parallel(loop, serial, slot, workers or self.max_workers)
+
+    async def _find_pin_parallel(self, loop, serial, slot, workers):
+        starts = range(0, self.limit + 1, self.chunk_size)
+        running = {}  # asyncio future -> (chunk index, worker future)
+        abandoned = []
+        next_chunk = 0
+        best_chunk, best_pin = len(starts), None
+        try:
+            while True:
+                # Keep every worker busy, but never start chunks past one that already found a PIN
+                while next_chunk < best_chunk and len(running) < workers:
+                    start = starts[next_chunk]
+                    stop = min(start + self.chunk_size, self.limit + 1)
+                    work = self.executor.submit(search_pin_range, serial, start, stop, self.difficulty, slot)
+                    running[asyncio.wrap_future(work)] = (next_chunk, work)
+                    next_chunk += 1
+                if not running:
+                    break
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    chunk, _ = running.pop(future)
+                    pin = future.result()
+                    if pin is not None and chunk < best_chunk:
+                        best_chunk, best_pin = chunk, pin
+                        if slot is not None:
+                            self.found_at[slot] = starts[chunk]
+                # Later chunks can only produce larger PINs
+                for future, (chunk, work) in list(running.items()):
+                    if chunk > best_chunk:
+                        abandoned.append(work)
+                        del running[future]
+        finally:
+            abandoned.extend(work for _, work in running.values())
+            self._release_slot(loop, slot, abandoned)
+        return self.limit if best_pin is None else best_pin
+
+    def _release_slot(self, loop, slot, abandoned):
+        # Queued chunks are dropped; running ones still write to the slot, so it is
+        # only reused once the last of them has returned
+        still_running = [work for work in abandoned if not work.cancel() and not work.done()]
+        if slot is None:
+            return
+        if not still_running:
+            self.free_slots.append(slot)
+            return
+        remaining = [len(still_running)]
+
+        def finished():
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                self.free_slots.append(slot)
+
+        def on_done(_):
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(finished)
+
+        for work in still_running:
+            work.add_done_callback(on_done)
+
+class PinCache:
+    """LRU cache of serial -> PIN in front of the search pool, optionally backed by a dbm file.
+
+    Prefetches wait in their own queue and at most prefetch_concurrency of them search
+    at once, one chunk each. Together they leave at least one pool worker free, so a
+    rover's dig never queues behind speculative searches.
+    """
+
+    def __init__(self, pool, max_entries, path=None, prefetch_concurrency=PIN_PREFETCH_CONCURRENCY):
+        self.pool = pool
+        self.max_entries = max_entries
+        self.path = path
+        self.entries = OrderedDict()  # serial -> pin, least recently used first
+        self.pending = {}  # serial -> search task in flight
+        self.prefetch_concurrency = prefetch_concurrency
+        self.prefetch_queue = OrderedDict()  # serials waiting for a prefetch worker, oldest first
+        self.prefetchers = set()
+        # Stored PINs are only valid for the difficulty and limit they were searched with
+        self.namespace = f"{pool.difficulty}:{pool.limit}:"
+        self.store = None
+        self.hits = 0
+        self.misses = 0
+
+    def open(self):
+        if self.path and self.store is None:
+            self.store = dbm.open(self.path, 'c')
+
+    def close(self):
+        for task in self.prefetchers:
+            task.cancel()
+        self.prefetch_queue.clear()
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+
+    def lookup(self, serial):
+        pin = self.entries.get(serial)
+        if pin is not None:
+            self.entries.move_to_end(serial)
+            return pin
+        if self.store is not None:
+            raw = self.store.get((self.namespace + serial).encode())
+            if raw is not None:
+                pin = int(raw)
+                self._remember(serial, pin)
+                return pin
+        return None
+
+    def _remember(self, serial, pin):
+        self.entries[serial] = pin
+        self.entries.move_to_end(serial)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _search(self, serial, workers=None):
+        # Share one search between every caller (and prefetch) asking for the same serial;
+        # a dig for a serial being prefetched waits on that one-chunk search rather than starting over
+        task = self.pending.get(serial)
+        if task is None:
+            task = asyncio.ensure_future(self._compute(serial, workers))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())  # Don't warn about unawaited prefetches
+            self.pending[serial] = task
+        return task
+
+    async def _compute(self, serial, workers):
+        try:
+            pin = await self.pool.find_pin(serial, workers)
+        finally:
+            self.pending.pop(serial, None)
+        self._remember(serial, pin)
+        if self.store is not None:
+            self.store[(self.namespace + serial).encode()] = str(pin).encode()
+        return pin
+
+    async def get(self, serial):
+        pin = self.lookup(serial)
+        if pin is not None:
+            self.hits += 1
+            return pin
+        self.misses += 1
+        # Shielded so a caller going away doesn't cancel a search others may be waiting on
+        return await asyncio.shield(self._search(serial))
+
+    def prefetch(self, serial):
+        """Speculatively computes the PIN for serial in the background."""
+        # More than the cache holds would only evict each other
+        if (self.prefetch_limit() <= 0 or serial in self.pending or serial in self.prefetch_queue
+                or len(self.prefetch_queue) >= self.max_entries or self.lookup(serial) is not None):
+            return
+        self.prefetch_queue[serial] = None
+        if len(self.prefetchers) < self.prefetch_limit():
+            task = asyncio.ensure_future(self._prefetch_worker())
+            self.prefetchers.add(task)
+            task.add_done_callback(self.prefetchers.discard)
+
+    def prefetch_limit(self):
+        # A process pool keeps a worker for digs, so a single worker leaves none for prefetching
+        if self.pool.max_workers > 0:
+            return min(self.prefetch_concurrency, self.pool.max_workers - 1)
+        return self.prefetch_concurrency
+
+    def prefetch_many(self, serials):
+        for serial in serials:
+            self.prefetch(serial)
+
+    async def _prefetch_worker(self):
+        while self.prefetch_queue:
+            serial, _ = self.prefetch_queue.popitem(last=False)
+            if serial not in self.pending and self.lookup(serial) is None:
+                try:
+                    await self._search(serial, workers=1)
+                except Exception:
+                    pass  # A dig for this serial will search again and report the error
+
+pin_pool = PinSearchPool(PIN_POOL_SIZE, PIN_QUEUE_SIZE)
+pin_cache = PinCache(pin_pool, PIN_CACHE_SIZE, PIN_CACHE_FILE)
+
+@asynccontextmanager
+async def lifespan(app):
+    pin_pool.start()
+    pin_cache.open()
+    if SHARED_DB:
+        db.attach(SQLiteJournal(SHARED_DB, SHARED_SNAPSHOT_OPS))
+    elif DATA_DIR:
+        db.attach(FileJournal(DATA_DIR, DATA_FSYNC, DATA_SNAPSHOT_OPS))
+    spectators.start()
+    scheduler.start()
+    try:
+        yield
+    finally:
+        await scheduler.stop()
+        await spectators.stop()
+        db.detach()
+        pin_pool.shutdown()
+        pin_cache.close()
+
+async def sync_world():
+    # With a shared backend, every request first catches up with the other workers
+    db.sync()
 
-app = FastAPI(title="Rover Control API")
+app = FastAPI(title="Rover Control API", lifespan=lifespan, dependencies=[Depends(sync_world)])
 
 # Enum for rover status
 class RoverStatus(str, Enum):
@@ -36,6 +366,9 @@ class MineUpdate(BaseModel):
 class Mine(MineBase):
     id: int
 
+# Validates a POST /mines/bulk body straight from the JSON bytes
+_mine_list = TypeAdapter(List[MineCreate])
+
 class RoverBase(BaseModel):
     commands: str
 
@@ -56,23 +389,546 @@ class Rover(RoverBase):
     position: RoverPosition
     executed_commands: str = ""
 
+# What DataStore keeps. The models above are only built at the API boundary: a slotted
+# record is a fraction of a model's size, and setting its fields skips validation.
+class MineRecord:
+    """One mine, as handed out by MineTable."""
+    __slots__ = ("id", "x", "y", "serial_number")
+
+    def __init__(self, id, x, y, serial_number):
+        self.id = id
+        self.x = x
+        self.y = y
+        self.serial_number = serial_number
+
+    def to_json(self):
+        return {"x": self.x, "y": self.y, "serial_number": self.serial_number, "id": self.id}
+
+class MineTable(Mapping):
+    """The stored mines as parallel columns of IDs, xs, ys and serial numbers.
+
+    Reads like a dict of id -> MineRecord, but the records are built on access and are
+    copies: changes go through add, move, set_serial and remove. A million mines are three
+    int64 arrays, a list and an index instead of a million objects for the garbage collector
+    to scan. Columns can be given as anything array() takes, raw native-order bytes included.
+    """
+
+    def __init__(self, ids=(), xs=(), ys=(), serials=()):
+        self.ids = array('q', ids)
+        self.xs = array('q', xs)
+        self.ys = array('q', ys)
+        self.serials = list(serials)
+        self._slots = None
+
+    @property
+    def slots(self):
+        """id -> index into the columns, built on first use: recovering a big world doesn't wait for it."""
+        if self._slots is None:
+            self._slots = dict(zip(self.ids, range(len(self.ids))))
+        return self._slots
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, mine_id):
+        return mine_id in self.slots
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __getitem__(self, mine_id):
+        i = self.slots[mine_id]
+        return MineRecord(mine_id, self.xs[i], self.ys[i], self.serials[i])
+
+    def values(self):
+        return map(MineRecord, self.ids, self.xs, self.ys, self.serials)
+
+    def items(self):
+        return zip(self.ids, self.values())
+
+    def columns(self):
+        """Copies of the four columns, in the same (arbitrary) order."""
+        return array('q', self.ids), array('q', self.xs), array('q', self.ys), list(self.serials)
+
+    def add(self, mine):
+        i = self.slots.get(mine.id)
+        if i is None:
+            self.slots[mine.id] = len(self.ids)
+            self.ids.append(mine.id)
+            self.xs.append(mine.x)
+            self.ys.append(mine.y)
+            self.serials.append(mine.serial_number)
+        else:
+            self.xs[i], self.ys[i], self.serials[i] = mine.x, mine.y, mine.serial_number
+
+    def move(self, mine_id, x, y):
+        i = self.slots[mine_id]
+        self.xs[i] = x
+        self.ys[i] = y
+
+    def set_serial(self, mine_id, serial):
+        self.serials[self.slots[mine_id]] = serial
+
+    def remove(self, mine_id):
+        mine = self[mine_id]
+        i = self.slots.pop(mine_id)
+        last = len(self.ids) - 1
+        if i != last:  # The last mine fills the gap
+            for column in (self.ids, self.xs, self.ys, self.serials):
+                column[i] = column[last]
+            self.slots[self.ids[i]] = i
+        for column in (self.ids, self.xs, self.ys, self.serials):
+            column.pop()
+        return mine
+
+class RoverRecord:
+    """One rover; the scheduler and WebSocket sessions hold on to it, so it changes in place."""
+    __slots__ = ("id", "commands", "status", "x", "y", "facing", "_executed", "path")
+
+    def __init__(self, id, commands, status=RoverStatus.NOT_STARTED, x=0, y=0, facing='S', executed_commands=""):
+        self.id = id
+        self.commands = commands
+        self.status = status
+        self.x = x
+        self.y = y
+        self.facing = facing
+        self._executed = executed_commands  # A string, or parts still to be joined
+        self.path = None  # Trajectory since it was last started, if it moved in this process
+
+    @property
+    def executed_commands(self):
+        if not isinstance(self._executed, str):
+            self._executed = "".join(self._executed)
+        return self._executed
+
+    @executed_commands.setter
+    def executed_commands(self, commands):
+        self._executed = commands
+
+    def add_executed(self, commands):
+        """Appends to executed_commands without copying it; the parts are joined when it is next read."""
+        if isinstance(self._executed, str):
+            self._executed = [self._executed]
+        self._executed.append(commands)
+
+    @classmethod
+    def from_json(cls, data):
+        position = data["position"]
+        return cls(data["id"], data["commands"], RoverStatus(data["status"]),
+                   position["x"], position["y"], position["facing"], data["executed_commands"])
+
+    def follow(self, commands, width, height):
+        """Adds executed commands to the rover's path, unless it was last moved by another worker."""
+        if self.path is not None:
+            self.path.follow(commands, width, height)
+
+    def place(self, x, y, facing):
+        self.x = x
+        self.y = y
+        self.facing = facing
+
+    def position_json(self):
+        return {"x": self.x, "y": self.y, "facing": self.facing}
+
+    def to_json(self):
+        """The rover as a Rover model would dump it in JSON mode.
+
+        Changes nothing, so the journal's writer thread may call it on a live rover.
+        """
+        executed = self._executed
+        if not isinstance(executed, str):
+            executed = "".join(executed)
+        return {"commands": self.commands, "id": self.id, "status": self.status.value,
+                "position": {"x": self.x, "y": self.y, "facing": self.facing}, "executed_commands": executed}
+
 class MapDimensions(BaseModel):
     height: int
     width: int
 
+class BatchDispatchRequest(BaseModel):
+    rover_ids: Optional[List[int]] = None  # Dispatched in this order
+    all_not_started: bool = False  # Dispatch every NOT_STARTED rover, in ID order
+
+class SimulationRequest(BaseModel):
+    commands: str
+    position: Optional[RoverPosition] = None  # Defaults to a dispatched rover's start, (0, 0) facing S
+
+class SimulationResult(BaseModel):
+    position: RoverPosition
+    executed_commands: str
+    status: RoverStatus  # FINISHED or ELIMINATED
+    disarmed_mines: List[Mine]
+
+# Every non-zero cell becomes b'1' when the grid is written out as JSON
+_CELL_DIGITS = b'0' + b'1' * 255
+
+class Grid:
+    """Map cells stored one byte per cell in a flat, row-major bytearray."""
+
+    sparse = False
+
+    def __init__(self, height, width):
+        self.height = height
+        self.width = width
+        self.cells = bytearray(height * width)
+
+    def get(self, x, y):
+        return self.cells[y * self.width + x]
+
+    def set(self, x, y, value):
+        self.cells[y * self.width + x] = value
+
+    def fill(self, xs, ys):
+        """Marks the cells at the coordinates in two NumPy arrays, in one vectorized write."""
+        np.frombuffer(self.cells, dtype=np.uint8)[ys * self.width + xs] = 1
+
+    def occupied(self):
+        return len(self.cells) - self.cells.count(0)
+
+    def occupied_runs(self):
+        """Yields (offset, length) of each run of occupied cells, offsets in row-major order."""
+        for match in re.finditer(rb'[^\x00]+', self.cells):
+            yield match.start(), match.end() - match.start()
+
+    def packed_bits(self):
+        """One bit per cell, row-major, most significant bit first."""
+        digits = self.cells.translate(_CELL_DIGITS) + b'0' * (-len(self.cells) % 8)
+        return int(digits, 2).to_bytes(len(digits) // 8, 'big')
+
+    def window(self, x, y, width, height):
+        """Copies a rectangle (inside the map) into a new dense grid, one row slice at a time."""
+        window = Grid(height, width)
+        for row in range(height):
+            start = (y + row) * self.width + x
+            window.cells[row * width:(row + 1) * width] = self.cells[start:start + width]
+        return window
+
+    def iter_json_rows(self):
+        """Yields each row as a JSON array, encoded straight from the byte buffer."""
+        w = self.width
+        row = _json_row_template(w)
+        for y in range(self.height):
+            row[1::2] = self.cells[y * w:(y + 1) * w].translate(_CELL_DIGITS)
+            yield bytes(row)
+
+    def to_json(self):
+        return b'[' + b','.join(self.iter_json_rows()) + b']'
+
+class SparseGrid:
+    """Map cells stored as occupied coordinates only, for huge maps with few mines.
+
+    Same interface as Grid. Memory and resize cost depend on the number of
+    mines, not on the map size; dense rows are only built when asked for.
+    """
+
+    sparse = True
+
+    def __init__(self, height, width, occupied=()):
+        self.height = height
+        self.width = width
+        self.rows = {}  # y -> set of x with a non-zero cell
+        for x, y in occupied:
+            self.rows.setdefault(y, set()).add(x)
+
+    def get(self, x, y):
+        row = self.rows.get(y)
+        return 1 if row is not None and x in row else 0
+
+    def set(self, x, y, value):
+        if value:
+            self.rows.setdefault(y, set()).add(x)
+        else:
+            row = self.rows.get(y)
+            if row is not None:
+                row.discard(x)
+                if not row:
+                    del self.rows[y]
+
+    def fill(self, xs, ys):
+        for x, y in zip(xs.tolist(), ys.tolist()):
+            self.rows.setdefault(y, set()).add(x)
+
+    def occupied(self):
+        return sum(len(row) for row in self.rows.values())
+
+    def occupied_runs(self):
+        w = self.width
+        start = length = None
+        for y in sorted(self.rows):
+            for x in sorted(self.rows[y]):
+                offset = y * w + x
+                if start is not None and offset == start + length:
+                    length += 1
+                    continue
+                if start is not None:
+                    yield start, length
+                start, length = offset, 1
+        if start is not None:
+            yield start, length
+
+    def packed_bits(self):
+        bits = bytearray((self.height * self.width + 7) // 8)
+        for start, length in self.occupied_runs():
+            for offset in range(start, start + length):
+                bits[offset >> 3] |= 0x80 >> (offset & 7)
+        return bytes(bits)
+
+    def window(self, x, y, width, height):
+        window = Grid(height, width)
+        for row in range(height):
+            for cx in self.rows.get(y + row, ()):
+                if x <= cx < x + width:
+                    window.set(cx - x, row, 1)
+        return window
+
+    def iter_json_rows(self):
+        w = self.width
+        row = _json_row_template(w)
+        row[1::2] = b'0' * w
+        empty = bytes(row)
+        for y in range(self.height):
+            xs = self.rows.get(y)
+            if not xs:
+                yield empty
+                continue
+            xs = tuple(xs)  # The map may change while a response is streaming
+            for x in xs:
+                row[1 + 2 * x] = ord('1')
+            yield bytes(row)
+            for x in xs:
+                row[1 + 2 * x] = ord('0')
+
+    def to_json(self):
+        return b'[' + b','.join(self.iter_json_rows()) + b']'
+
+def _json_row_template(width):
+    """A reusable "[d,d,...,d]" buffer; digits go at the odd offsets."""
+    if width == 0:
+        return bytearray(b'[]')
+    row = bytearray(b',') * (2 * width + 1)
+    row[0] = ord('[')
+    row[-1] = ord(']')
+    return row
+
+# Binary map encoding (GET /map with Accept: application/octet-stream).
+# Header, little-endian: magic b"RVMP", format version, encoding, reserved uint16,
+# uint32 height, uint32 width, uint64 map version. Then, for MAP_ENCODING_BITS,
+# one bit per cell (row-major, most significant bit first, 1 = mine); for
+# MAP_ENCODING_RUNS, LEB128 varints giving alternating run lengths of empty and
+# occupied cells, starting with empty, that add up to height * width.
+MAP_FORMAT_MAGIC = b"RVMP"
+MAP_FORMAT_VERSION = 1
+MAP_ENCODING_BITS = 1
+MAP_ENCODING_RUNS = 2
+_MAP_HEADER = struct.Struct('<4sBBHIIQ')
+
+def _append_varint(out, n):
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+def encode_map(grid, encoding, version):
+    out = bytearray(_MAP_HEADER.pack(
+        MAP_FORMAT_MAGIC, MAP_FORMAT_VERSION, encoding, 0, grid.height, grid.width, version))
+    if encoding == MAP_ENCODING_BITS:
+        out += grid.packed_bits()
+        return bytes(out)
+    position = 0
+    for start, length in grid.occupied_runs():
+        _append_varint(out, start - position)
+        _append_varint(out, length)
+        position = start + length
+    _append_varint(out, grid.height * grid.width - position)
+    return bytes(out)
+
+def make_grid(height, width, occupied=()):
+    """Creates the grid backend for a map of this size according to MAP_MODE."""
+    if MAP_MODE == "sparse" or (MAP_MODE == "auto" and height * width > DENSE_MAP_MAX_CELLS):
+        return SparseGrid(height, width, occupied)
+    grid = Grid(height, width)
+    for x, y in occupied:
+        grid.set(x, y, 1)
+    return grid
+
+def _sorted_lines(keys, values, ids=None):
+    """Groups values by key into {key: sorted list of values}, vectorized.
+
+    Given ids too, also returns {key: ids in the same order as that key's values}. The
+    lines are int64 arrays, cut from one buffer without making an int object per value.
+    """
+    if not len(keys):
+        return {}, {}
+    # Coordinates are non-negative, so one sort of a combined key orders by key, then value
+    order = np.argsort(keys * (int(values.max()) + 1) + values)
+    keys = keys[order]
+    ends = (np.flatnonzero(np.diff(keys)) + 1).tolist() + [len(keys)]
+    spans = list(zip([0] + ends[:-1], ends))
+    line_keys = keys[[start for start, _ in spans]].tolist()
+
+    def cut(column):
+        data = column[order].tobytes()
+        return dict(zip(line_keys, [array('q', data[8 * start:8 * end]) for start, end in spans]))
+
+    return cut(values), (cut(ids) if ids is not None else None)
+
+def _insert_id(ids, new_id):
+    # New IDs are almost always the largest yet
+    if not ids or new_id > ids[-1]:
+        ids.append(new_id)
+    else:
+        bisect.insort(ids, new_id)
+
+def _remove_id(ids, old_id):
+    del ids[bisect.bisect_left(ids, old_id)]
+
 # In-memory data storage
 class DataStore:
-    def __init__(self):
+    def __init__(self, check_consistency=CHECK_CONSISTENCY):
         self.map_height = 10
         self.map_width = 10
-        self.grid = [[0 for _ in range(self.map_width)] for _ in range(self.map_height)]
-        self.mines = {}  # id -> Mine
-        self.rovers = {}  # id -> Rover
+        self.grid = make_grid(self.map_height, self.map_width)
+        self.mines = MineTable()
+        # int64 arrays, kept sorted
+        self.mine_rows = {}  # y -> sorted x of the mines in that row
+        self.mine_row_ids = {}  # y -> IDs of the mines in that row, in the same order
+        self.mine_cols = {}  # x -> sorted y of the mines in that column
+        self.rovers = {}  # id -> RoverRecord
+        # Sorted IDs, so a page of GET /mines or /rovers starts with a bisect instead of a scan
+        self.mine_ids = []
+        self.rover_ids = []
         self.next_mine_id = 1
         self.next_rover_id = 1
+        self.check_consistency = check_consistency
+        # Bumped by every change to the map; with the epoch it identifies one state of the world
+        self.map_version = 0
+        self.map_epoch = uuid.uuid4().hex[:8]
+        self.tile_versions = {}  # (tx, ty) -> map version of the last change inside that tile
+        self.layout_version = 0  # Map version of the last resize, which changes every tile
+        # Ring buffer of (version, kind, ...) change events; older ones fall off the end
+        self.map_changes = deque(maxlen=MAP_CHANGE_LOG_SIZE)
+        self.changes_floor = 0  # Oldest version a client can still catch up from
+        # Bumped by every change to any mine (serial numbers included) and to any rover
+        self.mines_version = 0
+        self.rovers_version = 0
+        self.backend = None  # SQLiteJournal when several workers share the world, FileJournal to keep it on disk
+        self.rover_listener = None  # Called with the ID of every rover saved or deleted
+
+    def attach(self, backend):
+        self.backend = backend
+        backend.open(self)
+
+    def detach(self):
+        if self.backend is not None:
+            self.backend.close()
+            self.backend = None
+
+    def sync(self):
+        """Catches up with changes other workers made; called whenever the store is consistent."""
+        if self.backend is not None:
+            self.backend.sync(self)
+
+    def transaction(self):
+        """Makes a read-modify-write atomic across workers: syncs first, publishes on exit.
+
+        Nothing inside may await, and errors should be raised before anything is changed.
+        """
+        if self.backend is None:
+            return nullcontext()
+        return self.backend.transaction(self)
+
+    def _record(self, *op):
+        if self.backend is not None:
+            self.backend.record(op)
+
+    def apply_op(self, op):
+        """Replays an op recorded by another worker."""
+        kind = op[0]
+        if kind == "add_mine":
+            self.add_mine(MineRecord(op[1], op[2], op[3], op[4]))
+        elif kind == "add_mines":
+            self.add_mines([MineRecord(*mine) for mine in op[1]])
+        elif kind == "clear_mines":
+            self.clear_mines()
+        elif kind == "move_mine":
+            self.move_mine(op[1], op[2], op[3])
+        elif kind == "serial":
+            self.set_mine_serial(op[1], op[2])
+        elif kind == "remove_mine":
+            self.remove_mine(op[1])
+        elif kind == "resize":
+            self.resize(op[1], op[2])
+        elif kind == "rover":
+            self._put_rover(op[1])
+        elif kind == "rovers":
+            for data in op[1]:
+                self._put_rover(data)
+        elif kind == "rover_pose":
+            rover = self.rovers.get(op[1])
+            if rover is not None:
+                rover.place(op[2], op[3], op[4])
+                rover.status = RoverStatus(op[5])
+                rover.path = None  # Moved by another worker
+                self.save_rover(rover)
+        elif kind == "delete_rover":
+            self.delete_rover(op[1])
+
+    def snapshot(self, columns=False, live_rovers=False):
+        """The whole world as plain data, for load_snapshot; columns gives mines as mine_columns.
+
+        live_rovers leaves "rovers" as the RoverRecords themselves, for a caller that dumps
+        them later, off the event loop. Such a dump may show changes made after the snapshot,
+        but each of those is also recorded as an op that sets the fields it changed, so
+        replaying the ops after it still ends in the right world.
+        """
+        rovers = list(self.rovers.values())
+        state = {
+            "height": self.map_height,
+            "width": self.map_width,
+            "map_version": self.map_version,
+            "next_mine_id": self.next_mine_id,
+            "next_rover_id": self.next_rover_id,
+            "rovers": rovers if live_rovers else [r.to_json() for r in rovers],
+        }
+        if columns:
+            state["mine_columns"] = self.mines.columns()
+        else:
+            state["mines"] = [list(mine) for mine in zip(self.mines.ids, self.mines.xs, self.mines.ys, self.mines.serials)]
+        return state
+
+    def load_snapshot(self, state):
+        """Replaces the world with a snapshot; change history before it is gone, so clients resync.
+
+        Mines come as snapshot()'s rows, or as four columns (ids, xs, ys, serials) under
+        "mine_columns", which loads faster.
+        """
+        self.map_height = state["height"]
+        self.map_width = state["width"]
+        if "mine_columns" in state:
+            ids, xs, ys, serials = state["mine_columns"]
+        else:
+            ids, xs, ys, serials = [list(column) for column in zip(*state["mines"])] or [[], [], [], []]
+        self.mines = MineTable(ids, xs, ys, serials)
+        self.mine_ids = np.sort(np.array(self.mines.ids, dtype=np.int64)).tolist()
+        self.mines_version += 1
+        self._rebuild_map()
+        kept = {data["id"] for data in state["rovers"]}
+        for rover_id in [rover_id for rover_id in self.rovers if rover_id not in kept]:
+            self.delete_rover(rover_id)
+        for data in state["rovers"]:
+            self._put_rover(data)
+        self.next_mine_id = state["next_mine_id"]
+        self.next_rover_id = state["next_rover_id"]
+        self.map_version = state["map_version"]
+        self.tile_versions.clear()
+        self.layout_version = self.map_version
+        self.map_changes.clear()
+        self.changes_floor = self.map_version
+        if self.check_consistency:
+            self.verify_consistency()
 
     def get_grid(self):
-        return [row[:] for row in self.grid]  # Create a deep copy
+        return self.grid  # Shared, not copied: read it, mutate through DataStore methods
 
     def update_grid_for_mine(self, mine_id, old_x=None, old_y=None):
         mine = self.mines.get(mine_id)
@@ -80,27 +936,304 @@ class DataStore:
             # Clear old position if provided
             if old_x is not None and old_y is not None:
                 if 0 <= old_x < self.map_width and 0 <= old_y < self.map_height:
-                    self.grid[old_y][old_x] = 0
+                    self.grid.set(old_x, old_y, 0)
             
             # Set new position
             if 0 <= mine.x < self.map_width and 0 <= mine.y < self.map_height:
-                self.grid[mine.y][mine.x] = 1
+                self.grid.set(mine.x, mine.y, 1)
 
     def is_valid_position(self, x, y):
         return 0 <= x < self.map_width and 0 <= y < self.map_height
 
-    def find_pin(self, serial):
-        """Computes a PIN for the mine using a brute-force search on SHA256 hashes."""
-        pin = 0
-        while True:
-            temp_key = serial + str(pin)
-            hash_hex = hashlib.sha256(temp_key.encode()).hexdigest()
-            if hash_hex.startswith('000000'):
-                return pin
-            pin += 1
-            # Limiting search to prevent infinite loops
-            if pin > 100000:
-                return pin - 1
+    def mine_id_at(self, x, y):
+        row = self.mine_rows.get(y)
+        if row:
+            i = bisect.bisect_left(row, x)
+            if i < len(row) and row[i] == x:
+                return self.mine_row_ids[y][i]
+        return None
+
+    def mine_ids_in(self, x0, y0, x1, y1, most=None):
+        """IDs of the mines inside the box (inclusive), sorted: a bisect per row, not a scan of all mines.
+
+        None if there are more than most of them.
+        """
+        if y1 - y0 < len(self.mine_rows):
+            rows = [y for y in range(max(y0, 0), y1 + 1) if y in self.mine_rows]
+        else:
+            rows = [y for y in self.mine_rows if y0 <= y <= y1]
+        spans = []
+        count = 0
+        for y in rows:
+            row = self.mine_rows[y]
+            start, stop = bisect.bisect_left(row, x0), bisect.bisect_right(row, x1)
+            if start < stop:
+                spans.append((y, start, stop))
+                count += stop - start
+        if most is not None and count > most:
+            return None
+        ids = []
+        for y, start, stop in spans:
+            ids.extend(self.mine_row_ids[y][start:stop])
+        ids.sort()
+        return ids
+
+    def next_mine(self, x, y, dx, dy, limit, removed=()):
+        """Returns how many cells ahead of (x, y) the first mine in direction (dx, dy) is.
+
+        Only the next limit cells are searched, and positions in removed are skipped;
+        None if there is no such mine.
+        """
+        if dx:
+            line, pos, step = self.mine_rows.get(y), x, dx
+        else:
+            line, pos, step = self.mine_cols.get(x), y, dy
+        if not line:
+            return None
+        if step > 0:
+            i = bisect.bisect_right(line, pos)
+            while i < len(line) and line[i] - pos <= limit:
+                if ((line[i], y) if dx else (x, line[i])) not in removed:
+                    return line[i] - pos
+                i += 1
+        else:
+            i = bisect.bisect_left(line, pos) - 1
+            while i >= 0 and pos - line[i] <= limit:
+                if ((line[i], y) if dx else (x, line[i])) not in removed:
+                    return pos - line[i]
+                i -= 1
+        return None
+
+    def _index_mine(self, x, y, mine_id):
+        row = self.mine_rows.setdefault(y, array('q'))
+        i = bisect.bisect_left(row, x)
+        row.insert(i, x)
+        self.mine_row_ids.setdefault(y, array('q')).insert(i, mine_id)
+        bisect.insort(self.mine_cols.setdefault(x, array('q')), y)
+
+    def _unindex_mine(self, x, y):
+        row = self.mine_rows[y]
+        i = bisect.bisect_left(row, x)
+        del row[i]
+        del self.mine_row_ids[y][i]
+        if not row:
+            del self.mine_rows[y], self.mine_row_ids[y]
+        col = self.mine_cols[x]
+        del col[bisect.bisect_left(col, y)]
+        if not col:
+            del self.mine_cols[x]
+
+    def add_mine(self, mine):
+        self.mines.add(mine)
+        _insert_id(self.mine_ids, mine.id)
+        self.next_mine_id = max(self.next_mine_id, mine.id + 1)
+        self._index_mine(mine.x, mine.y, mine.id)
+        self.mines_version += 1
+        self._record("add_mine", mine.id, mine.x, mine.y, mine.serial_number)
+        self.update_grid_for_mine(mine.id)
+        self._map_changed((mine.x, mine.y, 1))
+
+    def add_mines(self, mines):
+        """Adds many mines at once: the indexes and grid are rebuilt once, and the map version bumps once."""
+        for mine in mines:
+            self.mines.add(mine)
+            _insert_id(self.mine_ids, mine.id)
+            self.next_mine_id = max(self.next_mine_id, mine.id + 1)
+        self.mines_version += 1
+        self._record("add_mines", [[m.id, m.x, m.y, m.serial_number] for m in mines])
+        self._rebuild_map()
+        self._cells_changed([(m.x, m.y, 1) for m in mines])
+
+    def clear_mines(self):
+        cells = [(x, y, 0) for x, y in zip(self.mines.xs, self.mines.ys)]
+        self.mines = MineTable()
+        self.mine_ids = []
+        self.mines_version += 1
+        self._record("clear_mines")
+        self._rebuild_map()
+        self._cells_changed(cells)
+
+    def move_mine(self, mine_id, x, y):
+        mine = self.mines[mine_id]
+        old_x, old_y = mine.x, mine.y
+        if (x, y) == (old_x, old_y):
+            return
+        self._unindex_mine(old_x, old_y)
+        self.mines.move(mine_id, x, y)
+        self._index_mine(x, y, mine_id)
+        self.mines_version += 1
+        self._record("move_mine", mine_id, x, y)
+        self.update_grid_for_mine(mine_id, old_x, old_y)
+        self._map_changed((old_x, old_y, 0), (x, y, 1))
+
+    def remove_mine(self, mine_id):
+        mine = self.mines.remove(mine_id)
+        _remove_id(self.mine_ids, mine_id)
+        self._unindex_mine(mine.x, mine.y)
+        self.mines_version += 1
+        self._record("remove_mine", mine_id)
+        if self.is_valid_position(mine.x, mine.y):
+            self.grid.set(mine.x, mine.y, 0)
+        self._map_changed((mine.x, mine.y, 0))
+        return mine
+
+    def set_mine_serial(self, mine_id, serial):
+        self.mines.set_serial(mine_id, serial)
+        self.mines_version += 1
+        self._record("serial", mine_id, serial)
+
+    def save_rover(self, rover, pose_only=False):
+        """Stores a new or changed rover; call after every change to one.
+
+        pose_only shares just the position and status with other workers, which
+        saves copying long command strings on every step.
+        """
+        if rover.id not in self.rovers:
+            _insert_id(self.rover_ids, rover.id)
+        self.rovers[rover.id] = rover
+        self.next_rover_id = max(self.next_rover_id, rover.id + 1)
+        self.rovers_version += 1
+        if self.backend is not None:
+            if pose_only:
+                self._record("rover_pose", rover.id, rover.x, rover.y, rover.facing, rover.status.value)
+            else:
+                self._record("rover", rover.to_json())
+        if self.rover_listener is not None:
+            self.rover_listener(rover.id)
+
+    def save_rovers(self, rovers):
+        """Stores many new or changed rovers, shared with other workers as one op."""
+        for rover in rovers:
+            if rover.id not in self.rovers:
+                _insert_id(self.rover_ids, rover.id)
+            self.rovers[rover.id] = rover
+            self.next_rover_id = max(self.next_rover_id, rover.id + 1)
+        self.rovers_version += 1
+        if self.backend is not None:
+            self._record("rovers", [rover.to_json() for rover in rovers])
+        if self.rover_listener is not None:
+            for rover in rovers:
+                self.rover_listener(rover.id)
+
+    def delete_rover(self, rover_id):
+        del self.rovers[rover_id]
+        _remove_id(self.rover_ids, rover_id)
+        self.rovers_version += 1
+        self._record("delete_rover", rover_id)
+        if self.rover_listener is not None:
+            self.rover_listener(rover_id)
+
+    def _put_rover(self, data):
+        # Updated in place, so code holding the rover (the scheduler, a WebSocket session) sees it
+        rover = self.rovers.get(data["id"])
+        if rover is None:
+            self.save_rover(RoverRecord.from_json(data))
+            return
+        position = data["position"]
+        rover.commands = data["commands"]
+        rover.status = RoverStatus(data["status"])
+        rover.place(position["x"], position["y"], position["facing"])
+        rover.executed_commands = data["executed_commands"]
+        rover.path = None
+        self.save_rover(rover)
+
+    def resize(self, height, width):
+        self.map_height = height
+        self.map_width = width
+
+        # Drop mines that are no longer within the grid
+        mines = self.mines
+        for mine_id in [mine_id for mine_id, x, y in zip(mines.ids, mines.xs, mines.ys)
+                        if not self.is_valid_position(x, y)]:
+            mines.remove(mine_id)
+        self.mine_ids = sorted(self.mines.ids)
+
+        self.mines_version += 1
+        self._record("resize", height, width)
+        self._rebuild_map()
+        self._map_changed()
+        self.tile_versions.clear()
+        self.layout_version = self.map_version
+        # Pruned mines need no events of their own: they are outside the new bounds
+        self._log_change((self.map_version, "resize", height, width))
+
+    def _rebuild_map(self):
+        # The grid's cells are exactly the mine positions, so it is rebuilt from the columns:
+        # O(mines) for a sparse grid, one allocation plus O(mines) for a dense one
+        xs = np.array(self.mines.xs, dtype=np.int64)
+        ys = np.array(self.mines.ys, dtype=np.int64)
+        self.grid = make_grid(self.map_height, self.map_width)
+        self.grid.fill(xs, ys)
+        self.mine_rows, self.mine_row_ids = _sorted_lines(ys, xs, np.array(self.mines.ids, dtype=np.int64))
+        self.mine_cols, _ = _sorted_lines(xs, ys)
+
+    def map_etag(self):
+        return f'"{self.map_epoch}-{self.map_version}"'
+
+    def tile_version(self, tx, ty):
+        return max(self.tile_versions.get((tx, ty), 0), self.layout_version)
+
+    def tile_etag(self, tx, ty):
+        return f'"{self.map_epoch}-t{self.tile_version(tx, ty)}"'
+
+    def changes_since(self, version):
+        """Returns the change events after version, or None if some have already been dropped."""
+        if version < self.changes_floor or version > self.map_version:
+            return None
+        changes = []
+        for change in reversed(self.map_changes):
+            if change[0] <= version:
+                break
+            changes.append(change)
+        changes.reverse()
+        return changes
+
+    def _log_change(self, change):
+        if len(self.map_changes) == self.map_changes.maxlen:
+            # Clients that haven't seen the event about to be dropped must resync
+            self.changes_floor = self.map_changes[0][0]
+        self.map_changes.append(change)
+
+    def _map_changed(self, *cells):
+        """Bumps the map version after a change to the given (x, y, new value) cells."""
+        self.map_version += 1
+        for x, y, value in cells:
+            self.tile_versions[(x // MAP_TILE_SIZE, y // MAP_TILE_SIZE)] = self.map_version
+            self._log_change((self.map_version, "cell", x, y, value))
+        if self.check_consistency:
+            self.verify_consistency()
+
+    def _cells_changed(self, cells):
+        if len(cells) < self.map_changes.maxlen:
+            self._map_changed(*cells)
+            return
+        # More cells than the change log holds: like a resize, every tile changes and clients resync
+        self.map_version += 1
+        self.tile_versions.clear()
+        self.layout_version = self.map_version
+        self.map_changes.clear()
+        self.changes_floor = self.map_version
+        if self.check_consistency:
+            self.verify_consistency()
+
+    def verify_consistency(self):
+        """Raises AssertionError if mines, the position index and the grid disagree."""
+        assert self.mine_ids == sorted(self.mines), "mine ID index differs from mines"
+        assert self.mines.slots == {mine_id: i for i, mine_id in enumerate(self.mines.ids)}, "mine table index is off"
+        assert self.rover_ids == sorted(self.rovers), "rover ID index differs from rovers"
+        for mine_id, mine in self.mines.items():
+            assert self.mine_id_at(mine.x, mine.y) == mine_id, f"mine {mine_id} missing from position index"
+            assert self.is_valid_position(mine.x, mine.y), f"mine {mine_id} is outside the map"
+            assert self.grid.get(mine.x, mine.y) > 0, f"mine {mine_id} is not on the grid"
+        assert self.grid.occupied() == len(self.mines), "grid has cells without a mine"
+        rows = {(x, y) for y, xs in self.mine_rows.items() for x in xs}
+        cols = {(x, y) for x, ys in self.mine_cols.items() for y in ys}
+        assert rows == cols == set(zip(self.mines.xs, self.mines.ys)), "row or column index differs from mines"
+        assert sorted(i for ids in self.mine_row_ids.values() for i in ids) == self.mine_ids, "row IDs differ from mines"
+        assert all(len(self.mine_row_ids.get(y, ())) == len(xs) for y, xs in self.mine_rows.items()), \
+            "row IDs and row index differ"
+        assert all(list(xs) == sorted(xs) for xs in self.mine_rows.values()), "row index is not sorted"
+        assert all(list(ys) == sorted(ys) for ys in self.mine_cols.values()), "column index is not sorted"
 
 # Initialize data store
 db = DataStore()
@@ -114,208 +1247,1112 @@ direction_moves = {
     'W': (-1, 0),
 }
 
+# Command compiler: a command string becomes runs of turns, moves and digs
+_COMMAND_RUNS = re.compile(r'[LR]+|M+|D+')
+
+def compile_commands(commands):
+    """Yields (kind, count, start, end) for each run of commands in the string.
+
+    Turn runs have kind "T" and count the net quarter turns to the right; "M" and
+    "D" runs count their commands. start and end are the run's offsets in commands.
+    """
+    for match in _COMMAND_RUNS.finditer(commands):
+        run = match.group()
+        if run[0] in 'LR':
+            yield 'T', (run.count('R') - run.count('L')) % 4, match.start(), match.end()
+        else:
+            yield run[0], len(run), match.start(), match.end()
+
+class CommandRun:
+    """Outcome of run_commands."""
+
+    def __init__(self, x, y, facing, executed, exploded, disarmed):
+        self.x = x
+        self.y = y
+        self.facing = facing
+        self.executed = executed  # Number of commands executed
+        self.exploded = exploded
+        self.disarmed = disarmed  # IDs of the mines disarmed, in order
+
+class Trajectory:
+    """The cells a rover moved through since it was last started, as straight runs.
+
+    runs holds x, y, dx, dy, length for each run: length steps of (dx, dy) from (x, y).
+    Memory grows with the turns, not the steps. Executed commands are handed over with
+    follow() and only worked out when the path is read, from where the last read ended.
+    """
+    __slots__ = ("runs", "moves", "x", "y", "direction_idx", "pending")
+
+    def __init__(self, x=0, y=0, facing='S'):
+        self.runs = array('q', (x, y, 0, 0, 0))
+        self.moves = 0  # Cells moved; points are numbered 0 (the start) to moves
+        self.x = x
+        self.y = y
+        self.direction_idx = directions.index(facing)
+        self.pending = []  # [width, height, [commands, ...]] not worked out yet
+
+    def follow(self, commands, width, height):
+        """Adds executed commands; width and height are the size of the map they ran on."""
+        if not commands:
+            return
+        if self.pending and self.pending[-1][:2] == [width, height]:
+            self.pending[-1][2].append(commands)
+        else:
+            self.pending.append([width, height, [commands]])
+
+    def _catch_up(self):
+        # Only the map edges matter: the commands were executed, so no mine stopped them early
+        pending, self.pending = self.pending, []
+        runs = self.runs
+        x, y, direction_idx = self.x, self.y, self.direction_idx
+        for width, height, parts in pending:
+            for kind, count, _, _ in compile_commands("".join(parts)):
+                if kind == 'T':
+                    direction_idx = (direction_idx + count) % 4
+                    continue
+                if kind != 'M':
+                    continue
+                dx, dy = direction_moves[directions[direction_idx]]
+                if dx:
+                    room = width - 1 - x if dx > 0 else x
+                else:
+                    room = height - 1 - y if dy > 0 else y
+                steps = min(count, max(room, 0))
+                if not steps:
+                    continue
+                if not runs[-1]:  # Nothing moved yet
+                    runs[-3:] = array('q', (dx, dy, steps))
+                elif runs[-3] == dx and runs[-2] == dy:
+                    runs[-1] += steps
+                else:
+                    runs.extend((x, y, dx, dy, steps))
+                x += dx * steps
+                y += dy * steps
+                self.moves += steps
+        self.x, self.y, self.direction_idx = x, y, direction_idx
+
+    def length(self):
+        self._catch_up()
+        return self.moves
+
+    def points(self, start, stop, every):
+        """[x, y] of points start, start + every, ... up to stop (inclusive), and stop itself."""
+        self._catch_up()
+        wanted = range(start, stop + 1, every)
+        if not wanted:
+            return []
+        out = []
+        k = 0
+        base = 0  # Number of the point each run starts from
+        runs = self.runs
+        for r in range(0, len(runs), 5):
+            x, y, dx, dy, length = runs[r:r + 5]
+            while k < len(wanted) and wanted[k] <= base + length:
+                step = wanted[k] - base
+                out.append([x + dx * step, y + dy * step])
+                k += 1
+            base += length
+        if wanted[-1] != stop:
+            out.extend(self.points(stop, stop, 1))
+        return out
+
+def iter_commands(store, commands, x=0, y=0, facing='S', removed=None):
+    """Yields what a rover does with commands, one run at a time, without changing store.
+
+    Events are (kind, executed, x, y, detail) tuples, executed being the number of
+    commands run so far: "pose" after each turn or move run (detail is the facing),
+    "mine" when the rover stops on a mine and "disarm" when it disarms one (detail is
+    the mine ID), then "finished" or "exploded" (detail is the facing).
+
+    Each move run jumps straight to the first mine ahead or the map edge, so the cost
+    depends on the number of runs and mine encounters, not the string length. Positions
+    of the mines it disarms are added to removed, which later lookups skip.
+    """
+    removed = set() if removed is None else removed
+    direction_idx = directions.index(facing)
+    on_mine = False
+    for kind, count, start, end in compile_commands(commands):
+        if kind == 'T':
+            direction_idx = (direction_idx + count) % 4
+            yield 'pose', end, x, y, directions[direction_idx]
+        elif kind == 'M':
+            # Moving off an active mine without disarming it is fatal
+            if on_mine:
+                yield 'exploded', start, x, y, directions[direction_idx]
+                return
+            dx, dy = direction_moves[directions[direction_idx]]
+            # Moves past the edge are ignored, so the rover goes at most this far
+            if dx:
+                room = store.map_width - 1 - x if dx > 0 else x
+            else:
+                room = store.map_height - 1 - y if dy > 0 else y
+            steps = min(count, max(room, 0))
+            hit = store.next_mine(x, y, dx, dy, steps, removed)
+            if hit is not None:
+                x += dx * hit
+                y += dy * hit
+                on_mine = True
+                yield 'mine', start + hit, x, y, store.mine_id_at(x, y)
+                if count > hit:
+                    yield 'exploded', start + hit, x, y, directions[direction_idx]
+                    return
+            else:
+                x += dx * steps
+                y += dy * steps
+            yield 'pose', end, x, y, directions[direction_idx]
+        elif kind == 'D' and on_mine:
+            on_mine = False
+            # Another request may have removed the mine while a streamed run was paused
+            mine_id = store.mine_id_at(x, y)
+            if mine_id is not None:
+                removed.add((x, y))
+                yield 'disarm', start + 1, x, y, mine_id
+    yield 'finished', len(commands), x, y, directions[direction_idx]
+
+def run_commands(store, commands, x=0, y=0, facing='S', removed=None):
+    """Runs iter_commands to the end and sums it up as a CommandRun."""
+    disarmed = []
+    for kind, executed, x, y, detail in iter_commands(store, commands, x, y, facing, removed):
+        if kind == 'disarm':
+            disarmed.append(detail)
+    return CommandRun(x, y, detail, executed, kind == 'exploded', disarmed)
+
+class SimulationCache:
+    """LRU of run_commands results for one map version; any change to the map empties it."""
+
+    def __init__(self, store, max_entries):
+        self.store = store
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # (commands, x, y, facing) -> CommandRun
+        self.version = None
+
+    def run(self, commands, x, y, facing):
+        if self.version != (self.store.map_epoch, self.store.map_version):
+            self.entries.clear()
+            self.version = (self.store.map_epoch, self.store.map_version)
+        key = (commands, x, y, facing)
+        result = self.entries.get(key)
+        if result is not None:
+            self.entries.move_to_end(key)
+            return result
+        result = run_commands(self.store, commands, x, y, facing)
+        if self.max_entries > 0:
+            self.entries[key] = result
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return result
+
+simulation_cache = SimulationCache(db, SIMULATION_CACHE_SIZE)
+
+def run_in_order(store, programs):
+    """run_commands for each program from the dispatch start, as if each rover were dispatched
+    after the one before it: mines disarmed by earlier rovers are gone for later ones.
+
+    Only reads store; the CommandRuns say what to apply.
+    """
+    removed = set()
+    return [run_commands(store, commands, removed=removed) for commands in programs]
+
+def _change_event(change):
+    """JSON form of a DataStore change log entry."""
+    if change[1] == "cell":
+        version, kind, x, y, value = change
+        return {"version": version, "type": kind, "x": x, "y": y, "value": value}
+    version, kind, height, width = change
+    return {"version": version, "type": kind, "height": height, "width": width}
+
+def _spectator_rover(rover):
+    # executed_commands can be megabytes long, spectators get its length
+    return {
+        "id": rover.id,
+        "status": rover.status.value,
+        "position": rover.position_json(),
+        "executed": len(rover.executed_commands),
+    }
+
+class SpectatorSubscriber:
+    """One watcher's pending update: updates it hasn't taken yet are merged, never queued."""
+
+    def __init__(self):
+        self.update = None
+        self.text = None  # The hub's serialized update, while it's the only one pending
+        self.ready = asyncio.Event()
+
+    def push(self, update, text):
+        if self.update is None:
+            self.update, self.text = update, text
+        else:
+            self.update = _merge_spectator_updates(self.update, update)
+            self.text = None
+        self.ready.set()
+
+    async def next(self):
+        """Waits for the next update and returns it as JSON text."""
+        await self.ready.wait()
+        self.ready.clear()
+        update, text = self.update, self.text
+        self.update = self.text = None
+        return text if text is not None else _spectator_update_json(update)
+
+def _merge_spectator_updates(old, new):
+    """Folds two consecutive updates into one that has the same effect."""
+    resync = old["resync"] or new["resync"] or len(old["changes"]) + len(new["changes"]) > SPECTATOR_MAX_CHANGES
+    rovers = {rover_id: data for rover_id, data in old["rovers"].items() if rover_id not in new["removed"]}
+    rovers.update(new["rovers"])
+    return {
+        "epoch": new["epoch"],
+        "version": new["version"],
+        "resync": resync,
+        "changes": [] if resync else old["changes"] + new["changes"],
+        "rovers": rovers,
+        "removed": (old["removed"] - new["rovers"].keys()) | new["removed"],
+    }
+
+def _spectator_update_json(update):
+    return json.dumps({
+        "type": "update",
+        "epoch": update["epoch"],
+        "version": update["version"],
+        "resync": update["resync"],
+        "changes": update["changes"],
+        "rovers": list(update["rovers"].values()),
+        "removed": sorted(update["removed"]),
+    })
+
+class SpectatorHub:
+    """Fans rover and map changes out to spectator WebSockets, at most once per tick.
+
+    Map changes come from the DataStore change log; rover changes are flagged with
+    rover_changed. Each tick they are built and serialized once for all subscribers.
+    """
+
+    def __init__(self, store, tick):
+        self.store = store
+        self.tick = tick
+        self.subscribers = set()
+        self.dirty_rovers = set()  # IDs of rovers changed since the last tick
+        self.version = 0  # Map version of the last tick
+        self.task = None
+        self.errors = 0  # Ticks that raised
+
+    def start(self):
+        self.version = self.store.map_version
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def subscribe(self):
+        subscriber = SpectatorSubscriber()
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+
+    def rover_changed(self, rover_id):
+        if self.subscribers:
+            self.dirty_rovers.add(rover_id)
+
+    def snapshot(self):
+        """Full state for a new subscriber; the map itself is fetched with GET /map."""
+        store = self.store
+        return {
+            "type": "snapshot",
+            "epoch": store.map_epoch,
+            "version": store.map_version,
+            "height": store.map_height,
+            "width": store.map_width,
+            "rovers": [_spectator_rover(rover) for rover in store.rovers.values()],
+        }
+
+    def publish(self):
+        store = self.store
+        version, self.version = self.version, store.map_version
+        dirty, self.dirty_rovers = self.dirty_rovers, set()
+        if not self.subscribers or (version == store.map_version and not dirty):
+            return
+        changes = store.changes_since(version)
+        if changes is not None and len(changes) > SPECTATOR_MAX_CHANGES:
+            changes = None
+        rovers = {}
+        removed = set()
+        for rover_id in dirty:
+            rover = store.rovers.get(rover_id)
+            if rover is None:
+                removed.add(rover_id)
+            else:
+                rovers[rover_id] = _spectator_rover(rover)
+        update = {
+            "epoch": store.map_epoch,
+            "version": store.map_version,
+            "resync": changes is None,
+            "changes": [_change_event(change) for change in changes or ()],
+            "rovers": rovers,
+            "removed": removed,
+        }
+        text = _spectator_update_json(update)
+        for subscriber in self.subscribers:
+            subscriber.push(update, text)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                self.store.sync()  # Picks up changes made by other workers
+                self.publish()
+            except Exception:
+                # One bad tick (say the shared database was locked) mustn't stop the feed
+                self.errors += 1
+                print("Spectator tick failed:")
+                traceback.print_exc()
+
+spectators = SpectatorHub(db, SPECTATOR_TICK_MS / 1000)
+
+class ScheduledRover:
+    """An enqueued rover's progress through its commands, with dispatch semantics."""
+
+    def __init__(self, rover):
+        self.rover = rover
+        self.offset = 0  # Commands executed so far
+        self.x = 0
+        self.y = 0
+        self.direction_idx = 2  # Start facing South
+        self.on_mine = False
+        self.exploded = False
+
+    def advance(self, store, steps):
+        """Runs up to steps commands and returns the mines disarmed on the way."""
+        commands = self.rover.commands
+        disarmed = []
+        offset = self.offset
+        for cmd in commands[self.offset:self.offset + steps]:
+            if cmd == 'L':
+                self.direction_idx = (self.direction_idx - 1) % 4
+            elif cmd == 'R':
+                self.direction_idx = (self.direction_idx + 1) % 4
+            elif cmd == 'M':
+                # If we are on an active mine and try to move without disarming it, we explode
+                if self.on_mine:
+                    self.exploded = True
+                    break
+                dx, dy = direction_moves[directions[self.direction_idx]]
+                if store.is_valid_position(self.x + dx, self.y + dy):
+                    self.x += dx
+                    self.y += dy
+                    self.on_mine = store.mine_id_at(self.x, self.y) is not None
+            elif cmd == 'D' and self.on_mine:
+                mine_id = store.mine_id_at(self.x, self.y)
+                if mine_id is not None:
+                    disarmed.append(store.remove_mine(mine_id))
+                self.on_mine = False
+            self.offset += 1
+        self.rover.place(self.x, self.y, directions[self.direction_idx])
+        self.rover.follow(commands[offset:self.offset], store.map_width, store.map_height)
+        return disarmed
+
+    @property
+    def done(self):
+        return self.exploded or self.offset >= len(self.rover.commands)
+
+class RoverScheduler:
+    """Advances every enqueued rover on a shared clock, one batch of steps per tick.
+
+    A tick stops early once it has used up its time budget; the rovers it didn't
+    reach are first in line next tick. Ticks that start more than a whole interval
+    late are skipped rather than run back to back.
+    """
+
+    def __init__(self, store, tick, steps, budget):
+        self.store = store
+        self.tick = tick
+        self.steps = steps
+        self.budget = budget
+        self.queue = deque()  # ScheduledRover, in the order they're advanced
+        self.task = None
+        self.ticks = 0
+        self.overruns = 0  # Ticks that hit the budget
+        self.skipped = 0  # Ticks dropped because the loop fell a whole interval behind
+        self.deferred = 0  # Rover advances postponed to the next tick by the budget
+        self.errors = 0  # Ticks and rover advances that raised
+        self.last_tick = 0.0
+        self.max_tick = 0.0
+        self.total_tick = 0.0
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def enqueue(self, rover):
+        rover.status = RoverStatus.MOVING
+        rover.place(0, 0, 'S')
+        rover.executed_commands = ""
+        rover.path = Trajectory()
+        self.queue.append(ScheduledRover(rover))
+        self.store.save_rover(rover)
+
+    def cancel(self, rover_id):
+        """Stops advancing a rover, e.g. because a WebSocket session took it over."""
+        self.queue = deque(entry for entry in self.queue if entry.rover.id != rover_id)
+
+    def run_tick(self):
+        with self.store.transaction():
+            self._advance_all()
+
+    def _advance_all(self):
+        started = time.perf_counter()
+        deadline = started + self.budget
+        pending = len(self.queue)  # Rovers not yet advanced this tick
+        while pending:
+            pending -= 1
+            entry = self.queue.popleft()
+            rover = entry.rover
+            if self.store.rovers.get(rover.id) is not rover:
+                continue  # Deleted while moving
+            try:
+                disarmed = entry.advance(self.store, self.steps)
+            except Exception:
+                # Stopped where it got to instead of being left MOVING; the others go on
+                self.errors += 1
+                print(f"Scheduler failed to advance rover {rover.id}:")
+                traceback.print_exc()
+                rover.executed_commands = rover.commands[:entry.offset]
+                rover.status = RoverStatus.FINISHED
+                self.store.save_rover(rover)
+                continue
+            for mine in disarmed:
+                pin_cache.prefetch(mine.serial_number)
+            if entry.done:
+                rover.executed_commands = rover.commands[:entry.offset]
+                rover.status = RoverStatus.ELIMINATED if entry.exploded else RoverStatus.FINISHED
+                self.store.save_rover(rover)
+            else:
+                self.queue.append(entry)
+                self.store.save_rover(rover, pose_only=True)
+            # At least one rover moves every tick, however small the budget
+            if pending and time.perf_counter() >= deadline:
+                self.overruns += 1
+                self.deferred += pending
+                break
+        self.ticks += 1
+        self.last_tick = time.perf_counter() - started
+        self.max_tick = max(self.max_tick, self.last_tick)
+        self.total_tick += self.last_tick
+
+    def metrics(self):
+        return {
+            "tick_ms": self.tick * 1000,
+            "steps_per_tick": self.steps,
+            "budget_ms": self.budget * 1000,
+            "active": len(self.queue),
+            "ticks": self.ticks,
+            "overruns": self.overruns,
+            "skipped": self.skipped,
+            "deferred": self.deferred,
+            "errors": self.errors,
+            "last_tick_ms": self.last_tick * 1000,
+            "max_tick_ms": self.max_tick * 1000,
+            "avg_tick_ms": self.total_tick * 1000 / self.ticks if self.ticks else 0.0,
+        }
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time() + self.tick
+        while True:
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+            behind = loop.time() - next_tick
+            if behind > self.tick:
+                missed = int(behind // self.tick)
+                self.skipped += missed
+                next_tick += missed * self.tick
+            if self.queue:
+                try:
+                    self.run_tick()
+                except Exception:
+                    self.errors += 1
+                    print("Scheduler tick failed:")
+                    traceback.print_exc()
+            next_tick += self.tick
+
+scheduler = RoverScheduler(db, TICK_MS / 1000, TICK_STEPS, TICK_BUDGET_MS / 1000)
+
+class ResponseCache:
+    """Encoded response bodies of the read endpoints, kept until the data behind them changes.
+
+    An entry is stored with the version of the data it was built from and served only
+    while that version is current; discard() drops one early. The least recently used
+    entries go once their bodies add up to more than max_bytes. A request that misses
+    while the same body is already being built waits for that build (single flight).
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()  # key -> (version, body, headers)
+        self.building = {}  # key -> (version, task) of builds in progress
+
+    async def get(self, key, version, build):
+        """Returns (body, headers) for key at version; build is a coroutine function making them."""
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == version:
+            self.entries.move_to_end(key)
+            return entry[1], entry[2]
+        flight = self.building.get(key)
+        if flight is None or flight[0] != version:
+            # A task of its own, so a caller that goes away doesn't cancel the others' build
+            flight = (version, asyncio.ensure_future(self._build(key, build)))
+            self.building[key] = flight
+        return await asyncio.shield(flight[1])
+
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+        self.building.pop(key, None)  # A build in progress may have read the old data
+
+    async def _build(self, key, build):
+        try:
+            result = await build()
+        finally:
+            flight = self.building.get(key)
+            current = flight is not None and flight[1] is asyncio.current_task()
+            if current:
+                del self.building[key]
+        if current:
+            self._store(key, flight[0], result)
+        return result
+
+    def _store(self, key, version, result):
+        body, headers = result
+        if len(body) > self.max_bytes:
+            return
+        self.discard(key)
+        self.entries[key] = (version, body, headers)
+        self.size += len(body)
+        while self.size > self.max_bytes:
+            _, (_, old, _) = self.entries.popitem(last=False)
+            self.size -= len(old)
+
+response_cache = ResponseCache(RESPONSE_CACHE_BYTES)
+
+def _rover_changed(rover_id):
+    spectators.rover_changed(rover_id)
+    response_cache.discard(("rover", rover_id))
+
+db.rover_listener = _rover_changed
+
 # Map endpoints
+def _etag_matches(request, etag):
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+def _map_encoding(request, grid, encoding):
+    """The packed binary encoding a map request asks for (see encode_map), None for JSON rows."""
+    if encoding is None and "application/octet-stream" not in request.headers.get("accept", ""):
+        return None
+    if encoding is None:
+        encoding = "rle" if grid.sparse else "bits"
+    if encoding not in ("bits", "rle"):
+        raise HTTPException(status_code=400, detail="Invalid encoding. Use bits or rle.")
+    if encoding == "bits" and grid.height * grid.width > DENSE_MAP_MAX_CELLS * 8:
+        raise HTTPException(status_code=400, detail="Map too large for packed bits, use encoding=rle")
+    return encoding
+
+def _encode_grid(grid, encoding, version):
+    if encoding is None:
+        return grid.to_json()
+    return encode_map(grid, MAP_ENCODING_BITS if encoding == "bits" else MAP_ENCODING_RUNS, version)
+
+def _map_headers(etag, encoding):
+    # The same URL serves JSON or binary by Accept, so each body gets its own tag
+    return {"ETag": f'{etag[:-1]}-{encoding or "json"}"', "Vary": "Accept"}
+
+def _grid_response(request, grid, etag, version, encoding=None):
+    """Encodes a grid as JSON rows, or packed binary when asked for; 304 if the client has it."""
+    encoding = _map_encoding(request, grid, encoding)
+    headers = _map_headers(etag, encoding)
+    if _etag_matches(request, headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    if encoding is not None:
+        return Response(content=_encode_grid(grid, encoding, version), media_type="application/octet-stream", headers=headers)
+
+    if grid.sparse:
+        # Dense rows of a sparse map are built one at a time while streaming
+        return StreamingResponse(_stream_json_rows(grid), media_type="application/json", headers=headers)
+    # Encoded straight from the grid bytes, skipping response_model validation
+    return Response(content=grid.to_json(), media_type="application/json", headers=headers)
+
+def _map_window(x, y, width, height):
+    """Clips a requested window to the map and copies it out of the grid."""
+    if x < 0 or y < 0 or x >= db.map_width or y >= db.map_height:
+        raise HTTPException(status_code=400, detail="Window origin is outside the map")
+    if width <= 0 or height <= 0:
+        raise HTTPException(status_code=400, detail="Window width and height must be positive")
+    width = min(width, db.map_width - x)
+    height = min(height, db.map_height - y)
+    if width * height > DENSE_MAP_MAX_CELLS:
+        raise HTTPException(status_code=400, detail="Window too large, request a smaller region or use tiles")
+    return db.get_grid().window(x, y, width, height)
+
 @app.get("/map", response_model=List[List[int]])
-async def get_map():
-    return db.get_grid()
+async def get_map(
+    request: Request,
+    encoding: Optional[str] = None,
+    x: Optional[int] = None,
+    y: Optional[int] = None,
+    width: Optional[int] = None,
+    height: Optional[int] = None,
+):
+    """Returns the grid, or only the window at (x, y) of width x height cells if any of those is given.
+
+    The map version and encoding are sent as an ETag, so unchanged maps cost a 304.
+    """
+    etag = db.map_etag()
+    grid = db.get_grid()
+    if x is not None or y is not None or width is not None or height is not None:
+        x = 0 if x is None else x
+        y = 0 if y is None else y
+        grid = _map_window(x, y, db.map_width - x if width is None else width,
+                           db.map_height - y if height is None else height)
+        return _grid_response(request, grid, etag, db.map_version, encoding)
+
+    encoding = _map_encoding(request, grid, encoding)
+    headers = _map_headers(etag, encoding)
+    if _etag_matches(request, headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    if encoding is None and grid.sparse:
+        return _grid_response(request, grid, etag, db.map_version)  # Streamed, too big to keep
+    version = db.map_version
+
+    async def build():
+        return await asyncio.to_thread(_encode_grid, grid, encoding, version), None
+
+    body, _ = await response_cache.get(("map", encoding), (etag, db.mines_version), build)
+    return Response(content=body, media_type="application/octet-stream" if encoding else "application/json",
+                    headers=headers)
+
+@app.get("/map/tiles/{tx}/{ty}", response_model=List[List[int]])
+async def get_map_tile(tx: int, ty: int, request: Request, encoding: Optional[str] = None):
+    """Returns one MAP_TILE_SIZE square tile of the map (smaller at the right and bottom edges).
+
+    Each tile has its own version and ETag, so clients only refetch tiles that changed.
+    """
+    x, y = tx * MAP_TILE_SIZE, ty * MAP_TILE_SIZE
+    if tx < 0 or ty < 0 or x >= db.map_width or y >= db.map_height:
+        raise HTTPException(status_code=404, detail="Tile not found")
+    grid = _map_window(x, y, MAP_TILE_SIZE, MAP_TILE_SIZE)
+    return _grid_response(request, grid, db.tile_etag(tx, ty), db.tile_version(tx, ty), encoding)
+
+@app.get("/map/changes")
+async def get_map_changes(since: int, epoch: Optional[str] = None):
+    """Returns the cell changes and resizes after map version `since`.
+
+    If that version is too old to be covered by the change log, or belongs to
+    another epoch (the server restarted), "resync" is true and the client has to
+    fetch the whole map again.
+    """
+    changes = db.changes_since(since) if epoch in (None, db.map_epoch) else None
+    if changes is None:
+        return {"epoch": db.map_epoch, "version": db.map_version, "resync": True, "changes": []}
+    return {"epoch": db.map_epoch, "version": db.map_version, "resync": False, "changes": [_change_event(c) for c in changes]}
+
+def _stream_json_rows(grid):
+    yield b'['
+    for y, row in enumerate(grid.iter_json_rows()):
+        yield row if y == 0 else b',' + row
+    yield b']'
 
 @app.put("/map", status_code=status.HTTP_200_OK)
 async def update_map(dimensions: MapDimensions):
     if dimensions.height <= 0 or dimensions.width <= 0:
         raise HTTPException(status_code=400, detail="Height and width must be positive")
     
-    # Update map dimensions
-    old_height, old_width = db.map_height, db.map_width
-    db.map_height = dimensions.height
-    db.map_width = dimensions.width
-    
-    # Create new grid
-    new_grid = [[0 for _ in range(db.map_width)] for _ in range(db.map_height)]
-    
-    # Copy over old grid values where possible
-    for y in range(min(old_height, db.map_height)):
-        for x in range(min(old_width, db.map_width)):
-            new_grid[y][x] = db.grid[y][x]
-    
-    db.grid = new_grid
-    
-    # Update mines to ensure they are within the new grid
-    for mine_id, mine in list(db.mines.items()):
-        if not db.is_valid_position(mine.x, mine.y):
-            del db.mines[mine_id]
-        else:
-            db.update_grid_for_mine(mine_id)
+    with db.transaction():
+        db.resize(dimensions.height, dimensions.width)
     
     return {"message": "Map dimensions updated successfully"}
 
+def _projection(fields, allowed):
+    """Parses a fields= list of record keys; None if the whole record is wanted."""
+    if fields is None:
+        return None
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name not in allowed]
+    if unknown or not names:
+        raise HTTPException(status_code=400, detail=f"Unknown fields {', '.join(unknown)}. Choose from {', '.join(allowed)}.")
+    return names
+
+async def _list_page(key, version, source, dump, fields, keep, cursor, limit):
+    """Responds with the records after cursor in ID order, at most limit of them.
+
+    source() gives the sorted IDs and the id -> record dict. With a limit, at most
+    PAGE_SCAN_LIMIT records are looked at, so a selective filter can give a short or even
+    empty page. X-Next-Cursor is set whenever there may be more. Bodies go through the
+    response cache under key, valid while the records are at version.
+    """
+    if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    try:
+        after = None if cursor is None else int(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    async def build():
+        # The page is picked on the event loop, where nothing changes under it; only encoding goes to a thread
+        ids, records = source()
+        start = 0 if after is None else bisect.bisect_right(ids, after)
+        stop = len(ids) if limit is None else min(len(ids), start + PAGE_SCAN_LIMIT)
+        page = []
+        i = start
+        while i < stop:
+            record = records[ids[i]]
+            i += 1
+            if keep is None or keep(record):
+                page.append(record)
+                if len(page) == limit:
+                    break
+        headers = {"X-Next-Cursor": str(ids[i - 1])} if i < len(ids) else {}
+        return await asyncio.to_thread(_encode_page, page, dump, fields), headers
+
+    body, headers = await response_cache.get(key, version, build)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def _encode_page(page, dump, fields):
+    # Encoded here rather than through response_model, which would reject projected records
+    if fields is not None:
+        page = [{name: data[name] for name in fields} for data in map(dump, page)]
+    else:
+        page = [dump(record) for record in page]
+    return json.dumps(page, ensure_ascii=False, separators=(",", ":")).encode()
+
+_MINE_FIELDS = ("x", "y", "serial_number", "id")
+_ROVER_FIELDS = ("commands", "id", "status", "position", "executed_commands")
+
 # Mines endpoints
 @app.get("/mines", response_model=List[Mine])
-async def get_mines():
-    return list(db.mines.values())
+async def get_mines(
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    bbox: Optional[str] = None,
+    fields: Optional[str] = None,
+):
+    """Lists mines in ID order, all of them unless a limit is given.
+
+    bbox=x0,y0,x1,y1 keeps mines inside that box (inclusive), and fields=id,x,... returns
+    only those keys. A full page comes with an X-Next-Cursor header to pass as cursor.
+    """
+    source = lambda: (db.mine_ids, db.mines)
+    keep = None
+    if bbox is not None:
+        try:
+            x0, y0, x1, y1 = (int(value) for value in bbox.split(","))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="bbox must be x0,y0,x1,y1")
+        keep = lambda mine: x0 <= mine.x <= x1 and y0 <= mine.y <= y1
+
+        def source():
+            # A box is looked up by row; one holding a good share of the mines fills its pages
+            # about as fast from the filtered scan in ID order, without sorting them all
+            ids = db.mine_ids_in(x0, y0, x1, y1, len(db.mine_ids) // 8)
+            return (db.mine_ids if ids is None else ids), db.mines
+    return await _list_page(("mines", cursor, limit, bbox, fields), db.mines_version, source,
+                            MineRecord.to_json, _projection(fields, _MINE_FIELDS), keep, cursor, limit)
+
+async def _parse_mine_upload(request):
+    # Parsed line by line as the body arrives, so only the mines read so far are held, not the upload
+    parser = MineLayoutParser()
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    partial = ""
+    try:
+        async for chunk in request.stream():
+            lines = (partial + decoder.decode(chunk)).split("\n")
+            partial = lines.pop()
+            for line in lines:
+                parser.feed(line)
+        parser.feed(partial + decoder.decode(b"", final=True))
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="The body must be UTF-8 text")
+    return parser.finish()
+
+@app.post("/mines/bulk", status_code=status.HTTP_201_CREATED)
+async def create_mines_bulk(request: Request, height: Optional[int] = None, width: Optional[int] = None, replace: bool = False):
+    """Creates many mines at once, all or nothing.
+
+    The body is a JSON array of mines, or, as text/plain, a map file followed by serial
+    numbers (see mine_import), whose header sets the map size. height and width resize
+    the map first; replace removes the existing mines. The new mines get consecutive IDs.
+    """
+    if request.headers.get("content-type", "").startswith("text/"):
+        if height is not None or width is not None:
+            raise HTTPException(status_code=400, detail="A map file sets the map size, height and width can't be given too")
+        try:
+            height, width, mines = await _parse_mine_upload(request)
+        except MineFileError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    else:
+        try:
+            mines = [(m.x, m.y, m.serial_number) for m in _mine_list.validate_json(await request.body())]
+        except ValidationError as e:
+            raise RequestValidationError(e.errors())
+    if (height is None) != (width is None):
+        raise HTTPException(status_code=400, detail="Give both height and width, or neither")
+    if height is not None and (height <= 0 or width <= 0):
+        raise HTTPException(status_code=400, detail="Height and width must be positive")
+
+    with db.transaction():
+        if height is None:
+            height, width = db.map_height, db.map_width
+        # Everything is checked in one pass before anything changes
+        occupied = set() if replace else {(x, y) for x, y in zip(db.mines.xs, db.mines.ys) if x < width and y < height}
+        for i, (x, y, _) in enumerate(mines):
+            if not (0 <= x < width and 0 <= y < height):
+                raise HTTPException(status_code=400, detail=f"Mine {i}: invalid mine position ({x}, {y})")
+            if (x, y) in occupied:
+                raise HTTPException(status_code=400, detail=f"Mine {i}: position ({x}, {y}) is already occupied by a mine")
+            occupied.add((x, y))
+
+        if replace:
+            db.clear_mines()
+        if (height, width) != (db.map_height, db.map_width):
+            db.resize(height, width)
+        first_id = db.next_mine_id
+        db.add_mines([MineRecord(first_id + i, x, y, serial) for i, (x, y, serial) in enumerate(mines)])
+    pin_cache.prefetch_many(serial for _, _, serial in mines)
+
+    return {
+        "created": len(mines),
+        "first_id": first_id if mines else None,
+        "last_id": first_id + len(mines) - 1 if mines else None,
+        "height": height,
+        "width": width,
+    }
 
 @app.get("/mines/{mine_id}", response_model=Mine)
 async def get_mine(mine_id: int):
     mine = db.mines.get(mine_id)
     if mine is None:
         raise HTTPException(status_code=404, detail="Mine not found")
-    return mine
+    return mine.to_json()
 
 @app.delete("/mines/{mine_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_mine(mine_id: int):
-    mine = db.mines.get(mine_id)
-    if mine is None:
-        raise HTTPException(status_code=404, detail="Mine not found")
+    with db.transaction():
+        mine = db.mines.get(mine_id)
+        if mine is None:
+            raise HTTPException(status_code=404, detail="Mine not found")
     
-    # Remove mine from grid
-    if db.is_valid_position(mine.x, mine.y):
-        db.grid[mine.y][mine.x] = 0
-    
-    # Remove mine from storage
-    del db.mines[mine_id]
+        # Remove mine from grid and storage
+        db.remove_mine(mine_id)
     return None
 
 @app.post("/mines", response_model=Mine, status_code=status.HTTP_201_CREATED)
 async def create_mine(mine: MineCreate):
-    if not db.is_valid_position(mine.x, mine.y):
-        raise HTTPException(status_code=400, detail="Invalid mine position")
+    with db.transaction():
+        if not db.is_valid_position(mine.x, mine.y):
+            raise HTTPException(status_code=400, detail="Invalid mine position")
     
-    # Check if position is already occupied by a mine
-    for existing_mine in db.mines.values():
-        if existing_mine.x == mine.x and existing_mine.y == mine.y:
+        # Check if position is already occupied by a mine
+        if db.mine_id_at(mine.x, mine.y) is not None:
             raise HTTPException(status_code=400, detail="Position already occupied by a mine")
     
-    # Create new mine
-    mine_id = db.next_mine_id
-    db.next_mine_id += 1
+        # Create new mine
+        mine_id = db.next_mine_id  # add_mine moves next_mine_id past it
     
-    new_mine = Mine(
-        id=mine_id,
-        x=mine.x,
-        y=mine.y,
-        serial_number=mine.serial_number
-    )
+        new_mine = MineRecord(mine_id, mine.x, mine.y, mine.serial_number)
     
-    db.mines[mine_id] = new_mine
-    db.update_grid_for_mine(mine_id)
+        db.add_mine(new_mine)
+    pin_cache.prefetch(new_mine.serial_number)
     
-    return new_mine
+    return new_mine.to_json()
 
 @app.put("/mines/{mine_id}", response_model=Mine)
 async def update_mine(mine_id: int, mine_update: MineUpdate):
-    if mine_id not in db.mines:
-        raise HTTPException(status_code=404, detail="Mine not found")
-
-    mine = db.mines[mine_id]
-    old_x, old_y = mine.x, mine.y # Store original position
-
-    update_data = mine_update.dict(exclude_unset=True)
-
-    # --- Prepare potential new values ---
-    new_x = update_data.get('x', mine.x)
-    new_y = update_data.get('y', mine.y)
-    new_serial = update_data.get('serial_number', mine.serial_number)
-
-    # --- Validation ---
-    # 1. Validate new position bounds
-    if not db.is_valid_position(new_x, new_y):
-        # Revert changes if position is invalid and was part of the update
-        if 'x' in update_data or 'y' in update_data:
-             raise HTTPException(status_code=400, detail=f"Invalid new mine position ({new_x}, {new_y}). Out of bounds.")
-        # else: Allow update if only serial was changed
-
-    # 2. Check if the new position is occupied by ANOTHER mine
-    if 'x' in update_data or 'y' in update_data: # Only check if position actually changed
-        for other_mine_id, other_mine in db.mines.items():
-            if other_mine_id != mine_id and other_mine.x == new_x and other_mine.y == new_y:
+    with db.transaction():
+        if mine_id not in db.mines:
+            raise HTTPException(status_code=404, detail="Mine not found")
+
+        mine = db.mines[mine_id]
+
+        update_data = mine_update.dict(exclude_unset=True)
+
+        # --- Prepare potential new values ---
+        new_x = update_data.get('x', mine.x)
+        new_y = update_data.get('y', mine.y)
+        new_serial = update_data.get('serial_number', mine.serial_number)
+
+        # --- Validation ---
+        # 1. Validate new position bounds
+        if not db.is_valid_position(new_x, new_y):
+            # Revert changes if position is invalid and was part of the update
+            if 'x' in update_data or 'y' in update_data:
+                 raise HTTPException(status_code=400, detail=f"Invalid new mine position ({new_x}, {new_y}). Out of bounds.")
+            # else: Allow update if only serial was changed
+
+        # 2. Check if the new position is occupied by ANOTHER mine
+        if 'x' in update_data or 'y' in update_data: # Only check if position actually changed
+            other_mine_id = db.mine_id_at(new_x, new_y)
+            if other_mine_id is not None and other_mine_id != mine_id:
                 raise HTTPException(
                     status_code=400,
                     detail=f"New position ({new_x}, {new_y}) is already occupied by mine {other_mine_id}"
                 )
 
-    # --- Apply Updates ---
-    mine.x = new_x
-    mine.y = new_y
-    mine.serial_number = new_serial
+        # --- Apply Updates ---
+        if new_serial != mine.serial_number:
+            pin_cache.prefetch(new_serial)
+            db.set_mine_serial(mine_id, new_serial)
 
-    # --- Update Grid ---
-    # Only update grid if position actually changed
-    if mine.x != old_x or mine.y != old_y:
-        # Clear old position on the grid
-        if db.is_valid_position(old_x, old_y):
-            db.grid[old_y][old_x] = 0
-        # Set new position on the grid
-        if db.is_valid_position(mine.x, mine.y):
-             db.grid[mine.y][mine.x] = 1 # Assuming 1 represents a mine
+        # --- Update Grid and position index ---
+        # Only touches them if the position actually changed
+        db.move_mine(mine_id, new_x, new_y)
 
-    return mine
+    return db.mines[mine_id].to_json()
 
 # Rovers endpoints
+_valid_commands = re.compile(r"[LRMD]*")
+
 @app.get("/rovers", response_model=List[Rover])
-async def get_rovers():
-    return list(db.rovers.values())
+async def get_rovers(
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    status_filter: Optional[str] = Query(None, alias="status"),
+    fields: Optional[str] = None,
+):
+    """Lists rovers in ID order, all of them unless a limit is given.
+
+    status=Moving,Finished keeps rovers with those statuses, and fields=id,status returns
+    only those keys. A full page comes with an X-Next-Cursor header to pass as cursor.
+    """
+    keep = None
+    if status_filter is not None:
+        try:
+            statuses = {RoverStatus(value.strip()) for value in status_filter.split(",")}
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Unknown status. Choose from {', '.join(s.value for s in RoverStatus)}.")
+        keep = lambda rover: rover.status in statuses
+    return await _list_page(("rovers", cursor, limit, status_filter, fields), db.rovers_version,
+                            lambda: (db.rover_ids, db.rovers), RoverRecord.to_json,
+                            _projection(fields, _ROVER_FIELDS), keep, cursor, limit)
 
 @app.get("/rovers/{rover_id}", response_model=Rover)
 async def get_rover(rover_id: int):
     rover = db.rovers.get(rover_id)
     if rover is None:
         raise HTTPException(status_code=404, detail="Rover not found")
-    return rover
+
+    async def build():
+        return json.dumps(rover.to_json(), ensure_ascii=False, separators=(",", ":")).encode(), None
+
+    # Dropped from the cache whenever the rover is saved or deleted
+    body, _ = await response_cache.get(("rover", rover_id), None, build)
+    return Response(content=body, media_type="application/json")
+
+@app.get("/rovers/{rover_id}/path")
+async def get_rover_path(rover_id: int, start: int = 0, stop: Optional[int] = None, max_points: Optional[int] = None):
+    """Returns the cells a rover moved through since it was last started, as [x, y] points.
+
+    Point 0 is where it started and point i is where its i-th move took it. start and
+    stop (inclusive) pick a window, and max_points thins it out evenly, keeping the last
+    point. Paths are kept in memory by the worker that moved the rover.
+    """
+    rover = db.rovers.get(rover_id)
+    if rover is None:
+        raise HTTPException(status_code=404, detail="Rover not found")
+    if start < 0 or (stop is not None and stop < start):
+        raise HTTPException(status_code=400, detail="Invalid window: need 0 <= start <= stop")
+    if max_points is not None and max_points < 2:
+        raise HTTPException(status_code=400, detail="max_points must be at least 2")
+    path = rover.path or Trajectory(rover.x, rover.y, rover.facing)  # Not moved here: just where it is
+    moves = path.length()
+    stop = moves if stop is None else min(stop, moves)
+    every = 1
+    if max_points is not None and stop - start + 1 > max_points:
+        every = math.ceil((stop - start) / (max_points - 1))
+    points = path.points(start, stop, every) if start <= stop else []
+    return {"id": rover_id, "moves": moves, "start": start, "stop": stop, "every": every, "points": points}
 
 @app.post("/rovers", response_model=Rover, status_code=status.HTTP_201_CREATED)
 async def create_rover(rover: RoverCreate):
     # Validate commands
-    if not all(cmd in 'LRMD' for cmd in rover.commands):
+    if not _valid_commands.fullmatch(rover.commands):
         raise HTTPException(status_code=400, detail="Invalid commands. Only L, R, M, D are allowed.")
     
     # Create new rover
-    rover_id = db.next_rover_id
-    db.next_rover_id += 1
-    
-    new_rover = Rover(
-        id=rover_id,
-        commands=rover.commands,
-        status=RoverStatus.NOT_STARTED,
-        position=RoverPosition(x=0, y=0, facing='S')  # Start at (0,0) facing South
-    )
-    
-    db.rovers[rover_id] = new_rover
-    return new_rover
+    with db.transaction():
+        rover_id = db.next_rover_id  # save_rover moves next_rover_id past it
+        
+        new_rover = RoverRecord(rover_id, rover.commands)  # Starts at (0,0) facing South
+        
+        db.save_rover(new_rover)
+    return new_rover.to_json()
+
+@app.post("/rovers/bulk", status_code=status.HTTP_201_CREATED)
+async def create_rovers_bulk(rovers: List[RoverCreate]):
+    """Creates many rovers at once, all or nothing, and returns their IDs (consecutive, in order)."""
+    for i, rover in enumerate(rovers):
+        if not _valid_commands.fullmatch(rover.commands):
+            raise HTTPException(status_code=400, detail=f"Rover {i}: invalid commands. Only L, R, M, D are allowed.")
+
+    with db.transaction():
+        first_id = db.next_rover_id
+        db.save_rovers([RoverRecord(first_id + i, rover.commands) for i, rover in enumerate(rovers)])
+    return {"created": len(rovers), "ids": list(range(first_id, first_id + len(rovers)))}
 
 @app.delete("/rovers/{rover_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_rover(rover_id: int):
-    if rover_id not in db.rovers:
-        raise HTTPException(status_code=404, detail="Rover not found")
-    
-    del db.rovers[rover_id]
+    with db.transaction():
+        if rover_id not in db.rovers:
+            raise HTTPException(status_code=404, detail="Rover not found")
+        
+        db.delete_rover(rover_id)
     return None
 
 @app.put("/rovers/{rover_id}", response_model=Rover)
 async def update_rover(rover_id: int, rover_update: RoverUpdate):
-    if rover_id not in db.rovers:
-        raise HTTPException(status_code=404, detail="Rover not found")
-    
-    rover = db.rovers[rover_id]
-    
-    # Can only update if rover is not currently in motion
-    if rover.status not in [RoverStatus.NOT_STARTED, RoverStatus.FINISHED]:
-        raise HTTPException(
-            status_code=400, 
-            detail=f"Cannot update rover while status is {rover.status}"
-        )
-    
-    # Validate commands
-    if not all(cmd in 'LRMD' for cmd in rover_update.commands):
-        raise HTTPException(status_code=400, detail="Invalid commands. Only L, R, M, D are allowed.")
-    
-    rover.commands = rover_update.commands
-    rover.status = RoverStatus.NOT_STARTED
-    rover.position = RoverPosition(x=0, y=0, facing='S')  # Reset position
-    rover.executed_commands = ""
+    with db.transaction():
+        if rover_id not in db.rovers:
+            raise HTTPException(status_code=404, detail="Rover not found")
+        
+        rover = db.rovers[rover_id]
+        
+        # Can only update if rover is not currently in motion
+        if rover.status not in [RoverStatus.NOT_STARTED, RoverStatus.FINISHED]:
+            raise HTTPException(
+                status_code=400, 
+                detail=f"Cannot update rover while status is {rover.status}"
+            )
+        
+        # Validate commands
+        if not _valid_commands.fullmatch(rover_update.commands):
+            raise HTTPException(status_code=400, detail="Invalid commands. Only L, R, M, D are allowed.")
+        
+        rover.commands = rover_update.commands
+        rover.status = RoverStatus.NOT_STARTED
+        rover.place(0, 0, 'S')  # Reset position
+        rover.executed_commands = ""
+        rover.path = None
+        db.save_rover(rover)
     
-    return rover
+    return rover.to_json()
 
-@app.post("/rovers/{rover_id}/dispatch", response_model=Rover)
-async def dispatch_rover(rover_id: int):
+def _dispatchable_rover(rover_id):
     if rover_id not in db.rovers:
         raise HTTPException(status_code=404, detail="Rover not found")
     
@@ -327,94 +2364,434 @@ async def dispatch_rover(rover_id: int):
             status_code=400, 
             detail=f"Cannot dispatch rover while status is {rover.status}"
         )
+    return rover
+
+@app.post("/rovers/{rover_id}/dispatch", response_model=Rover)
+async def dispatch_rover(rover_id: int):
+    with db.transaction():
+        rover = _dispatchable_rover(rover_id)
+        
+        # Reset rover state
+        rover.status = RoverStatus.MOVING
+        result = run_commands(db, rover.commands)
+        rover.place(result.x, result.y, result.facing)
+        rover.executed_commands = rover.commands[:result.executed]
+        rover.path = Trajectory()
+        rover.follow(rover.executed_commands, db.map_width, db.map_height)
+        db.save_rover(rover)
+
+        # Disarm the mines before awaiting any PIN so other requests never see a half-disarmed mine
+        disarmed = [db.remove_mine(mine_id) for mine_id in result.disarmed]
+    for mine in disarmed:
+        pin = await pin_cache.get(mine.serial_number)
+
+    with db.transaction():
+        if result.exploded:
+            rover.status = RoverStatus.ELIMINATED
+        else:
+            rover.status = RoverStatus.FINISHED
+        if db.rovers.get(rover_id) is rover:  # Not deleted meanwhile
+            db.save_rover(rover)
     
-    # Reset rover state
-    rover.status = RoverStatus.MOVING
-    rover.position = RoverPosition(x=0, y=0, facing='S')  # Start at (0,0) facing South
-    rover.executed_commands = ""
-    
-    # Process commands
-    direction_idx = 2  # Start facing South (index 2 in directions list)
-    current_pos = (0, 0)
-    executed = []
-    exploded = False
-    on_mine = False
-    
-    for cmd in rover.commands:
-        if cmd == 'L':
-            direction_idx = (direction_idx - 1) % 4
-            rover.position.facing = directions[direction_idx]
-        elif cmd == 'R':
-            direction_idx = (direction_idx + 1) % 4
-            rover.position.facing = directions[direction_idx]
-        elif cmd == 'M':
-            # If we are on an active mine and try to move without disarming, we explode.
-            if on_mine:
-                exploded = True
-                break
-            
-            # Execute the move
-            dx, dy = direction_moves[rover.position.facing]
-            new_x = rover.position.x + dx
-            new_y = rover.position.y + dy
-            
-            # Check if move is valid
+    return rover.to_json()
+
+def _format_event(event, fmt):
+    if fmt == "sse":
+        return f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+    return json.dumps(event) + "\n"
+
+async def _stream_dispatch(rover_id, fmt, every):
+    """Runs a dispatch while streaming its events; see dispatch_rover_stream."""
+    # The rover starts moving only once the body is being sent: a client gone before then
+    # never gets here, and this generator's finally is the only thing that finishes the dispatch
+    with db.transaction():
+        try:
+            rover = _dispatchable_rover(rover_id)
+        except HTTPException as e:  # Deleted or dispatched since the request was checked
+            rover = None
+            error = {"event": "error", "status_code": e.status_code, "detail": e.detail}
+        else:
+            rover.status = RoverStatus.MOVING
+            rover.place(0, 0, 'S')
+            rover.executed_commands = ""
+            rover.path = Trajectory()
+            db.save_rover(rover)
+    if rover is None:
+        yield _format_event(error, fmt)
+        return
+    events = iter_commands(db, rover.commands)
+    pending = []
+    last_pose = 0
+    followed = 0  # Commands handed to the rover's path so far
+    kind, executed = None, 0
+    try:
+        for kind, executed, x, y, detail in events:
+            if kind == 'pose':
+                rover.place(x, y, detail)
+                rover.follow(rover.commands[followed:executed], db.map_width, db.map_height)
+                followed = executed
+                with db.transaction():
+                    if db.rovers.get(rover.id) is rover:
+                        db.save_rover(rover, pose_only=True)
+                if executed - last_pose < every:
+                    continue
+                last_pose = executed
+                pending.append({"event": "pose", "executed": executed, "x": x, "y": y, "facing": detail})
+            elif kind == 'mine':
+                pending.append({"event": "mine", "executed": executed, "x": x, "y": y, "mine_id": detail})
+            elif kind == 'disarm':
+                with db.transaction():
+                    # Another worker may have removed it while the stream was paused
+                    mine = db.remove_mine(detail) if detail in db.mines else None
+                if mine is None:
+                    continue
+                # Send what we have first, so the client isn't kept waiting on the PIN
+                if pending:
+                    yield "".join(_format_event(event, fmt) for event in pending)
+                    pending = []
+                pin = await pin_cache.get(mine.serial_number)
+                pending.append({"event": "disarm", "executed": executed, "mine": mine.to_json(), "pin": pin})
+            else:
+                rover.place(x, y, detail)
+                rover.executed_commands = rover.commands[:executed]
+                rover.follow(rover.commands[followed:executed], db.map_width, db.map_height)
+                rover.status = RoverStatus.ELIMINATED if kind == 'exploded' else RoverStatus.FINISHED
+                with db.transaction():
+                    if db.rovers.get(rover.id) is rover:
+                        db.save_rover(rover)
+                pending.append({"event": "status", "rover": rover.to_json()})
+            # Each yield waits for the client to take the chunk, which is the backpressure
+            if len(pending) >= DISPATCH_STREAM_BATCH:
+                yield "".join(_format_event(event, fmt) for event in pending)
+                pending = []
+        if pending:
+            yield "".join(_format_event(event, fmt) for event in pending)
+    finally:
+        if kind not in ('finished', 'exploded'):
+            # The client went away: the dispatch still completes, without waiting on PINs
+            with db.transaction():
+                for kind, executed, x, y, detail in events:
+                    if kind == 'disarm' and detail in db.mines:
+                        pin_cache.prefetch(db.remove_mine(detail).serial_number)
+                    elif kind not in ('mine', 'disarm'):
+                        rover.place(x, y, detail)
+                rover.executed_commands = rover.commands[:executed]
+                rover.follow(rover.commands[followed:executed], db.map_width, db.map_height)
+                rover.status = RoverStatus.ELIMINATED if kind == 'exploded' else RoverStatus.FINISHED
+                if db.rovers.get(rover.id) is rover:
+                    db.save_rover(rover)
+
+@app.post("/rovers/{rover_id}/dispatch/stream")
+async def dispatch_rover_stream(rover_id: int, format: str = "ndjson", every: int = 1):
+    """Dispatches a rover like POST /rovers/{rover_id}/dispatch, streaming its progress.
+
+    Sends NDJSON lines (or Server-Sent Events with format=sse): "pose" events after
+    runs of turns or moves, at most one per every commands, "mine" and "disarm"
+    events, and a final "status" record holding the rover. A rover deleted or
+    dispatched elsewhere before its stream starts gets a single "error" event instead.
+    """
+    if format not in ("ndjson", "sse"):
+        raise HTTPException(status_code=400, detail="Invalid format. Use ndjson or sse.")
+    if every < 1:
+        raise HTTPException(status_code=400, detail="every must be at least 1")
+    _dispatchable_rover(rover_id)
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(_stream_dispatch(rover_id, format, every), media_type=media_type)
+
+@app.post("/rovers/{rover_id}/enqueue", response_model=Rover, status_code=status.HTTP_202_ACCEPTED)
+async def enqueue_rover(rover_id: int):
+    """Dispatches a rover without waiting: it moves ROVER_TICK_STEPS commands per scheduler tick."""
+    with db.transaction():
+        rover = _dispatchable_rover(rover_id)
+        scheduler.enqueue(rover)
+    return rover.to_json()
+
+@app.get("/scheduler")
+async def get_scheduler_metrics():
+    return scheduler.metrics()
+
+def _batch_rovers(batch):
+    if batch.all_not_started:
+        rover_ids = [rid for rid, r in db.rovers.items() if r.status == RoverStatus.NOT_STARTED]
+    elif batch.rover_ids is not None:
+        rover_ids = batch.rover_ids
+    else:
+        raise HTTPException(status_code=400, detail="Give rover_ids or set all_not_started")
+    if len(set(rover_ids)) != len(rover_ids):
+        raise HTTPException(status_code=400, detail="Duplicate rover IDs")
+    for rover_id in rover_ids:
+        rover = db.rovers.get(rover_id)
+        if rover is None:
+            raise HTTPException(status_code=404, detail=f"Rover {rover_id} not found")
+        if rover.status not in [RoverStatus.NOT_STARTED, RoverStatus.FINISHED]:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Cannot dispatch rover {rover_id} while status is {rover.status}"
+            )
+    return [db.rovers[rover_id] for rover_id in rover_ids]
+
+@app.post("/rovers/dispatch", response_model=List[Rover])
+async def dispatch_rovers(batch: BatchDispatchRequest):
+    """Dispatches many rovers in one request, with the same results as dispatching them one by one."""
+    rovers = _batch_rovers(batch)
+    programs = [rover.commands for rover in rovers]
+    # The runs only read the world, so they go to a thread; if the mines or the rovers changed
+    # meanwhile (or a read raced a change and failed), they are redone below
+    mines_version = db.mines_version
+    try:
+        results = await asyncio.to_thread(run_in_order, db, programs)
+    except Exception:
+        results = None
+
+    with db.transaction():
+        rovers = _batch_rovers(batch)
+        if (results is None or db.mines_version != mines_version
+                or any(rover.commands is not commands for rover, commands in zip(rovers, programs))):
+            results = run_in_order(db, [rover.commands for rover in rovers])
+
+        # Apply everything before the first await, so the batch is atomic for other requests
+        disarmed = []
+        for rover, result in zip(rovers, results):
+            rover.place(result.x, result.y, result.facing)
+            rover.executed_commands = rover.commands[:result.executed]
+            rover.path = Trajectory()
+            rover.follow(rover.executed_commands, db.map_width, db.map_height)
+            rover.status = RoverStatus.ELIMINATED if result.exploded else RoverStatus.FINISHED
+            db.save_rover(rover)
+            disarmed.extend(db.remove_mine(mine_id) for mine_id in result.disarmed)
+
+    for mine in disarmed:
+        await pin_cache.get(mine.serial_number)
+    return [rover.to_json() for rover in rovers]
+
+@app.post("/simulate", response_model=SimulationResult)
+async def simulate(request: SimulationRequest):
+    """Dry run: what a rover would do with these commands, without changing any state."""
+    if not _valid_commands.fullmatch(request.commands):
+        raise HTTPException(status_code=400, detail="Invalid commands. Only L, R, M, D are allowed.")
+    start = request.position or RoverPosition(x=0, y=0, facing='S')
+    if start.facing not in directions:
+        raise HTTPException(status_code=400, detail="Invalid facing. Only N, E, S, W are allowed.")
+    if not db.is_valid_position(start.x, start.y):
+        raise HTTPException(status_code=400, detail="Start position is outside the map")
+
+    result = simulation_cache.run(request.commands, start.x, start.y, start.facing)
+    return SimulationResult(
+        position=RoverPosition(x=result.x, y=result.y, facing=result.facing),
+        executed_commands=request.commands[:result.executed],
+        status=RoverStatus.ELIMINATED if result.exploded else RoverStatus.FINISHED,
+        disarmed_mines=[db.mines[mine_id].to_json() for mine_id in result.disarmed],
+    )
+
+# WebSocket for real-time control
+# Short keys for WebSocket responses in encoding=compact; messages and derived fields are dropped
+_COMPACT_KEYS = {
+    "command": "c", "commands": "c", "status": "s", "position": "p", "onMine": "m",
+    "mineIdDisarmed": "d", "pin": "pin", "executed": "n", "results": "r", "events": "e",
+    "index": "i", "roverId": "id",
+}
+
+def _compact_payload(payload):
+    """Short-key form of a WebSocket response: positions become [x, y, facing]."""
+    compact = {}
+    for key, value in payload.items():
+        short = _COMPACT_KEYS.get(key)
+        if short is None:
+            continue
+        if key == "position":
+            value = [value["x"], value["y"], value["facing"]]
+        elif key in ("results", "events"):
+            value = [_compact_payload(item) for item in value]
+        compact[short] = value
+    return compact
+
+class RealtimeSession:
+    """Rover state for one real-time control session on /ws/{rover_id}."""
+
+    def __init__(self, rover, direction_idx, on_mine):
+        self.rover = rover
+        self.direction_idx = direction_idx
+        self.on_mine = on_mine
+        self.eliminated = False
+
+    async def step(self, command):
+        """Runs one command and returns its response payload."""
+        with db.transaction():
+            response_payload, mine_obj = self._step(command)
+        if mine_obj is not None:
+            # The PIN is awaited outside the transaction; its fields were reserved in order
+            pin = await pin_cache.get(mine_obj.serial_number) # Off the event loop
+            response_payload["pin"] = pin
+            response_payload["message"] = f"Mine {mine_obj.id} successfully disarmed. PIN: {pin}"
+        return response_payload
+
+    def _step(self, command):
+        rover = self.rover
+        mine_obj = None
+        response_payload = {"command": command} # Start constructing response
+
+        if command == 'L':
+            self.direction_idx = (self.direction_idx - 1 + 4) % 4 # Ensure positive modulo
+            rover.facing = directions[self.direction_idx]
+            response_payload["status"] = "success"
+            response_payload["newFacing"] = rover.facing
+            response_payload["position"] = rover.position_json()
+
+        elif command == 'R':
+            self.direction_idx = (self.direction_idx + 1) % 4
+            rover.facing = directions[self.direction_idx]
+            response_payload["status"] = "success"
+            response_payload["newFacing"] = rover.facing
+            response_payload["position"] = rover.position_json()
+
+        elif command == 'M':
+            if self.on_mine:
+                rover.status = RoverStatus.ELIMINATED
+                self.eliminated = True
+                response_payload["status"] = "eliminated"
+                response_payload["message"] = "Rover eliminated! Moved on an active mine."
+                response_payload["position"] = rover.position_json()
+                db.save_rover(rover, pose_only=True)
+                return response_payload, None
+
+            dx, dy = direction_moves[rover.facing]
+            new_x = rover.x + dx
+            new_y = rover.y + dy
+
             if db.is_valid_position(new_x, new_y):
-                rover.position.x = new_x
-                rover.position.y = new_y
-                
+                rover.x = new_x
+                rover.y = new_y
+                response_payload["status"] = "success"
+                response_payload["newPosition"] = {"x": new_x, "y": new_y} # For clarity
+                response_payload["position"] = rover.position_json() # Send full new position object
+
                 # Check if landed on a mine
-                if db.grid[new_y][new_x] > 0:
-                    on_mine = True
+                if db.grid.get(new_x, new_y) > 0:
+                    self.on_mine = True
+                    response_payload["status"] = "warning" # Override status if on mine
+                    response_payload["message"] = "Rover moved onto a mine! Disarm before moving again."
+                    response_payload["onMine"] = True
                 else:
-                    on_mine = False
+                    self.on_mine = False
+                    response_payload["onMine"] = False
             else:
-                # Out of bounds, ignore move
-                pass
-        elif cmd == 'D':
-            # Disarming command - only works if we are on an active mine
-            if on_mine and db.grid[rover.position.y][rover.position.x] > 0:
-                # Find which mine is at this position
-                mine_id = None
-                for mid, mine in db.mines.items():
-                    if mine.x == rover.position.x and mine.y == rover.position.y:
-                        mine_id = mid
-                        break
+                response_payload["status"] = "error"
+                response_payload["message"] = "Cannot move outside map boundaries."
+                response_payload["position"] = rover.position_json() # Send current position
+
+        elif command == 'D':
+            if self.on_mine and db.is_valid_position(rover.x, rover.y) and \
+               db.grid.get(rover.x, rover.y) > 0:
+                mine_at_pos_id = db.mine_id_at(rover.x, rover.y)
                 
-                if mine_id is not None:
-                    mine = db.mines[mine_id]
-                    pin = db.find_pin(mine.serial_number)
-                    
-                    # Disarm the mine
-                    if db.is_valid_position(mine.x, mine.y):
-                        db.grid[mine.y][mine.x] = 0
-                    
-                    # Remove the mine
-                    del db.mines[mine_id]
-                    
-                    on_mine = False
+                if mine_at_pos_id is not None:
+                    mine_obj = db.remove_mine(mine_at_pos_id) # Clear from grid and store
+                    self.on_mine = False
+
+                    response_payload["status"] = "success"
+                    response_payload["mineIdDisarmed"] = mine_at_pos_id
+                    response_payload["pin"] = None
+                    response_payload["message"] = None
+                    response_payload["onMine"] = False
+                else: # Should not happen if on_mine is true and grid > 0
+                    response_payload["status"] = "error"
+                    response_payload["message"] = "Mine data inconsistency."
+                    response_payload["onMine"] = self.on_mine # Still on mine
             else:
-                # No mine to disarm
-                pass
-        
-        executed.append(cmd)
-    
-    rover.executed_commands = ''.join(executed)
-    
-    if exploded:
-        rover.status = RoverStatus.ELIMINATED
-    else:
-        rover.status = RoverStatus.FINISHED
-    
-    return rover
+                response_payload["status"] = "error"
+                response_payload["message"] = "No mine to disarm at this position."
+                response_payload["onMine"] = self.on_mine
+
+            response_payload["position"] = rover.position_json()
+
+        db.save_rover(rover, pose_only=True)
+        return response_payload, mine_obj
+
+    def log(self, commands):
+        """Adds executed commands to the rover's executed_commands and path for this session."""
+        self.rover.add_executed(commands)
+        self.rover.follow(commands, db.map_width, db.map_height)
+        with db.transaction():
+            if db.rovers.get(self.rover.id) is self.rover:
+                db.save_rover(self.rover, pose_only=True)
+
+    async def run_frame(self, frame, report):
+        """Runs a multi-command frame in order and returns one aggregated payload.
+
+        With report="final" the per-command results are left out, except for events:
+        commands that did not simply succeed, and disarms.
+        """
+        rover = self.rover
+        if not _valid_commands.fullmatch(frame):
+            return {"commands": frame, "status": "error", "message": "Invalid command. Only L, R, M, D are allowed."}
+        results = []
+        for command in frame:
+            results.append(await self.step(command))
+            if self.eliminated:
+                break
+        executed = len(results) - 1 if self.eliminated else len(results)
+        self.log(frame[:executed])
+
+        response_payload = {
+            "commands": frame,
+            "status": "eliminated" if self.eliminated else "success",
+            "executed": executed,
+            "position": rover.position_json(),
+            "onMine": self.on_mine,
+        }
+        if report == "final":
+            response_payload["events"] = [
+                dict(result, index=i) for i, result in enumerate(results)
+                if result["status"] != "success" or "pin" in result
+            ]
+        else:
+            response_payload["results"] = results
+        return response_payload
+
+@app.websocket("/ws/spectate")
+async def spectate(websocket: WebSocket):
+    """Read-only feed of the world: a snapshot, then coalesced rover and map updates."""
+    await websocket.accept()
+    subscriber = spectators.subscribe()
+
+    async def forward():
+        await websocket.send_json(spectators.snapshot())
+        while True:
+            await websocket.send_text(await subscriber.next())
+
+    # Sends run in their own task, so a slow watcher only delays itself; its updates merge meanwhile
+    sender = asyncio.create_task(forward())
+    try:
+        while True:
+            message = await websocket.receive()  # Spectators send nothing; this notices the disconnect
+            if message["type"] == "websocket.disconnect":
+                break
+    finally:
+        sender.cancel()
+        spectators.unsubscribe(subscriber)
 
-# WebSocket for real-time control
 @app.websocket("/ws/{rover_id}")
-async def websocket_endpoint(websocket: WebSocket, rover_id: int):
+async def websocket_endpoint(websocket: WebSocket, rover_id: int, report: str = "each", encoding: str = "json"):
+    """Real-time control: each text frame holds one command, or several run in order.
+
+    A multi-command frame gets one aggregated response; report=final keeps only the
+    final pose and events in it. encoding=compact sends responses with short keys.
+    """
     await websocket.accept()
 
+    if report not in ("each", "final") or encoding not in ("json", "compact"):
+        await websocket.send_json({"status": "error", "message": "Invalid options. Use report=each|final and encoding=json|compact."})
+        await websocket.close()
+        return
+
+    async def send(payload):
+        if encoding == "compact":
+            await websocket.send_text(json.dumps(_compact_payload(payload), separators=(",", ":")))
+        else:
+            await websocket.send_json(payload)
+
     if rover_id not in db.rovers:
-        await websocket.send_json({"status": "error", "message": "Rover not found"})
+        await send({"status": "error", "message": "Rover not found"})
         await websocket.close()
         return
 
@@ -424,7 +2801,7 @@ async def websocket_endpoint(websocket: WebSocket, rover_id: int):
         # If rover was MOVING from a dispatch, we might want to interrupt that or handle it.
         # For simplicity now, if it's ELIMINATED, we won't allow control.
         if rover.status == RoverStatus.ELIMINATED:
-            await websocket.send_json({"status": "error", "message": f"Rover is {rover.status}, cannot control"})
+            await send({"status": "error", "message": f"Rover is {rover.status}, cannot control"})
             await websocket.close()
             return
         # If it was MOVING from a prior dispatch, we'll override its command list
@@ -433,129 +2810,66 @@ async def websocket_endpoint(websocket: WebSocket, rover_id: int):
 
 
     # --- MODIFICATION: Start from current rover state ---
+    scheduler.cancel(rover_id) # An enqueued rover stops following its program
     rover.status = RoverStatus.MOVING # Set to MOVING for real-time session
     # rover.commands = "" # Clear pre-programmed commands
     rover.executed_commands = "" # Clear executed commands for this session
 
-    # Initialize direction_idx based on rover.position.facing
+    # Initialize direction_idx based on rover.facing
     try:
-        direction_idx = directions.index(rover.position.facing)
+        direction_idx = directions.index(rover.facing)
     except ValueError:
         # Fallback if facing is somehow invalid, default to South
-        print(f"Warning: Rover {rover_id} had invalid facing '{rover.position.facing}'. Defaulting to South.")
-        rover.position.facing = 'S'
+        print(f"Warning: Rover {rover_id} had invalid facing '{rover.facing}'. Defaulting to South.")
+        rover.facing = 'S'
         direction_idx = 2
 
     # Initialize on_mine based on current position
     on_mine = False
-    if db.is_valid_position(rover.position.x, rover.position.y) and \
-       db.grid[rover.position.y][rover.position.x] > 0:
+    if db.is_valid_position(rover.x, rover.y) and \
+       db.grid.get(rover.x, rover.y) > 0:
         on_mine = True
+    rover.path = Trajectory(rover.x, rover.y, rover.facing)
     # --- END MODIFICATION ---
+    session = RealtimeSession(rover, direction_idx, on_mine)
+    with db.transaction():
+        db.save_rover(rover)
 
-    await websocket.send_json({ # Send initial state to client
+    await send({ # Send initial state to client
         "status": "connected",
         "message": "Real-time control initiated.",
         "roverId": rover.id,
-        "position": rover.position.dict(),
+        "position": rover.position_json(),
         "onMine": on_mine
     })
 
 
     try:
         while True:
-            command = await websocket.receive_text()
-            response_payload = {"command": command} # Start constructing response
-
-            if command not in 'LRMD':
-                response_payload["status"] = "error"
-                response_payload["message"] = "Invalid command. Only L, R, M, D are allowed."
-                await websocket.send_json(response_payload)
-                continue
-
-            if command == 'L':
-                direction_idx = (direction_idx - 1 + 4) % 4 # Ensure positive modulo
-                rover.position.facing = directions[direction_idx]
-                response_payload["status"] = "success"
-                response_payload["newFacing"] = rover.position.facing
-                response_payload["position"] = rover.position.dict()
+            frame = await websocket.receive_text()
 
-            elif command == 'R':
-                direction_idx = (direction_idx + 1) % 4
-                rover.position.facing = directions[direction_idx]
-                response_payload["status"] = "success"
-                response_payload["newFacing"] = rover.position.facing
-                response_payload["position"] = rover.position.dict()
-
-            elif command == 'M':
-                if on_mine:
-                    rover.status = RoverStatus.ELIMINATED
-                    response_payload["status"] = "eliminated"
-                    response_payload["message"] = "Rover eliminated! Moved on an active mine."
-                    response_payload["position"] = rover.position.dict()
-                    await websocket.send_json(response_payload)
+            if len(frame) > 1:
+                await send(await session.run_frame(frame, report))
+                if session.eliminated:
                     break # End WebSocket session
+                continue
 
-                dx, dy = direction_moves[rover.position.facing]
-                new_x = rover.position.x + dx
-                new_y = rover.position.y + dy
-
-                if db.is_valid_position(new_x, new_y):
-                    rover.position.x = new_x
-                    rover.position.y = new_y
-                    response_payload["status"] = "success"
-                    response_payload["newPosition"] = {"x": new_x, "y": new_y} # For clarity
-                    response_payload["position"] = rover.position.dict() # Send full new position object
-
-                    # Check if landed on a mine
-                    if db.grid[new_y][new_x] > 0:
-                        on_mine = True
-                        response_payload["status"] = "warning" # Override status if on mine
-                        response_payload["message"] = "Rover moved onto a mine! Disarm before moving again."
-                        response_payload["onMine"] = True
-                    else:
-                        on_mine = False
-                        response_payload["onMine"] = False
-                else:
-                    response_payload["status"] = "error"
-                    response_payload["message"] = "Cannot move outside map boundaries."
-                    response_payload["position"] = rover.position.dict() # Send current position
-
-            elif command == 'D':
-                if on_mine and db.is_valid_position(rover.position.x, rover.position.y) and \
-                   db.grid[rover.position.y][rover.position.x] > 0:
-                    mine_at_pos_id = None
-                    for mid, m_obj in db.mines.items():
-                        if m_obj.x == rover.position.x and m_obj.y == rover.position.y:
-                            mine_at_pos_id = mid
-                            break
-                    
-                    if mine_at_pos_id is not None:
-                        mine_obj = db.mines[mine_at_pos_id]
-                        pin = db.find_pin(mine_obj.serial_number)
-                        db.grid[mine_obj.y][mine_obj.x] = 0 # Clear from grid
-                        del db.mines[mine_at_pos_id] # Remove from store
-                        on_mine = False
-
-                        response_payload["status"] = "success"
-                        response_payload["mineIdDisarmed"] = mine_at_pos_id
-                        response_payload["pin"] = pin
-                        response_payload["message"] = f"Mine {mine_at_pos_id} successfully disarmed. PIN: {pin}"
-                        response_payload["onMine"] = False
-                    else: # Should not happen if on_mine is true and grid > 0
-                        response_payload["status"] = "error"
-                        response_payload["message"] = "Mine data inconsistency."
-                        response_payload["onMine"] = on_mine # Still on mine
-                else:
-                    response_payload["status"] = "error"
-                    response_payload["message"] = "No mine to disarm at this position."
-                    response_payload["onMine"] = on_mine
-
-                response_payload["position"] = rover.position.dict()
+            command = frame
+            if not command or not _valid_commands.fullmatch(command):
+                await send({
+                    "command": command,
+                    "status": "error",
+                    "message": "Invalid command. Only L, R, M, D are allowed.",
+                })
+                continue
 
+            response_payload = await session.step(command)
+            if session.eliminated:
+                await send(response_payload)
+                break # End WebSocket session
 
-            rover.executed_commands += command # Log executed command for this session
-            await websocket.send_json(response_payload)
+            session.log(command) # Log executed command for this session
+            await send(response_payload)
 
     except WebSocketDisconnect:
         print(f"Client for rover {rover_id} disconnected during real-time control.")
@@ -565,7 +2879,10 @@ async def websocket_endpoint(websocket: WebSocket, rover_id: int):
         # The rover's position and facing are already updated.
         if rover.status == RoverStatus.MOVING: # Check to avoid overriding ELIMINATED
             rover.status = RoverStatus.FINISHED
-        print(f"Real-time control for rover {rover_id} ended. Final status: {rover.status}, Position: ({rover.position.x},{rover.position.y}) Facing: {rover.position.facing}")
+        with db.transaction():
+            if db.rovers.get(rover_id) is rover: # Not deleted meanwhile
+                db.save_rover(rover)
+        print(f"Real-time control for rover {rover_id} ended. Final status: {rover.status}, Position: ({rover.x},{rover.y}) Facing: {rover.facing}")
 
 origins = [
     "http://localhost",         
@@ -579,6 +2896,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"], 
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
 
 @app.get("/", response_class=HTMLResponse, include_in_schema=False)
@@ -590,10 +2908,6 @@ async def read_root():
 
 app.mount("/static", StaticFiles(directory="."), name="static")
 
-@app.get("/map", response_model=List[List[int]])
-async def get_map():
-    return db.get_grid()
-
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="localhost", port=8000)
\ No newline at end of file
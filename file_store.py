@@ -0,0 +1,250 @@
+import json
+import mmap
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+from contextlib import nullcontext
+
+import numpy as np
+
+SNAPSHOT_MAGIC = b"RVRSNAP1"
+FSYNC_POLICIES = ("always", "interval", "never")
+FSYNC_INTERVAL = 1.0  # Seconds between log fsyncs with the "interval" policy
+_SNAPSHOT = object()  # Marks a snapshot among the ops on the writer's queue
+
+def write_snapshot(path, state, log_generation, epoch):
+    """Writes a DataStore.snapshot(columns=True) as a compact binary file, atomically.
+
+    Layout: magic, header length, JSON header (everything but the mines, padded to 8
+    bytes), then int64 arrays of mine ids, xs and ys, then the serials. The arrays load
+    straight from an mmap. Serials are UTF-8 lines when none contains a newline (header
+    "serials": "lines"), which splits back fastest; otherwise an int64 array of end
+    offsets followed by the serials back to back.
+    """
+    ids, xs, ys, serials = state["mine_columns"]
+    text = "\n".join(serials)
+    if text.count("\n") == max(len(serials) - 1, 0):
+        columns, blob, layout = (ids, xs, ys), text.encode(), "lines"
+    else:
+        encoded = [serial.encode() for serial in serials]
+        ends = np.cumsum([len(serial) for serial in encoded], dtype=np.int64)
+        columns, blob, layout = (ids, xs, ys, ends), b"".join(encoded), "offsets"
+    header = {key: value for key, value in state.items() if key != "mine_columns"}
+    header.update(mines=len(ids), serials=layout, serial_bytes=len(blob), log=log_generation, epoch=epoch)
+    header = json.dumps(header).encode()
+    header += b" " * (-len(header) % 8)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(SNAPSHOT_MAGIC + struct.pack("<Q", len(header)) + header)
+        for column in columns:
+            f.write(np.asarray(column, dtype="<i8").tobytes())
+        f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def read_snapshot(path):
+    """Loads a file written by write_snapshot: (state for load_snapshot, log generation, epoch)."""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if mm[:8] != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a rover world snapshot")
+        header_size, = struct.unpack_from("<Q", mm, 8)
+        offset = 16 + header_size
+        state = json.loads(mm[16:offset])
+        count = state.pop("mines")
+        layout = state.pop("serials", "offsets")  # Older snapshots only have offsets
+        columns = []
+        for _ in range(3 if layout == "lines" else 4):
+            columns.append(np.frombuffer(mm, dtype="<i8", count=count, offset=offset))
+            offset += 8 * count
+        if layout == "lines":
+            serials = mm[offset:offset + state.pop("serial_bytes")].decode().split("\n") if count else []
+        else:
+            state.pop("serial_bytes", None)
+            ends = columns.pop().tolist()
+            blob = mm[offset:offset + (ends[-1] if count else 0)]
+            serials = [blob[start:end].decode() for start, end in zip([0] + ends, ends)]
+        if sys.byteorder == "big":
+            columns = [column.byteswap() for column in columns]
+        state["mine_columns"] = tuple(column.tobytes() for column in columns) + (serials,)  # Native int64 bytes
+        del columns  # Views into the mmap must go before it closes
+    return state, state.pop("log"), state.pop("epoch")
+
+def _fsync_directory(path):
+    # Makes a file's creation or removal in the directory durable
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class FileJournal:
+    """Keeps a single process's world on disk: an append-only op log plus binary snapshots.
+
+    Every DataStore mutation is recorded as an op and handed to a writer thread, so
+    requests never wait on the disk. Every snapshot_every ops, at the next sync(), the
+    world is written to snapshot.bin and a new log generation starts. On startup the
+    snapshot is loaded and its log replayed; a torn last line from a crash is dropped.
+
+    Only a clean close() leaves the "clean" marker. Without it, the end of the log may
+    have been lost, taking map versions clients already saw. So the store keeps its new
+    map epoch, which tells those clients to resync, instead of the saved one.
+
+    fsync is "always" (after every batch the writer takes off its queue), "interval"
+    (at most once a second) or "never" (left to the OS).
+    """
+
+    def __init__(self, directory, fsync="interval", snapshot_every=100000):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync policy must be one of {', '.join(FSYNC_POLICIES)}")
+        self.directory = directory
+        self.fsync = fsync
+        self.snapshot_every = snapshot_every
+        self.store = None
+        self.generation = 0  # Log the ops since the last snapshot go to
+        self.ops_since_snapshot = 0
+        self.replaying = False
+        self.queue = queue.SimpleQueue()
+        self.writer = None
+        self.error = None
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _log_path(self, generation):
+        return self._path(f"ops-{generation}.log")
+
+    def open(self, store):
+        self.store = store
+        os.makedirs(self.directory, exist_ok=True)
+        clean = os.path.exists(self._path("clean"))
+        if clean:
+            os.remove(self._path("clean"))  # Until the next close(), a crash is possible
+            _fsync_directory(self.directory)
+        if os.path.exists(self._path("snapshot.bin")):
+            state, self.generation, epoch = read_snapshot(self._path("snapshot.bin"))
+            if clean:
+                store.map_epoch = epoch
+            store.load_snapshot(state)
+        else:
+            write_snapshot(self._path("snapshot.bin"), store.snapshot(columns=True), 0, store.map_epoch)
+        self._replay(store)
+        for name in os.listdir(self.directory):
+            if name.startswith("ops-") and name != f"ops-{self.generation}.log":
+                os.remove(self._path(name))  # Left behind by a crash right after a snapshot
+        self.writer = threading.Thread(target=self._write_loop, args=(open(self._log_path(self.generation), "ab"),),
+                                       name="rover-journal", daemon=True)
+        self.writer.start()
+
+    def _replay(self, store):
+        path = self._log_path(self.generation)
+        if not os.path.exists(path):
+            return
+        self.replaying = True
+        good = 0
+        try:
+            with open(path, "rb") as f:
+                for line in f:
+                    try:
+                        op = json.loads(line) if line.endswith(b"\n") else None
+                    except ValueError:
+                        op = None
+                    if op is None:
+                        break  # Torn write: everything before it is intact
+                    store.apply_op(op)
+                    good += len(line)
+                    self.ops_since_snapshot += 1
+        finally:
+            self.replaying = False
+        if good < os.path.getsize(path):
+            os.truncate(path, good)
+
+    def close(self):
+        if self.writer is None:
+            return
+        if self.error is None:
+            self._snapshot()  # So the next start only has the snapshot to load
+        self.queue.put(None)
+        self.writer.join()
+        self.writer = None
+        if self.error is None:
+            with open(self._path("clean"), "wb") as f:
+                os.fsync(f.fileno())
+            _fsync_directory(self.directory)
+
+    def sync(self, store):
+        # Called between requests and ticks, when the store is consistent: a safe point to snapshot
+        if self.error is not None:
+            raise RuntimeError("Writing the world journal failed") from self.error
+        if self.ops_since_snapshot >= self.snapshot_every:
+            self._snapshot()
+
+    def transaction(self, store):
+        return nullcontext()  # One process: nothing to coordinate with
+
+    def record(self, op):
+        if self.replaying:
+            return
+        self.ops_since_snapshot += 1
+        self.queue.put(op)
+
+    def _snapshot(self):
+        self.generation += 1
+        self.ops_since_snapshot = 0
+        # This runs on the event loop, so it only copies the mine columns and the list of
+        # rovers; dumping the rovers, encoding and writing are the writer thread's
+        state = self.store.snapshot(columns=True, live_rovers=True)
+        self.queue.put((_SNAPSHOT, state, self.generation, self.store.map_epoch))
+
+    def _write_loop(self, log):
+        last_fsync = time.monotonic()
+        dirty = False  # Written but not yet fsynced
+        try:
+            while True:
+                try:
+                    batch = [self.queue.get(timeout=FSYNC_INTERVAL if dirty else None)]
+                except queue.Empty:
+                    batch = []  # Idle: only the interval fsync below
+                while True:  # Group everything queued meanwhile into one write
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                lines = []
+                for item in batch:
+                    if item is not None and item[0] is not _SNAPSHOT:
+                        lines.append(json.dumps(item, separators=(",", ":")).encode() + b"\n")
+                        continue
+                    # Stop or snapshot: everything before it goes to disk first
+                    log.write(b"".join(lines))
+                    lines = []
+                    log.flush()
+                    os.fsync(log.fileno())
+                    dirty = False
+                    if item is None:
+                        log.close()
+                        return
+                    log = self._rotate(log, *item[1:])
+                if lines:
+                    log.write(b"".join(lines))
+                    log.flush()
+                    dirty = self.fsync != "never"
+                if dirty and (self.fsync == "always" or time.monotonic() - last_fsync >= FSYNC_INTERVAL):
+                    os.fsync(log.fileno())
+                    last_fsync = time.monotonic()
+                    dirty = False
+        except BaseException as e:
+            self.error = e
+            log.close()
+
+    def _rotate(self, log, state, generation, epoch):
+        # The new log exists before the snapshot that points at it; the old one goes after
+        log.close()
+        new_log = open(self._log_path(generation), "wb")
+        state["rovers"] = [rover.to_json() for rover in state["rovers"]]
+        write_snapshot(self._path("snapshot.bin"), state, generation, epoch)
+        os.remove(self._log_path(generation - 1))
+        return new_log
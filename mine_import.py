@@ -0,0 +1,87 @@
+"""Reads mine layouts in the map1.txt / mines.txt format.
+
+A map file is an "H W" header followed by H rows of W space-separated 0/1 cells, and
+a serial file has one serial number per line. The mines are the 1 cells in row-major
+order, and they take the serials in the order given; extra serials are left unused.
+
+Usage: python mine_import.py MAP_FILE SERIAL_FILE [--url URL] [--replace]
+"""
+import argparse
+import itertools
+
+class MineFileError(ValueError):
+    pass
+
+class MineLayoutParser:
+    """Parses map file lines followed by serial lines as they arrive.
+
+    feed() takes one line at a time and finish() returns (height, width, [(x, y, serial)]),
+    so a layout can be read without holding the text it came from.
+    """
+
+    def __init__(self):
+        self.height = self.width = None
+        self.rows = 0
+        self.cells = []  # (x, y) of every mine, in row-major order
+        self.mines = []
+
+    def feed(self, line):
+        line = line.strip()
+        if not line:
+            return
+        if self.height is None:
+            header = line.split()
+            if len(header) != 2 or not all(value.isdigit() for value in header):
+                raise MineFileError("The map must start with an 'H W' header")
+            self.height, self.width = int(header[0]), int(header[1])
+            if self.height <= 0 or self.width <= 0:
+                raise MineFileError("Height and width must be positive")
+        elif self.rows < self.height:
+            y = self.rows
+            values = line.split()
+            if len(values) != self.width:
+                raise MineFileError(f"Map row {y} has {len(values)} cells, expected {self.width}")
+            for x, value in enumerate(values):
+                if value == "1":
+                    self.cells.append((x, y))
+                elif value != "0":
+                    raise MineFileError(f"Map cell ({x}, {y}) is {value!r}, expected 0 or 1")
+            self.rows += 1
+        elif len(self.mines) < len(self.cells):
+            x, y = self.cells[len(self.mines)]
+            self.mines.append((x, y, line))
+
+    def finish(self):
+        if self.height is None:
+            raise MineFileError("The map must start with an 'H W' header")
+        if self.rows < self.height:
+            raise MineFileError(f"Expected {self.height} map rows, got {self.rows}")
+        if len(self.mines) < len(self.cells):
+            raise MineFileError(f"The map has {len(self.cells)} mines but only {len(self.mines)} serial numbers were given")
+        return self.height, self.width, self.mines
+
+def parse_mine_layout(lines):
+    """Parses map file lines followed by serial lines into (height, width, [(x, y, serial)])."""
+    parser = MineLayoutParser()
+    for line in lines:
+        parser.feed(line)
+    return parser.finish()
+
+def read_mine_files(map_path, serials_path):
+    with open(map_path) as map_file, open(serials_path) as serials_file:
+        return parse_mine_layout(itertools.chain(map_file, serials_file))
+
+def main():
+    parser = argparse.ArgumentParser(description='Load a map file and serial list into a rover server')
+    parser.add_argument('map_file', help='Map file: "H W" header, then H rows of 0/1 cells')
+    parser.add_argument('serial_file', help='Serial numbers, one per line')
+    parser.add_argument('--url', default='http://localhost:8000', help='Base URL of the server')
+    parser.add_argument('--replace', action='store_true', help='Remove the existing mines first')
+    args = parser.parse_args()
+
+    from RoverOperator import RoverOperator
+    height, width, mines = read_mine_files(args.map_file, args.serial_file)
+    RoverOperator(args.url).bulk_create_mines(mines, height, width, args.replace)
+
+if __name__ == "__main__":
+    main()
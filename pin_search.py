@@ -0,0 +1,78 @@
+import hashlib
+
+# How often (in PINs) a worker checks whether an earlier chunk already found a PIN
+PIN_CANCEL_CHECK_INTERVAL = 4096
+NO_PIN_FOUND = 2 ** 62
+
+# Last digit of a candidate PIN, allocated once instead of on every iteration
+DIGITS = [str(d).encode() for d in range(10)]
+
+# Shared with the pool workers: per search slot, the start of the lowest chunk that found a PIN
+_pin_found_at = None
+
+def _init_pin_worker(found_at):
+    global _pin_found_at
+    _pin_found_at = found_at
+
+def zero_prefix_threshold(difficulty):
+    """Returns the byte string that raw digests starting with `difficulty` zero hex digits sort below."""
+    nbytes = (difficulty + 1) // 2
+    # e.g. 6 digits -> b'\x00\x00\x01', 5 digits -> b'\x00\x00\x10'
+    return (1 << (4 * (2 * nbytes - difficulty))).to_bytes(nbytes, 'big')
+
+class PinSearchEngine:
+    """Searches PINs for one serial, reusing the SHA-256 state of the already hashed serial.
+
+    Candidates are hashed as serial + str(pin) like the original search. A PIN qualifies
+    when its raw digest sorts below a precomputed threshold, which is the same as the hex
+    digest starting with `difficulty` zeros.
+    """
+
+    def __init__(self, serial, difficulty):
+        self.base = hashlib.sha256(serial.encode())
+        self.difficulty = difficulty
+        self.threshold = zero_prefix_threshold(difficulty) if difficulty > 0 else None
+
+    def search(self, start, stop):
+        """Returns the first PIN in [start, stop) that qualifies, or None."""
+        if start >= stop:
+            return None
+        if self.threshold is None:
+            return start
+        base = self.base
+        threshold = self.threshold
+        digits = DIGITS
+        # PINs are walked ten at a time: str(pin // 10) is hashed once per ten candidates,
+        # and each candidate only appends its last digit to a copy of that state
+        for tens in range(start // 10, (stop - 1) // 10 + 1):
+            first = tens * 10
+            state = base.copy()
+            if tens:
+                state.update(str(tens).encode())
+            for d in range(max(start - first, 0), min(stop - first, 10)):
+                candidate = state.copy()
+                candidate.update(digits[d])
+                if candidate.digest() < threshold:
+                    return first + d
+        return None
+
+def search_pin_range(serial, start, stop, difficulty=6, slot=None):
+    """Returns the first PIN in [start, stop) whose hash has `difficulty` leading zeros, or None."""
+    engine = PinSearchEngine(serial, difficulty)
+    if slot is None:
+        return engine.search(start, stop)
+    for block in range(start, stop, PIN_CANCEL_CHECK_INTERVAL):
+        # Give up once a chunk before this one has found a PIN: the smaller one wins
+        if _pin_found_at[slot] < start:
+            return None
+        pin = engine.search(block, min(block + PIN_CANCEL_CHECK_INTERVAL, stop))
+        if pin is not None:
+            _pin_found_at[slot] = min(_pin_found_at[slot], start)
+            return pin
+    return None
+
+def find_pin(serial, difficulty=6, limit=100000):
+    """Computes a PIN for the mine using a brute-force search on SHA256 hashes."""
+    pin = search_pin_range(serial, 0, limit + 1, difficulty)
+    # Limiting search to prevent infinite loops
+    return limit if pin is None else pin
@@ -1,5 +1,6 @@
 document.addEventListener("DOMContentLoaded", () => {
   const API_URL = "http://localhost:8000";
+  const LIST_PAGE_SIZE = 500; // Records per GET /mines or /rovers request
   let currentMap = [];
   let currentRovers = [];
   let currentMines = [];
@@ -8,6 +9,13 @@ document.addEventListener("DOMContentLoaded", () => {
   let webSocket = null;
   let mapWidth = 10;
   let mapHeight = 10;
+  let mapETag = null; // Version of currentMap, sent back so unchanged maps cost a 304
+  let mapVersion = null; // Map version currentMap reflects, for /map/changes
+  let mapEpoch = null;
+  let mapSyncing = null; // syncMap() in flight; feed updates wait for it
+  let mapSyncAgain = false;
+  let minesFetching = null; // fetchMines() in flight for the feed
+  let minesFetchAgain = false;
 
   // --- DOM Elements ---
   const mapGrid = document.getElementById("map-grid");
@@ -117,11 +125,95 @@ document.addEventListener("DOMContentLoaded", () => {
     }
   }
 
+  // Fetches every record of a list endpoint a page at a time, following X-Next-Cursor
+  async function fetchAllPages(endpoint) {
+    try {
+      const records = [];
+      let cursor = null;
+      do {
+        let url = `${API_URL}${endpoint}?limit=${LIST_PAGE_SIZE}`;
+        if (cursor !== null) url += `&cursor=${encodeURIComponent(cursor)}`;
+        const response = await fetch(url);
+        if (!response.ok) {
+          throw new Error(`HTTP error ${response.status}: ${await response.text()}`);
+        }
+        records.push(...(await response.json()));
+        cursor = response.headers.get("X-Next-Cursor");
+      } while (cursor !== null);
+      return records;
+    } catch (error) {
+      logStatus(`API Error: ${error.message}`, "error");
+      console.error("API Error:", error);
+      throw error;
+    }
+  }
+
   // --- Map Functions ---
+  // Decodes the binary GET /map body (see encode_map in fast_api_server.py)
+  function decodeMap(buffer) {
+    const view = new DataView(buffer);
+    const magic = String.fromCharCode(
+      ...new Uint8Array(buffer, 0, 4)
+    );
+    if (magic !== "RVMP") throw new Error("Not a binary map");
+    const encoding = view.getUint8(5);
+    const height = view.getUint32(8, true);
+    const width = view.getUint32(12, true);
+    const body = new Uint8Array(buffer, 24);
+    const rows = Array.from({ length: height }, () => new Array(width).fill(0));
+
+    if (encoding === 1) {
+      // Packed bits, most significant bit first
+      for (let offset = 0; offset < height * width; offset++) {
+        if (body[offset >> 3] & (0x80 >> (offset & 7))) {
+          rows[Math.floor(offset / width)][offset % width] = 1;
+        }
+      }
+    } else if (encoding === 2) {
+      // Varint run lengths alternating empty / occupied, starting with empty
+      let offset = 0;
+      let occupied = false;
+      let value = 0;
+      let scale = 1;
+      for (const byte of body) {
+        value += (byte & 0x7f) * scale;
+        scale *= 128;
+        if (byte & 0x80) continue;
+        if (occupied) {
+          for (let i = offset; i < offset + value; i++) {
+            rows[Math.floor(i / width)][i % width] = 1;
+          }
+        }
+        offset += value;
+        occupied = !occupied;
+        value = 0;
+        scale = 1;
+      }
+    } else {
+      throw new Error(`Unknown map encoding ${encoding}`);
+    }
+    return rows;
+  }
+
   async function fetchMap() {
     try {
       logStatus("Fetching map...");
-      currentMap = await fetchAPI("/map");
+      const headers = { Accept: "application/octet-stream" };
+      if (mapETag) headers["If-None-Match"] = mapETag;
+      const response = await fetch(`${API_URL}/map`, { headers });
+      if (response.status === 304) {
+        logStatus("Map unchanged.", "success");
+        renderMap();
+        return;
+      }
+      if (!response.ok) {
+        throw new Error(`HTTP error ${response.status}`);
+      }
+      const buffer = await response.arrayBuffer();
+      currentMap = decodeMap(buffer);
+      mapVersion = Number(new DataView(buffer).getBigUint64(16, true));
+      mapETag = response.headers.get("ETag");
+      mapEpoch = mapETag ? mapETag.replace(/"/g, "").split("-")[0] : null;
       if (currentMap && currentMap.length > 0) {
         mapHeight = currentMap.length;
         mapWidth = currentMap[0].length;
@@ -134,7 +226,57 @@ document.addEventListener("DOMContentLoaded", () => {
         mapGrid.innerHTML = "Failed to load map.";
       }
     } catch (error) {
+      logStatus(`API Error: ${error.message}`, "error");
       mapGrid.innerHTML = "Failed to load map.";
+    }
+  }
+
+  // Applies change events (from /map/changes or the spectator feed) to currentMap.
+  // Returns true if some cell gained a mine that currentMines doesn't have yet.
+  function applyMapChanges(changes, version) {
+    let unknownMine = false;
+    for (const change of changes) {
+      if (change.type === "cell") {
+        currentMap[change.y][change.x] = change.value;
+        if (change.value) {
+          if (!currentMines.some((m) => m.x === change.x && m.y === change.y)) unknownMine = true;
+        } else {
+          currentMines = currentMines.filter((m) => m.x !== change.x || m.y !== change.y);
+        }
+      } else if (change.type === "resize") {
+        const oldMap = currentMap;
+        currentMap = Array.from({ length: change.height }, (_, y) =>
+          Array.from({ length: change.width }, (_, x) =>
+            oldMap[y] && oldMap[y][x] ? oldMap[y][x] : 0
+          )
+        );
+        currentMines = currentMines.filter((m) => m.x < change.width && m.y < change.height);
+      }
+    }
+    mapVersion = version;
+    mapETag = null; // currentMap no longer matches the last full fetch
+    mapHeight = currentMap.length;
+    mapWidth = currentMap.length > 0 ? currentMap[0].length : 0;
+    mapHeightInput.value = mapHeight;
+    mapWidthInput.value = mapWidth;
+    if (changes.length > 0) renderMinesList();
+    return unknownMine;
+  }
+
+  // Applies the cell changes since mapVersion instead of refetching the whole grid
+  async function syncMap() {
+    if (mapVersion === null) return fetchMap();
+    try {
+      const params = new URLSearchParams({ since: mapVersion });
+      if (mapEpoch) params.set("epoch", mapEpoch);
+      const feed = await fetchAPI(`/map/changes?${params}`);
+      if (feed.resync) return fetchMap(); // Too far behind the change log
+      if (applyMapChanges(feed.changes, feed.version)) {
+        await fetchMines(); // Renders the map too
+      } else {
+        renderMap();
+      }
+    } catch (error) {
       // Error already logged by fetchAPI
     }
   }
@@ -245,7 +387,7 @@ document.addEventListener("DOMContentLoaded", () => {
         body: JSON.stringify({ width: newWidth, height: newHeight }),
       });
       logStatus("Map size updated.", "success");
-      await fetchMap(); // Re-fetch and render the map
+      await syncMap(); // Apply the resize to the local map
       await fetchMines(); // Mines might have been removed if outside new bounds
       await fetchRovers(); // Rovers might reset or need re-evaluation
     } catch (error) {
@@ -257,7 +399,7 @@ document.addEventListener("DOMContentLoaded", () => {
   async function fetchRovers() {
     try {
       logStatus("Fetching rovers...");
-      currentRovers = await fetchAPI("/rovers");
+      currentRovers = await fetchAllPages("/rovers");
       renderRoversList();
       updateRealtimeRoverSelect();
       logStatus("Rovers loaded.", "success");
@@ -384,6 +526,7 @@ document.addEventListener("DOMContentLoaded", () => {
         "success"
       );
       await fetchRovers(); // Refresh rover status and list
+      await syncMap(); // Mines disarmed during the run
       selectRover(selectedRoverId); // Re-select to update details panel
     } catch (error) {
       logStatus(`Failed to dispatch rover ${selectedRoverId}.`, "error");
@@ -414,7 +557,7 @@ document.addEventListener("DOMContentLoaded", () => {
   async function fetchMines() {
     try {
       logStatus("Fetching mines...");
-      currentMines = await fetchAPI("/mines");
+      currentMines = await fetchAllPages("/mines");
       renderMinesList();
       logStatus("Mines loaded.", "success");
       renderMap(); // Update map with mine locations
@@ -552,6 +695,7 @@ document.addEventListener("DOMContentLoaded", () => {
       logStatus(`Mine ${selectedMineId} updated successfully.`, "success");
       hideUpdateMineForm();
       await fetchMines(); // Refresh list and map
+      await syncMap();
       // Reselect the mine to show updated details, but fetchMines already re-renders list
       // selectMine(selectedMineId); // Might cause infinite loop if fetchMines triggers selection? Check needed.
     } catch (error) {
@@ -596,6 +740,7 @@ document.addEventListener("DOMContentLoaded", () => {
       mineYInput.value = "";
       mineSerialInput.value = "";
       await fetchMines(); // Refresh list and map
+      await syncMap();
     } catch (error) {
       logStatus(`Failed to create mine: ${error.message}`, "error"); // More specific error
     }
@@ -615,6 +760,7 @@ document.addEventListener("DOMContentLoaded", () => {
       hideUpdateMineForm(); // Hide update form if it was open
       selectMine(null); // Update UI
       await fetchMines(); // Refresh list and map
+      await syncMap();
     } catch (error) {
       logStatus(`Failed to delete mine ${selectedMineId}.`, "error");
     }
@@ -723,6 +869,7 @@ document.addEventListener("DOMContentLoaded", () => {
 
         if (shouldFetchMines) {
           fetchMines(); // Fetch mines if a 'D' command was successful
+          syncMap();
         }
 
         if (selectedRoverId === roverIdNum && roverToUpdate) {
@@ -832,12 +979,86 @@ document.addEventListener("DOMContentLoaded", () => {
   btnWsM.addEventListener("click", () => sendWsCommand("M"));
   btnWsD.addEventListener("click", () => sendWsCommand("D"));
 
+  // --- Spectator feed: keeps the map and rovers current without polling ---
+  function connectSpectator() {
+    const wsProtocol = window.location.protocol === "https:" ? "wss:" : "ws:";
+    const socket = new WebSocket(`${wsProtocol}//${window.location.host}/ws/spectate`);
+
+    socket.onmessage = (event) => {
+      const update = JSON.parse(event.data);
+      if (update.type === "snapshot") {
+        if (update.epoch !== mapEpoch || update.version !== mapVersion) feedMapSync(true);
+        return;
+      }
+      if (update.type !== "update") return;
+      // Our own requests may have synced the map past some of these changes already
+      const fresh = update.changes.filter((c) => c.version > mapVersion);
+      if (update.resync || update.epoch !== mapEpoch || mapSyncing) {
+        feedMapSync(update.resync || update.epoch !== mapEpoch);
+      } else if (fresh.length > 0 && fresh[0].version > mapVersion + 1) {
+        feedMapSync(false); // Missed some changes before this update: catch up over HTTP
+      } else if (applyMapChanges(fresh, Math.max(mapVersion, update.version))) {
+        feedMinesFetch(); // A mine we have no ID or serial number for
+      }
+      let unknownRover = false;
+      for (const data of update.rovers) {
+        const rover = currentRovers.find((r) => r.id === data.id);
+        if (rover) {
+          rover.status = data.status;
+          rover.position = data.position;
+        } else {
+          unknownRover = true;
+        }
+      }
+      currentRovers = currentRovers.filter((r) => !update.removed.includes(r.id));
+      if (unknownRover) {
+        fetchRovers(); // Created elsewhere, needs its full record
+        return;
+      }
+      renderRoversList();
+      renderMap();
+    };
+
+    socket.onclose = () => setTimeout(connectSpectator, 2000); // Server restarted or went away
+  }
+
+  // One syncMap() at a time; updates arriving meanwhile are caught up by another run after it
+  function feedMapSync(withMines) {
+    if (withMines) feedMinesFetch();
+    if (mapSyncing) {
+      mapSyncAgain = true;
+      return;
+    }
+    mapSyncing = syncMap().finally(() => {
+      mapSyncing = null;
+      if (mapSyncAgain) {
+        mapSyncAgain = false;
+        feedMapSync(false);
+      }
+    });
+  }
+
+  function feedMinesFetch() {
+    if (minesFetching) {
+      minesFetchAgain = true;
+      return;
+    }
+    minesFetching = fetchMines().finally(() => {
+      minesFetching = null;
+      if (minesFetchAgain) {
+        minesFetchAgain = false;
+        feedMinesFetch();
+      }
+    });
+  }
+
   // --- Initial Load ---
   async function initialize() {
     logStatus("Initializing Rover Management System...");
     await fetchMap();
     await fetchMines();
     await fetchRovers();
+    connectSpectator();
     logStatus("Initialization complete.");
   }
 
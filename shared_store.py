@@ -0,0 +1,177 @@
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+LOCK_TIMEOUT = 30  # Seconds to wait for another worker's write transaction before failing
+
+class SQLiteJournal:
+    """Shares one world between server processes through a SQLite database in WAL mode.
+
+    Every DataStore mutation is recorded as an op. Workers replay the ops they haven't
+    seen before serving a request, and make their own changes inside transaction(),
+    which takes SQLite's write lock, catches up first and appends the new ops on commit.
+    Every snapshot_every ops the whole world is written out, by a background thread,
+    and the ops the previous snapshot covered are dropped: the journal stays short, and
+    a worker less than snapshot_every ops behind still catches up from the ops alone.
+
+    Catching up never waits, as WAL readers don't block on writers, and is skipped when
+    no other worker has committed since. Taking the write lock does wait: a request
+    that changes the world blocks its worker's event loop while another worker is inside
+    a transaction, which only lasts as long as that request's own changes (at most
+    LOCK_TIMEOUT seconds, then sqlite3.OperationalError).
+    """
+
+    def __init__(self, path, snapshot_every=10000):
+        self.path = path
+        self.snapshot_every = snapshot_every
+        self.conn = None
+        self.seq = -1  # Last op applied to the store; the base snapshot is seq 0
+        self.snapshot_seq = 0
+        self.data_version = None  # PRAGMA data_version at the last catch-up
+        self.compactor = None  # Thread writing a snapshot, if one is running
+        self.pending = None  # Ops of the transaction in progress
+        self.replaying = False
+        self.stale = False  # Set when the store applied ops out of journal order
+
+    def open(self, store):
+        # Autocommit mode: transactions are started explicitly below
+        self.conn = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # FULL, not NORMAL: a power loss must not undo a commit whose map version clients
+        # already saw, as the epoch in meta would then vouch for versions that went back
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS ops (seq INTEGER PRIMARY KEY AUTOINCREMENT, op TEXT NOT NULL)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS snapshot (id INTEGER PRIMARY KEY CHECK (id = 0), seq INTEGER NOT NULL, state TEXT NOT NULL)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            # The first worker to start sets up the world; the others adopt it
+            self.conn.execute("INSERT OR IGNORE INTO meta VALUES ('epoch', ?)", (store.map_epoch,))
+            self.conn.execute("INSERT OR IGNORE INTO snapshot VALUES (0, 0, ?)", (json.dumps(store.snapshot()),))
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        store.map_epoch = self.conn.execute("SELECT value FROM meta WHERE key = 'epoch'").fetchone()[0]
+        self.sync(store)
+
+    def close(self):
+        if self.compactor is not None:
+            self.compactor.join()
+            self.compactor = None
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def sync(self, store):
+        """Brings the store up to date with the journal."""
+        if self.pending is not None:
+            return  # Already caught up when the transaction started
+        # Changes only when another connection commits: nothing new means nothing to read
+        version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self.data_version and not self.stale:
+            return
+        self.data_version = version
+        self.conn.execute("BEGIN")
+        try:
+            self._catch_up(store)
+        finally:
+            self.conn.execute("COMMIT")
+
+    def _catch_up(self, store):
+        if self.stale:
+            self.seq = -1
+            self.stale = False
+        self.replaying = True
+        try:
+            snapshot_seq = self.conn.execute("SELECT seq FROM snapshot").fetchone()[0]
+            if snapshot_seq > self.seq:
+                first = self.conn.execute("SELECT MIN(seq) FROM ops").fetchone()[0]
+                if first is None or first > self.seq + 1:
+                    # The ops since our last one were compacted away, so start from the snapshot
+                    state = self.conn.execute("SELECT state FROM snapshot").fetchone()[0]
+                    store.load_snapshot(json.loads(state))
+                    self.seq = snapshot_seq
+                self.snapshot_seq = snapshot_seq
+            for seq, op in self.conn.execute("SELECT seq, op FROM ops WHERE seq > ? ORDER BY seq", (self.seq,)):
+                store.apply_op(json.loads(op))
+                self.seq = seq
+        finally:
+            self.replaying = False
+
+    @contextmanager
+    def transaction(self, store):
+        if self.pending is not None:
+            yield  # Nested: part of the outer transaction
+            return
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._catch_up(store)
+            self.pending = []
+            yield
+            if self.pending:
+                self.conn.executemany("INSERT INTO ops (op) VALUES (?)", [(json.dumps(op),) for op in self.pending])
+                self.seq = self.conn.execute("SELECT MAX(seq) FROM ops").fetchone()[0]
+                if self.seq - self.snapshot_seq >= self.snapshot_every:
+                    # Another worker may have compacted since we last loaded a snapshot
+                    self.snapshot_seq = self.conn.execute("SELECT seq FROM snapshot").fetchone()[0]
+                    if self.seq - self.snapshot_seq >= self.snapshot_every:
+                        self._compact(store)
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            if self.pending:
+                # The store already has changes the journal won't: rebuild it from the journal
+                self.pending = None
+                self.stale = True
+                self.sync(store)
+            raise
+        finally:
+            self.pending = None
+
+    def record(self, op):
+        if self.replaying:
+            return
+        if self.pending is not None:
+            self.pending.append(op)
+            return
+        # A change made outside transaction(): append it on its own, and if other workers'
+        # ops came first, rebuild so the store applies everything in journal order
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            behind = self.conn.execute("SELECT COUNT(*) FROM ops WHERE seq > ?", (self.seq,)).fetchone()[0]
+            self.seq = self.conn.execute("INSERT INTO ops (op) VALUES (?)", (json.dumps(op),)).lastrowid
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        if behind:
+            self.stale = True
+
+    def _compact(self, store):
+        if self.compactor is not None and self.compactor.is_alive():
+            return  # The next transaction over the limit tries again
+        # The store is at self.seq now; encoding and writing it happen off the event loop
+        self.snapshot_seq = self.seq
+        self.compactor = threading.Thread(target=self._write_snapshot, args=(store.snapshot(), self.seq),
+                                          name="rover-compactor", daemon=True)
+        self.compactor.start()
+
+    def _write_snapshot(self, state, seq):
+        state = json.dumps(state)
+        conn = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT, isolation_level=None)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                previous = conn.execute("SELECT seq FROM snapshot").fetchone()[0]
+                if previous < seq:  # Another worker may have written a newer one meanwhile
+                    conn.execute("UPDATE snapshot SET seq = ?, state = ? WHERE id = 0", (seq, state))
+                    # Keep the ops after the previous snapshot, so workers behind this one replay them
+                    conn.execute("DELETE FROM ops WHERE seq <= ?", (previous,))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
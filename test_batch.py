@@ -0,0 +1,59 @@
+import random
+
+import pytest
+
+def setup_world(client, width, height, mine_cells, programs):
+    assert client.put("/map", json={"height": height, "width": width}).status_code == 200
+    if mine_cells:
+        mines = [{"x": x, "y": y, "serial_number": f"SN{i}"} for i, (x, y) in enumerate(mine_cells)]
+        assert client.post("/mines/bulk", json=mines).status_code in (200, 201)
+    return [client.post("/rovers", json={"commands": program}).json()["id"] for program in programs]
+
+def outcome(client, rovers):
+    mines = sorted((mine["x"], mine["y"]) for mine in client.get("/mines").json())
+    return [{key: rover[key] for key in ("position", "status", "executed_commands")} for rover in rovers], mines
+
+def dispatch_batch(client, width, height, mine_cells, programs):
+    ids = setup_world(client, width, height, mine_cells, programs)
+    response = client.post("/rovers/dispatch", json={"rover_ids": ids})
+    assert response.status_code == 200
+    return outcome(client, response.json())
+
+def dispatch_one_by_one(client, width, height, mine_cells, programs):
+    ids = setup_world(client, width, height, mine_cells, programs)
+    for rover_id in ids:
+        assert client.post(f"/rovers/{rover_id}/dispatch").status_code == 200
+    return outcome(client, [client.get(f"/rovers/{rover_id}").json() for rover_id in ids])
+
+def check_batch(client, reset_world, width, height, mine_cells, programs):
+    batched = dispatch_batch(client, width, height, mine_cells, programs)
+    reset_world()
+    assert batched == dispatch_one_by_one(client, width, height, mine_cells, programs)
+    return batched
+
+def test_rover_does_not_meet_mine_it_disarmed(client, reset_world):
+    rovers, mines = check_batch(client, reset_world, 3, 6, [(0, 1), (0, 3)], ["MDRRMRRMMMDRRMRRMM"])
+    assert rovers[0]["position"] == {"x": 0, "y": 4, "facing": "S"}
+    assert rovers[0]["status"] == "Finished" and mines == []
+
+@pytest.mark.parametrize("seed", range(20))
+def test_batch_matches_sequential_dispatch(client, reset_world, seed):
+    rng = random.Random(seed)
+    width, height = rng.randint(1, 8), rng.randint(1, 8)
+    cells = [(x, y) for x in range(width) for y in range(height)]
+    mine_cells = rng.sample(cells, rng.randint(0, len(cells) // 2))
+    # Digs after every move and U-turns, so rovers disarm mines and come back over them
+    programs = ["".join(rng.choice(["M", "MD", "MD", "RR", "L", "R"]) for _ in range(rng.randint(0, 30)))
+                for _ in range(rng.randint(1, 6))]
+    check_batch(client, reset_world, width, height, mine_cells, programs)
+
+@pytest.mark.parametrize("seed", range(20))
+def test_batch_matches_sequential_dispatch_in_corridors(client, reset_world, seed):
+    rng = random.Random(seed)
+    width, height = rng.randint(1, 2), rng.randint(2, 10)
+    cells = [(x, y) for x in range(width) for y in range(height)]
+    mine_cells = rng.sample(cells, rng.randint(0, len(cells)))
+    # Rovers share a corridor, so later ones walk over mines earlier ones disarmed
+    programs = ["".join(rng.choice(["MD", "MD", "RRM", "M"]) for _ in range(rng.randint(0, 30)))
+                for _ in range(rng.randint(1, 3))]
+    check_batch(client, reset_world, width, height, mine_cells, programs)
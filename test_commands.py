@@ -0,0 +1,82 @@
+import random
+
+import pytest
+
+import fast_api_server
+from fast_api_server import DataStore, MineRecord, directions, direction_moves, run_commands
+
+def naive_run(mines, width, height, commands, x, y, facing):
+    """One command at a time, straight from the rules: the baseline run_commands must match."""
+    mines = dict(mines)  # (x, y) -> mine id, minus the ones disarmed
+    direction_idx = directions.index(facing)
+    on_mine = False
+    disarmed = []
+    for executed, command in enumerate(commands):
+        if command == "L":
+            direction_idx = (direction_idx - 1) % 4
+        elif command == "R":
+            direction_idx = (direction_idx + 1) % 4
+        elif command == "M":
+            if on_mine:
+                return x, y, directions[direction_idx], executed, True, disarmed
+            dx, dy = direction_moves[directions[direction_idx]]
+            if 0 <= x + dx < width and 0 <= y + dy < height:
+                x, y = x + dx, y + dy
+                on_mine = (x, y) in mines
+        elif command == "D" and on_mine:
+            disarmed.append(mines.pop((x, y)))
+            on_mine = False
+    return x, y, directions[direction_idx], len(commands), False, disarmed
+
+@pytest.mark.parametrize("seed", range(30))
+def test_run_commands_matches_step_by_step_run(seed):
+    rng = random.Random(seed)
+    width, height = rng.randint(1, 15), rng.randint(1, 15)
+    store = DataStore(check_consistency=True)
+    store.resize(height, width)
+    cells = rng.sample([(x, y) for x in range(width) for y in range(height)], rng.randint(0, width * height // 3))
+    for i, (x, y) in enumerate(cells, 1):
+        store.add_mine(MineRecord(i, x, y, f"R{i}"))
+    mines = {(x, y): i for i, (x, y) in enumerate(cells, 1)}
+    # Long move runs, so the fast-forward has something to skip over
+    commands = "".join(rng.choice(["M" * rng.randint(1, 20), "D", "L", "R", "LL", "MD"])
+                       for _ in range(rng.randint(0, 40)))
+    start = (rng.randrange(width), rng.randrange(height), rng.choice(directions))
+    run = run_commands(store, commands, *start)
+    assert (run.x, run.y, run.facing, run.executed, run.exploded, run.disarmed) == \
+        naive_run(mines, width, height, commands, *start)
+
+def test_long_runs_stop_at_the_edge_and_on_mines():
+    store = DataStore()
+    store.resize(100, 1)
+    run = run_commands(store, "M" * 100000 + "RRMM")
+    assert (run.x, run.y, run.facing, run.executed, run.exploded) == (0, 97, "N", 100004, False)
+    store.add_mine(MineRecord(1, 0, 40, "stop"))
+    run = run_commands(store, "M" * 100000)
+    assert (run.x, run.y, run.executed, run.exploded) == (0, 40, 40, True)
+    # Mines in removed count as already disarmed
+    run = run_commands(store, "M" * 100000, removed={(0, 40)})
+    assert (run.x, run.y, run.executed, run.exploded) == (0, 99, 100000, False)
+
+def test_simulate_predicts_dispatch_without_changing_anything(client):
+    db = fast_api_server.db
+    assert client.put("/map", json={"height": 8, "width": 8}).status_code == 200
+    for i, (x, y) in enumerate([(0, 2), (0, 5), (3, 5)]):
+        client.post("/mines", json={"x": x, "y": y, "serial_number": f"SIM{i}"})
+    commands = "MMDMMMDLMMMDMM"
+    versions = (db.map_version, db.mines_version, db.rovers_version)
+    simulated = client.post("/simulate", json={"commands": commands}).json()
+    assert client.post("/simulate", json={"commands": commands}).json() == simulated  # From the cache
+    assert (db.map_version, db.mines_version, db.rovers_version) == versions
+    assert [mine["serial_number"] for mine in simulated["disarmed_mines"]] == ["SIM0", "SIM1", "SIM2"]
+
+    rover = client.post("/rovers", json={"commands": commands}).json()
+    dispatched = client.post(f"/rovers/{rover['id']}/dispatch").json()
+    for key in ("position", "executed_commands", "status"):
+        assert dispatched[key] == simulated[key]
+    # The map changed, so the cached run is stale
+    again = client.post("/simulate", json={"commands": commands}).json()
+    assert again["disarmed_mines"] == [] and again["position"] == simulated["position"]
+    start = {"commands": "MM", "position": {"x": 3, "y": 3, "facing": "E"}}
+    client.post("/mines", json={"x": 4, "y": 3, "serial_number": "SIM3"})
+    assert client.post("/simulate", json=start).json()["status"] == "Eliminated"
@@ -0,0 +1,116 @@
+import os
+import random
+
+from fast_api_server import DataStore, MineRecord, RoverRecord
+from file_store import FileJournal
+from shared_store import SQLiteJournal
+
+def open_store(directory, **options):
+    store = DataStore(check_consistency=True)
+    store.attach(FileJournal(str(directory), **options))
+    return store
+
+def crash(store):
+    """Stops the journal the way a crash would, once its writer has written the log: no final snapshot."""
+    journal = store.backend
+    journal.queue.put(None)
+    journal.writer.join()
+    store.backend = None
+
+def random_changes(store, rng, count):
+    """Makes count changes of one op each, returning the world after each one."""
+    states = [store.snapshot()]
+    for i in range(count):
+        action = rng.random()
+        x, y = rng.randrange(store.map_width), rng.randrange(store.map_height)
+        if store.mine_id_at(x, y) is None and (action < 0.6 or not store.mines):
+            store.add_mine(MineRecord(store.next_mine_id, x, y, f"J{i}"))
+        elif action < 0.8 and store.mine_id_at(x, y) is None:
+            store.move_mine(rng.choice(list(store.mines)), x, y)
+        else:
+            store.remove_mine(rng.choice(list(store.mines)))
+        states.append(store.snapshot())
+    return states
+
+def test_clean_restart_keeps_world_and_epoch(tmp_path):
+    store = open_store(tmp_path)
+    store.resize(8, 8)
+    random_changes(store, random.Random(1), 50)
+    expected, epoch = store.snapshot(), store.map_epoch
+    store.detach()
+    store = open_store(tmp_path)
+    assert store.snapshot() == expected and store.map_epoch == epoch
+    store.detach()
+
+def test_replay_after_truncated_log(tmp_path):
+    rng = random.Random(2)
+    for cut in range(12):
+        directory = tmp_path / str(cut)
+        store = open_store(directory, snapshot_every=10**6)
+        store.resize(6, 6)
+        base = store.snapshot()
+        epoch = store.map_epoch
+        states = random_changes(store, rng, 40)
+        crash(store)
+        path = directory / "ops-0.log"
+        lines = path.read_bytes().splitlines(keepends=True)
+        ops = len(lines) - 40  # The resize and anything before the changes
+        # Cut through a line, as a crash in the middle of a write would
+        kept = rng.randrange(40)
+        size = sum(len(line) for line in lines[:ops + kept])
+        os.truncate(path, size + rng.randrange(1, len(lines[ops + kept])))
+        store = open_store(directory)
+        assert store.snapshot() == states[kept]
+        assert store.snapshot() != base or kept == 0
+        # The torn line is gone, and versions may have gone back: clients must resync
+        assert path.stat().st_size == size
+        assert store.map_epoch != epoch
+        store.detach()
+
+def test_crash_after_clean_restart_rotates_epoch(tmp_path):
+    store = open_store(tmp_path)
+    store.resize(5, 5)
+    store.detach()
+    store = open_store(tmp_path)
+    epoch = store.map_epoch
+    store.add_mine(MineRecord(1, 2, 2, "after"))
+    expected = store.snapshot()
+    crash(store)
+    store = open_store(tmp_path)
+    assert store.snapshot() == expected
+    assert store.map_epoch != epoch
+    store.detach()
+
+def test_sqlite_workers_converge(tmp_path):
+    path = str(tmp_path / "world.db")
+    workers = []
+    for _ in range(2):
+        store = DataStore(check_consistency=True)
+        store.attach(SQLiteJournal(path, snapshot_every=25))
+        workers.append(store)
+    rng = random.Random(18)
+    with workers[0].transaction():
+        workers[0].resize(8, 8)
+    for step in range(300):
+        # The second worker often lags, so it sometimes catches up across a compaction
+        store = workers[0] if rng.random() < 0.7 else workers[1]
+        store.sync()
+        with store.transaction():
+            random_changes(store, rng, rng.randint(1, 3))
+            if rng.random() < 0.2:
+                store.save_rover(RoverRecord(store.next_rover_id, "MRM"))
+    for store in workers:
+        # Snapshots are written by a background thread, so wait for them first
+        if store.backend.compactor is not None:
+            store.backend.compactor.join()
+        store.sync()
+    assert workers[0].snapshot() == workers[1].snapshot()
+    assert workers[0].map_epoch == workers[1].map_epoch
+    # Compacted along the way
+    assert workers[0].backend.conn.execute("SELECT seq FROM snapshot").fetchone()[0] > 0
+    # A worker starting now loads the same world
+    late = DataStore(check_consistency=True)
+    late.attach(SQLiteJournal(path))
+    assert late.snapshot() == workers[0].snapshot()
+    for store in workers + [late]:
+        store.detach()
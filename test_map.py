@@ -0,0 +1,82 @@
+import random
+from collections import deque
+
+import fast_api_server
+
+BINARY = {"Accept": "application/octet-stream"}
+
+def test_map_etag_depends_on_encoding(client):
+    assert client.put("/map", json={"height": 20, "width": 20}).status_code == 200
+    client.post("/mines", json={"x": 3, "y": 4, "serial_number": "etag"})
+    for url in ("/map", "/map/tiles/0/0", "/map?x=2&y=2&width=5&height=5"):
+        as_json = client.get(url)
+        as_bits = client.get(url, headers=BINARY)
+        assert as_json.headers["vary"] == as_bits.headers["vary"] == "Accept"
+        assert as_json.headers["content-type"] == "application/json"
+        assert as_bits.headers["content-type"] == "application/octet-stream"
+        assert as_json.headers["etag"] != as_bits.headers["etag"]
+        # A tag only matches the body it came with
+        assert client.get(url, headers={"If-None-Match": as_json.headers["etag"]}).status_code == 304
+        assert client.get(url, headers=dict(BINARY, **{"If-None-Match": as_bits.headers["etag"]})).status_code == 304
+        stale = client.get(url, headers=dict(BINARY, **{"If-None-Match": as_json.headers["etag"]}))
+        assert stale.status_code == 200 and stale.content == as_bits.content
+        stale = client.get(url, headers={"If-None-Match": as_bits.headers["etag"]})
+        assert stale.status_code == 200 and stale.json() == as_json.json()
+
+def test_map_etag_changes_with_the_map(client):
+    assert client.put("/map", json={"height": 5, "width": 5}).status_code == 200
+    first = client.get("/map")
+    client.post("/mines", json={"x": 1, "y": 1, "serial_number": "changed"})
+    second = client.get("/map", headers={"If-None-Match": first.headers["etag"]})
+    assert second.status_code == 200 and second.json()[1][1] == 1
+    assert second.headers["etag"] != first.headers["etag"]
+    # The epoch stays the first part, which is what the web client reads
+    assert second.headers["etag"].strip('"').split("-")[0] == fast_api_server.db.map_epoch
+
+def test_map_window(client):
+    assert client.put("/map", json={"height": 6, "width": 8}).status_code == 200
+    client.post("/mines", json={"x": 5, "y": 4, "serial_number": "window"})
+    assert client.get("/map?x=4&y=3&width=2&height=2").json() == [[0, 0], [0, 1]]
+    # Missing sizes run to the map edge, oversized ones are clipped to it
+    assert client.get("/map?x=5&y=4").json() == [[1, 0, 0], [0, 0, 0]]
+    assert client.get("/map?x=5&y=4&width=100&height=100").json() == [[1, 0, 0], [0, 0, 0]]
+    for query in ("width=0", "height=0", "width=-1", "x=0&y=0&width=0&height=0", "x=8", "y=-1"):
+        assert client.get(f"/map?{query}").status_code == 400, query
+
+def apply_changes(grid, changes):
+    for change in changes:
+        if change["type"] == "cell":
+            grid[change["y"]][change["x"]] = change["value"]
+        else:
+            grid = [[row[x] if y < len(grid) and x < len(row) else 0 for x in range(change["width"])]
+                    for y, row in enumerate(grid + [[]] * change["height"]) if y < change["height"]]
+    return grid
+
+def test_change_feed_replays_to_the_current_map(client, monkeypatch):
+    monkeypatch.setattr(fast_api_server.db, "map_changes", deque(maxlen=6))
+    rng = random.Random(10)
+    assert client.put("/map", json={"height": 8, "width": 8}).status_code == 200
+    grid, version = client.get("/map").json(), fast_api_server.db.map_version
+    epoch, resyncs = fast_api_server.db.map_epoch, 0
+    for step in range(300):
+        action = rng.random()
+        if action < 0.5:
+            client.post("/mines", json={"x": rng.randrange(10), "y": rng.randrange(10), "serial_number": f"C{step}"})
+        elif action < 0.7:
+            client.put(f"/mines/{rng.randint(1, step + 1)}", json={"x": rng.randrange(10), "y": rng.randrange(10)})
+        elif action < 0.9:
+            client.delete(f"/mines/{rng.randint(1, step + 1)}")
+        elif action < 0.95:
+            client.put("/map", json={"height": rng.randint(4, 10), "width": rng.randint(4, 10)})
+        if rng.random() < 0.15:
+            feed = client.get(f"/map/changes?since={version}&epoch={epoch}").json()
+            if feed["resync"]:
+                resyncs += 1
+                grid = client.get("/map").json()
+            else:
+                grid = apply_changes(grid, feed["changes"])
+            version = feed["version"]
+            assert grid == client.get("/map").json()
+    assert resyncs  # The short log ran out at least once
+    # Another epoch, as after a restart, always means resync
+    assert client.get(f"/map/changes?since={version}&epoch=other").json()["resync"]
@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+from fast_api_server import _parse_mine_upload
+from mine_import import MineFileError, parse_mine_layout, read_mine_files
+
+LAYOUT = "3 4\n0 1 0 0\n\n1 0 0 1\n0 0 0 0\nSN-α\r\nSN-β\nSN-γ\nunused\n"
+
+def chunked(data, size):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+def test_parse_mine_layout():
+    assert parse_mine_layout(LAYOUT.splitlines()) == (3, 4, [(1, 0, "SN-α"), (0, 1, "SN-β"), (3, 1, "SN-γ")])
+    assert read_mine_files("map1.txt", "mines.txt")[:2] == (4, 3)
+
+@pytest.mark.parametrize("text, error", [
+    ("", "header"),
+    ("2 x\n", "header"),
+    ("2 2\n0 1\n", "Expected 2 map rows, got 1"),
+    ("2 2\n0 1\n1\n", "Map row 1 has 1 cells"),
+    ("1 2\n0 2\n", "Map cell \\(1, 0\\)"),
+    ("1 2\n1 1\nSN-1\n", "2 mines but only 1 serial"),
+])
+def test_parse_mine_layout_errors(text, error):
+    with pytest.raises(MineFileError, match=error):
+        parse_mine_layout(text.splitlines())
+
+class ChunkedRequest:
+    def __init__(self, data, size):
+        self.data, self.size = data, size
+
+    async def stream(self):
+        for chunk in chunked(self.data, self.size):
+            yield chunk
+
+@pytest.mark.parametrize("size", [1, 2, 7, 4096])
+def test_upload_is_parsed_chunk_by_chunk(size):
+    # Chunks split lines, CRLFs and the UTF-8 bytes of the serials
+    parsed = asyncio.run(_parse_mine_upload(ChunkedRequest(LAYOUT.encode(), size)))
+    assert parsed == parse_mine_layout(LAYOUT.splitlines())
+
+def test_text_upload_matches_json_upload(client, reset_world):
+    response = client.post("/mines/bulk", content=LAYOUT.encode(), headers={"Content-Type": "text/plain"})
+    assert response.status_code == 201
+    uploaded = client.get("/map").json(), [(m["x"], m["y"], m["serial_number"]) for m in client.get("/mines").json()]
+    reset_world()
+    mines = [{"x": x, "y": y, "serial_number": serial} for x, y, serial in parse_mine_layout(LAYOUT.splitlines())[2]]
+    assert client.post("/mines/bulk?height=3&width=4", json=mines).status_code == 201
+    assert uploaded == (client.get("/map").json(), [(m["x"], m["y"], m["serial_number"]) for m in client.get("/mines").json()])
+
+def test_bad_uploads_change_nothing(client):
+    assert client.post("/mines", json={"x": 0, "y": 0, "serial_number": "kept"}).status_code == 201
+    for body in [b"2 2\n0 1\n1 0\nSN-1\n", b"1 1\n1\n\xff\xfe\n", b"1 1\n1\nSN-\xc3"]:
+        response = client.post("/mines/bulk", content=body, headers={"Content-Type": "text/plain"})
+        assert response.status_code == 400
+    assert [mine["serial_number"] for mine in client.get("/mines").json()] == ["kept"]
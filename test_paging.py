@@ -0,0 +1,67 @@
+import random
+
+import pytest
+
+from fast_api_server import DataStore, MineRecord
+
+def walk(client, path, **params):
+    """Every record of a list endpoint, following X-Next-Cursor; also returns the page count."""
+    records, pages = [], 0
+    while True:
+        response = client.get(path, params=params)
+        assert response.status_code == 200, response.text
+        records += response.json()
+        pages += 1
+        params["cursor"] = response.headers.get("x-next-cursor")
+        if params["cursor"] is None:
+            return records, pages
+
+@pytest.fixture
+def world(client):
+    rng = random.Random(22)
+    cells = rng.sample(range(40 * 40), 300)
+    client.post("/mines/bulk?height=40&width=40", json=[{"x": p % 40, "y": p // 40, "serial_number": f"G{p}"} for p in cells])
+    for mine_id in range(1, 300, 7):
+        client.delete(f"/mines/{mine_id}")
+    client.post("/rovers/bulk", json=[{"commands": "".join(rng.choice("LRMD") for _ in range(8))} for _ in range(60)])
+    client.post("/rovers/dispatch", json={"rover_ids": list(range(1, 61, 3))})
+    return client
+
+def test_cursor_walks_give_every_record_once(world):
+    mines = world.get("/mines").json()
+    assert [mine["id"] for mine in mines] == sorted(mine["id"] for mine in mines)
+    for limit in (1, 17, 300):
+        assert walk(world, "/mines", limit=limit)[0] == mines
+    assert walk(world, "/mines", limit=25, fields="id,x")[0] == [{"id": m["id"], "x": m["x"]} for m in mines]
+    rovers = world.get("/rovers").json()
+    done = [{"id": r["id"], "status": r["status"]} for r in rovers if r["status"] in ("Finished", "Eliminated")]
+    assert walk(world, "/rovers", limit=4, status="Finished,Eliminated", fields="id,status")[0] == done
+
+@pytest.mark.parametrize("box", [(5, 0, 20, 10), (0, 0, 39, 39), (39, 39, 39, 39), (-5, 30, 100, 100), (10, 10, 5, 5)])
+def test_bbox_pages_match_a_filter(world, box):
+    x0, y0, x1, y1 = box
+    expected = [m for m in world.get("/mines").json() if x0 <= m["x"] <= x1 and y0 <= m["y"] <= y1]
+    bbox = ",".join(map(str, box))
+    assert world.get("/mines", params={"bbox": bbox}).json() == expected
+    records, pages = walk(world, "/mines", limit=10, bbox=bbox)
+    assert records == expected
+    assert pages == max(1, -(-len(expected) // 10))  # Full pages until the last
+
+@pytest.mark.parametrize("params", [{"limit": 0}, {"limit": 10 ** 6}, {"cursor": "x"}, {"fields": "id,bogus"},
+                                    {"status": "Flying"}, {"bbox": "1,2"}])
+def test_bad_list_parameters(world, params):
+    path = "/rovers" if "status" in params else "/mines"
+    assert world.get(path, params=params).status_code == 400
+
+def test_mine_ids_in_box_matches_a_scan():
+    rng = random.Random(23)
+    store = DataStore()
+    store.resize(30, 30)
+    cells = rng.sample([(x, y) for x in range(30) for y in range(30)], 200)
+    store.add_mines([MineRecord(rng.randrange(10 ** 6) * 1000 + i, x, y, "B") for i, (x, y) in enumerate(cells)])
+    for _ in range(300):
+        x0, y0 = rng.randint(-3, 32), rng.randint(-3, 32)
+        x1, y1 = x0 + rng.randint(-2, 20), y0 + rng.randint(-2, 20)
+        expected = sorted(mine.id for mine in store.mines.values() if x0 <= mine.x <= x1 and y0 <= mine.y <= y1)
+        assert store.mine_ids_in(x0, y0, x1, y1) == expected
+        assert store.mine_ids_in(x0, y0, x1, y1, most=10) == (expected if len(expected) <= 10 else None)
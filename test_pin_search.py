@@ -0,0 +1,91 @@
+import asyncio
+import hashlib
+import random
+
+import pytest
+
+from fast_api_server import PinCache, PinSearchPool
+from pin_search import PinSearchEngine, find_pin, search_pin_range
+
+def naive_search(serial, difficulty, start, stop):
+    """The original search: hex digests of serial + str(pin), one string at a time."""
+    for pin in range(start, stop):
+        if hashlib.sha256(f"{serial}{pin}".encode()).hexdigest().startswith("0" * difficulty):
+            return pin
+    return None
+
+@pytest.mark.parametrize("difficulty", [0, 1, 2, 3])
+def test_pin_engine_matches_hexdigest_search(difficulty):
+    rng = random.Random(difficulty)
+    for _ in range(10):
+        serial = "".join(rng.choice("ABCXYZ0123456789-é") for _ in range(rng.randint(0, 12)))
+        start = rng.randrange(0, 3000)
+        stop = start + rng.randrange(0, 2000)
+        expected = naive_search(serial, difficulty, start, stop)
+        assert PinSearchEngine(serial, difficulty).search(start, stop) == expected
+        assert search_pin_range(serial, start, stop, difficulty) == expected
+        pin = naive_search(serial, difficulty, 0, 5001)
+        assert find_pin(serial, difficulty, 5000) == (5000 if pin is None else pin)
+
+def test_parallel_pin_search_returns_smallest_pin():
+    async def search(serials):
+        pool = PinSearchPool(max_workers=2, max_pending=4, difficulty=3, limit=20000, chunk_size=500)
+        pool.start()
+        try:
+            return await asyncio.gather(*(pool.find_pin(serial) for serial in serials))
+        finally:
+            pool.shutdown()
+
+    serials = [f"parallel-{i}" for i in range(6)]
+    assert asyncio.run(search(serials)) == [find_pin(serial, 3, 20000) for serial in serials]
+
+def test_parallel_pin_search_without_a_pin_returns_limit():
+    async def search():
+        pool = PinSearchPool(max_workers=3, max_pending=2, difficulty=6, limit=3000, chunk_size=250)
+        pool.start()
+        try:
+            return await pool.find_pin("never"), sorted(pool.free_slots)
+        finally:
+            pool.shutdown()
+
+    pin, free_slots = asyncio.run(search())
+    assert pin == find_pin("never", 6, 3000) == 3000
+    assert free_slots == [0, 1, 2, 3]  # Every cancellation slot came back
+
+def test_prefetches_leave_a_worker_for_digs():
+    in_flight = {"prefetch": 0, "most": 0}
+
+    async def run():
+        pool = PinSearchPool(max_workers=3, max_pending=8, difficulty=3, limit=6000, chunk_size=500)
+        pool.start()
+        submit = pool.executor.submit
+        loop = asyncio.get_running_loop()
+
+        def finished():
+            in_flight["prefetch"] -= 1
+
+        def counting_submit(fn, serial, *args):
+            work = submit(fn, serial, *args)
+            if serial.startswith("prefetch-"):
+                in_flight["prefetch"] += 1
+                in_flight["most"] = max(in_flight["most"], in_flight["prefetch"])
+                work.add_done_callback(lambda _: loop.call_soon_threadsafe(finished))
+            return work
+
+        pool.executor.submit = counting_submit
+        cache = PinCache(pool, 100, prefetch_concurrency=4)
+        try:
+            cache.prefetch_many(f"prefetch-{i}" for i in range(8))
+            await asyncio.sleep(0)
+            dig = await cache.get("dig")
+            while cache.prefetchers:
+                await asyncio.sleep(0.01)
+            return dig, [cache.lookup(f"prefetch-{i}") for i in range(8)]
+        finally:
+            pool.shutdown()
+
+    dig, prefetched = asyncio.run(run())
+    assert dig == find_pin("dig", 3, 6000)
+    assert prefetched == [find_pin(f"prefetch-{i}", 3, 6000) for i in range(8)]
+    # Four prefetchers asked for, but only two run, a chunk each, next to the dig's worker
+    assert in_flight["most"] == 2
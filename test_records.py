@@ -0,0 +1,49 @@
+import random
+
+from fast_api_server import DataStore, MineRecord, MineTable, RoverRecord, RoverStatus
+
+def test_mine_table_reads_like_a_dict():
+    rng = random.Random(24)
+    table, expected = MineTable(), {}
+    for step in range(500):
+        mine_id = rng.randint(1, 40)
+        if mine_id in expected and rng.random() < 0.4:
+            assert table.remove(mine_id).to_json() == expected.pop(mine_id).to_json()
+        elif mine_id in expected and rng.random() < 0.5:
+            x, y = rng.randrange(50), rng.randrange(50)
+            table.move(mine_id, x, y)
+            expected[mine_id] = MineRecord(mine_id, x, y, expected[mine_id].serial_number)
+        else:
+            expected[mine_id] = MineRecord(mine_id, rng.randrange(50), rng.randrange(50), f"T{step}")
+            table.add(expected[mine_id])
+        assert len(table) == len(expected)
+    expected = {mine_id: mine.to_json() for mine_id, mine in expected.items()}
+    assert {mine_id: mine.to_json() for mine_id, mine in table.items()} == expected
+    assert sorted(table) == sorted(expected) and 41 not in table
+    # Loading from columns, as snapshots do, gives the same table
+    copy = MineTable(*table.columns())
+    assert {mine_id: copy[mine_id].to_json() for mine_id in copy} == expected
+
+def test_rover_record_joins_executed_parts_on_read():
+    rover = RoverRecord(7, "MMLR")
+    for part in ("M", "ML", "", "R"):
+        rover.add_executed(part)
+    data = rover.to_json()  # Doesn't join in place: the journal's writer thread calls it
+    assert data["executed_commands"] == "MMLR" and not isinstance(rover._executed, str)
+    assert rover.executed_commands == "MMLR" and isinstance(rover._executed, str)
+    copy = RoverRecord.from_json(data)
+    assert copy.to_json() == data and copy.status is RoverStatus.NOT_STARTED
+    assert not hasattr(rover, "__dict__")
+
+def test_snapshot_round_trip_keeps_indexes_consistent():
+    rng = random.Random(9)
+    store = DataStore(check_consistency=True)
+    store.resize(30, 20)
+    cells = rng.sample([(x, y) for x in range(20) for y in range(30)], 150)
+    store.add_mines([MineRecord(i + 1, x, y, f"S{i}") for i, (x, y) in enumerate(cells)])
+    for columns in (False, True):
+        copy = DataStore(check_consistency=True)
+        copy.load_snapshot(store.snapshot(columns=columns))
+        assert copy.snapshot() == store.snapshot()
+        for x, y in cells:
+            assert copy.mine_id_at(x, y) == store.mine_id_at(x, y)
@@ -0,0 +1,252 @@
+import asyncio
+import json
+import random
+import time
+
+import pytest
+
+import fast_api_server
+from fast_api_server import (DataStore, RealtimeSession, RoverRecord, RoverScheduler, RoverStatus, SpectatorHub,
+                             directions, direction_moves)
+
+def test_cached_rover_follows_a_stream(client, monkeypatch):
+    monkeypatch.setattr(fast_api_server, "DISPATCH_STREAM_BATCH", 1)
+    assert client.put("/map", json={"height": 40, "width": 10}).status_code == 200
+    rover_id = client.post("/rovers", json={"commands": "MMMMLMRMMMMMM" * 2}).json()["id"]
+    seen = []
+
+    async def stream():
+        response = await fast_api_server.dispatch_rover_stream(rover_id)
+        async for chunk in response.body_iterator:
+            event = json.loads(chunk)
+            if event["event"] == "pose":
+                # The cached body is dropped on every pose, not just at the end
+                position = client.get(f"/rovers/{rover_id}").json()["position"]
+                assert position == {key: event[key] for key in ("x", "y", "facing")}
+                seen.append(position)
+
+    asyncio.run(stream())
+    assert len(seen) > 2
+    assert client.get(f"/rovers/{rover_id}").json()["status"] == "Finished"
+
+def test_cached_rover_follows_a_realtime_session(client):
+    assert client.put("/map", json={"height": 5, "width": 5}).status_code == 200
+    rover_id = client.post("/rovers", json={"commands": ""}).json()["id"]
+    rover = fast_api_server.db.rovers[rover_id]
+    session = RealtimeSession(rover, 2, False)
+
+    async def run():
+        for command in "MMLM":
+            await session.step(command)
+            client.get(f"/rovers/{rover_id}")  # Cached between the step and the log
+            session.log(command)
+
+    asyncio.run(run())
+    body = client.get(f"/rovers/{rover_id}").json()
+    assert body["executed_commands"] == "MMLM"
+    assert body["position"] == {"x": 1, "y": 2, "facing": "E"}
+
+def test_stream_dropped_before_it_starts_leaves_rover_ready(client):
+    assert client.put("/map", json={"height": 5, "width": 5}).status_code == 200
+    rover_id = client.post("/rovers", json={"commands": "MMM"}).json()["id"]
+
+    async def drop():
+        # The response is made but its body never sent, as when the client goes away at once
+        response = await fast_api_server.dispatch_rover_stream(rover_id)
+        await response.body_iterator.aclose()
+
+    asyncio.run(drop())
+    assert client.get(f"/rovers/{rover_id}").json()["status"] == "Not Started"
+    lines = client.post(f"/rovers/{rover_id}/dispatch/stream").text.splitlines()
+    assert json.loads(lines[-1])["rover"]["status"] == "Finished"
+
+def test_stream_of_rover_deleted_meanwhile_reports_error(client):
+    rover_id = client.post("/rovers", json={"commands": "M"}).json()["id"]
+
+    async def race():
+        response = await fast_api_server.dispatch_rover_stream(rover_id)
+        assert client.delete(f"/rovers/{rover_id}").status_code == 204
+        return [json.loads(chunk) async for chunk in response.body_iterator]
+
+    events = asyncio.run(race())
+    assert [event["event"] for event in events] == ["error"]
+    assert events[0]["status_code"] == 404
+
+def test_scheduler_survives_a_failing_rover():
+    store = DataStore()
+    store.resize(10, 10)
+    good, bad = RoverRecord(1, "MMLMM"), RoverRecord(2, "MMMM")
+    store.save_rover(good)
+    store.save_rover(bad)
+
+    def broken(store, steps):
+        raise RuntimeError("broken rover")
+
+    async def run():
+        scheduler = RoverScheduler(store, 0.001, 2, 1.0)
+        scheduler.enqueue(bad)
+        scheduler.queue[0].advance = broken
+        scheduler.enqueue(good)
+        scheduler.start()
+        try:
+            for _ in range(200):
+                if not scheduler.queue:
+                    break
+                await asyncio.sleep(0.005)
+            assert not scheduler.task.done()
+        finally:
+            await scheduler.stop()
+        return scheduler
+
+    scheduler = asyncio.run(run())
+    assert scheduler.errors == 1
+    assert (good.status, good.executed_commands, good.x, good.y) == (RoverStatus.FINISHED, "MMLMM", 2, 2)
+    assert (bad.status, bad.executed_commands) == (RoverStatus.FINISHED, "")
+
+def test_spectator_feed_survives_a_failing_tick(monkeypatch):
+    store = DataStore()
+    store.resize(4, 4)
+    failures = iter([RuntimeError("database is locked")])
+
+    def sync():
+        for error in failures:
+            raise error
+
+    monkeypatch.setattr(store, "sync", sync)
+
+    async def run():
+        hub = SpectatorHub(store, 0.001)
+        subscriber = hub.subscribe()
+        hub.start()
+        try:
+            await asyncio.sleep(0.01)
+            store.save_rover(RoverRecord(1, "M"))
+            hub.rover_changed(1)
+            update = json.loads(await asyncio.wait_for(subscriber.next(), 1))
+        finally:
+            await hub.stop()
+        return hub, update
+
+    hub, update = asyncio.run(run())
+    assert hub.errors == 1
+    assert update
+
+def drive(client, rover_id, frames, query=""):
+    with client.websocket_connect(f"/ws/{rover_id}{query}") as ws:
+        ws.receive_text()  # Connected
+        replies = []
+        for frame in frames:
+            ws.send_text(frame)
+            replies.append(json.loads(ws.receive_text()))
+    return replies
+
+def test_command_frames_match_single_commands(client, reset_world):
+    commands = "MMDMMLMDR"
+
+    def run(frames):
+        assert client.put("/map", json={"height": 6, "width": 6}).status_code == 200
+        for x, y in [(0, 2), (1, 4)]:
+            client.post("/mines", json={"x": x, "y": y, "serial_number": f"WS{x}"})
+        rover_id = client.post("/rovers", json={"commands": ""}).json()["id"]
+        replies = drive(client, rover_id, frames)
+        rover = client.get(f"/rovers/{rover_id}").json()
+        reset_world()
+        return replies, rover
+
+    singles, one = run(list(commands))
+    (frame,), other = run([commands])
+    assert frame["status"] == "success" and frame["executed"] == len(commands)
+    assert frame["results"] == singles
+    assert frame["position"] == singles[-1]["position"]
+    assert one["executed_commands"] == other["executed_commands"] == commands
+    assert one["position"] == other["position"]
+
+def test_final_report_and_compact_encoding(client):
+    assert client.put("/map", json={"height": 6, "width": 6}).status_code == 200
+    client.post("/mines", json={"x": 0, "y": 3, "serial_number": "compact"})
+    rover_id = client.post("/rovers", json={"commands": ""}).json()["id"]
+    frame, = drive(client, rover_id, ["MMMDMMM"], "?report=final&encoding=compact")
+    # Only the stop on the mine, the dig and the bump into the map edge are reported
+    assert frame["s"] == "success" and frame["n"] == 7 and frame["p"] == [0, 5, "S"]
+    assert [event["i"] for event in frame["e"]] == [2, 3, 6]
+    assert frame["e"][1]["pin"] is not None and "message" not in frame["e"][1]
+    frame, = drive(client, rover_id, ["MX"], "?encoding=compact")
+    assert frame["s"] == "error"
+
+def walk(commands, width, height, mines):
+    """The cells a dispatched rover goes through, one command at a time."""
+    x, y, facing, on_mine, mines = 0, 0, "S", False, set(mines)
+    points = [[0, 0]]
+    for command in commands:
+        if command in "LR":
+            facing = directions[(directions.index(facing) + (1 if command == "R" else -1)) % 4]
+        elif command == "D" and on_mine:
+            mines.discard((x, y))
+            on_mine = False
+        elif command == "M":
+            if on_mine:
+                break
+            dx, dy = direction_moves[facing]
+            if 0 <= x + dx < width and 0 <= y + dy < height:
+                x, y = x + dx, y + dy
+                points.append([x, y])
+                on_mine = (x, y) in mines
+    return points
+
+@pytest.mark.parametrize("how", ["dispatch", "stream", "batch", "enqueue"])
+def test_path_follows_every_kind_of_dispatch(client, how):
+    rng = random.Random(25)
+    assert client.put("/map", json={"height": 12, "width": 9}).status_code == 200
+    mines = rng.sample([(x, y) for x in range(9) for y in range(12) if (x, y) != (0, 0)], 15)
+    client.post("/mines/bulk", json=[{"x": x, "y": y, "serial_number": f"P{i}"} for i, (x, y) in enumerate(mines)])
+    commands = "".join(rng.choice(["M" * rng.randint(1, 9), "MD", "L", "R"]) for _ in range(60))
+    rover_id = client.post("/rovers", json={"commands": commands}).json()["id"]
+    if how == "dispatch":
+        client.post(f"/rovers/{rover_id}/dispatch")
+    elif how == "stream":
+        client.post(f"/rovers/{rover_id}/dispatch/stream?every=3")
+    elif how == "batch":
+        client.post("/rovers/dispatch", json={"rover_ids": [rover_id]})
+    else:
+        client.post(f"/rovers/{rover_id}/enqueue")
+        for _ in range(500):
+            if client.get(f"/rovers/{rover_id}").json()["status"] != "Moving":
+                break
+            time.sleep(0.01)
+    expected = walk(commands, 9, 12, mines)
+    path = client.get(f"/rovers/{rover_id}/path").json()
+    assert path["points"] == expected and path["moves"] == len(expected) - 1
+    assert client.get(f"/rovers/{rover_id}").json()["position"]["x"] == expected[-1][0]
+    # A window, thinned out, keeps its last point
+    window = client.get(f"/rovers/{rover_id}/path?start=2&stop=20&max_points=4").json()
+    assert window["points"][0] == expected[2] and window["points"][-1] == expected[min(20, len(expected) - 1)]
+    assert len(window["points"]) <= 4
+
+@pytest.mark.parametrize("commands", ["MX", "m", "M D", "MMD\n", "ＭＭ"])
+def test_invalid_commands_are_refused_everywhere(client, commands):
+    rover_id = client.post("/rovers", json={"commands": "M"}).json()["id"]
+    assert client.post("/rovers", json={"commands": commands}).status_code == 400
+    assert client.put(f"/rovers/{rover_id}", json={"commands": commands}).status_code == 400
+    assert client.post("/simulate", json={"commands": commands}).status_code == 400
+    # All or nothing: the valid rover before the bad one isn't created either
+    assert client.post("/rovers/bulk", json=[{"commands": "MM"}, {"commands": commands}]).status_code == 400
+    assert [rover["id"] for rover in client.get("/rovers").json()] == [rover_id]
+    assert client.get(f"/rovers/{rover_id}").json()["commands"] == "M"
+
+def test_long_programs_and_bulk_rovers(client):
+    long_program = "MRML" * 250000
+    rover = client.post("/rovers", json={"commands": long_program}).json()
+    assert client.put(f"/rovers/{rover['id']}", json={"commands": long_program + "D"}).status_code == 200
+    created = client.post("/rovers/bulk", json=[{"commands": ""}, {"commands": "LRMD"}, {"commands": "MMM"}]).json()
+    assert created == {"created": 3, "ids": [rover["id"] + 1, rover["id"] + 2, rover["id"] + 3]}
+    assert [client.get(f"/rovers/{rover_id}").json()["commands"] for rover_id in created["ids"]] == ["", "LRMD", "MMM"]
+
+def test_read_scenario(tmp_path):
+    from RoverOperator import read_scenario
+    path = tmp_path / "world.txt"
+    path.write_text("map 4 5  # height, width\nmine 1 2 SN-1\n\nrover MMD\nrover\ndispatch\n")
+    assert read_scenario(str(path)) == {"height": 4, "width": 5, "mines": [(1, 2, "SN-1")],
+                                        "rovers": ["MMD", ""], "dispatch": True}
+    path.write_text("map 4 5\nrover MM RR\n")
+    with pytest.raises(ValueError, match="line 2"):
+        read_scenario(str(path))
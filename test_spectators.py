@@ -0,0 +1,77 @@
+import asyncio
+import json
+import random
+
+import fast_api_server
+from fast_api_server import DataStore, MineRecord, RoverRecord, RoverStatus, SpectatorHub
+
+class Watcher:
+    """What a spectator client keeps: the map and the rovers, updated from the feed."""
+
+    def __init__(self, hub, store):
+        self.subscriber = hub.subscribe()
+        self.store = store
+        self.grid = json.loads(store.grid.to_json())
+        self.rovers = {rover["id"]: rover for rover in hub.snapshot()["rovers"]}
+        self.resyncs = 0
+
+    def take(self):
+        if not self.subscriber.ready.is_set():
+            return
+        update = json.loads(asyncio.get_event_loop().run_until_complete(self.subscriber.next()))
+        if update["resync"]:
+            self.resyncs += 1
+            self.grid = json.loads(self.store.grid.to_json())  # GET /map
+        for change in update["changes"]:
+            if change["type"] == "cell":
+                self.grid[change["y"]][change["x"]] = change["value"]
+            else:
+                self.grid = [[row[x] if x < len(row) else 0 for x in range(change["width"])]
+                             for row in (self.grid + [[]] * change["height"])[:change["height"]]]
+        for rover in update["rovers"]:
+            self.rovers[rover["id"]] = rover
+        for rover_id in update["removed"]:
+            self.rovers.pop(rover_id, None)
+
+def test_slow_and_fast_watchers_end_up_with_the_world(monkeypatch):
+    monkeypatch.setattr(fast_api_server, "SPECTATOR_MAX_CHANGES", 12)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        rng = random.Random(16)
+        store = DataStore()
+        store.resize(8, 8)
+        hub = SpectatorHub(store, 1)
+        store.rover_listener = hub.rover_changed
+        hub.version = store.map_version
+        fast, slow = Watcher(hub, store), Watcher(hub, store)
+        for step in range(400):
+            for _ in range(rng.randint(1, 4)):
+                action = rng.random()
+                x, y = rng.randrange(store.map_width), rng.randrange(store.map_height)
+                if action < 0.4 and store.mine_id_at(x, y) is None:
+                    store.add_mine(MineRecord(store.next_mine_id, x, y, f"W{step}"))
+                elif action < 0.6 and store.mines:
+                    store.remove_mine(rng.choice(list(store.mines)))
+                elif action < 0.8:
+                    rover = store.rovers.get(rng.randint(1, 6)) or RoverRecord(rng.randint(1, 6), "M")
+                    rover.place(x, y, rng.choice("NESW"))
+                    rover.status = rng.choice(list(RoverStatus))
+                    store.save_rover(rover)
+                elif action < 0.9 and store.rovers:
+                    store.delete_rover(rng.choice(list(store.rovers)))
+                elif action < 0.93:
+                    store.resize(rng.randint(4, 10), rng.randint(4, 10))
+            hub.publish()
+            fast.take()
+            if step % 7 == 0:
+                slow.take()  # Everything since the last take arrives merged into one update
+        slow.take()
+        expected = {rover_id: fast_api_server._spectator_rover(rover) for rover_id, rover in store.rovers.items()}
+        for watcher in (fast, slow):
+            assert watcher.grid == json.loads(store.grid.to_json())
+            assert watcher.rovers == expected
+        assert slow.resyncs > fast.resyncs
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
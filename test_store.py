@@ -0,0 +1,88 @@
+import random
+
+import pytest
+
+import fast_api_server
+from fast_api_server import DataStore, MineRecord
+
+# Every test here runs with the consistency check on (the client fixture turns it on for the app):
+# each change to the map verifies the mine table, the indexes and the grid against each other
+
+def make_store(height, width):
+    store = DataStore(check_consistency=True)
+    store.resize(height, width)
+    return store
+
+@pytest.mark.parametrize("mode", ["dense", "sparse"])
+def test_random_mine_changes_keep_indexes_consistent(monkeypatch, mode):
+    monkeypatch.setattr(fast_api_server, "MAP_MODE", mode)
+    rng = random.Random(5)
+    store = make_store(12, 12)
+    expected = {}  # (x, y) -> mine id
+    for step in range(2000):
+        action = rng.random()
+        x, y = rng.randrange(store.map_width), rng.randrange(store.map_height)
+        if action < 0.35 and (x, y) not in expected:
+            mine_id = store.next_mine_id
+            store.add_mine(MineRecord(mine_id, x, y, f"SN{step}"))
+            expected[(x, y)] = mine_id
+        elif action < 0.55 and expected and (x, y) not in expected:
+            old = rng.choice(sorted(expected))
+            store.move_mine(expected[old], x, y)
+            expected[(x, y)] = expected.pop(old)
+        elif action < 0.75 and expected:
+            position = rng.choice(sorted(expected))
+            assert store.remove_mine(expected.pop(position)).x == position[0]
+        elif action < 0.8:
+            height, width = rng.randint(4, 16), rng.randint(4, 16)
+            store.resize(height, width)
+            expected = {(x, y): mine_id for (x, y), mine_id in expected.items() if x < width and y < height}
+        elif action < 0.82:
+            free = [(x, y) for x in range(store.map_width) for y in range(store.map_height) if (x, y) not in expected]
+            added = rng.sample(free, min(len(free), rng.randint(1, 20)))
+            mines = [MineRecord(store.next_mine_id + i, x, y, f"B{step}-{i}") for i, (x, y) in enumerate(added)]
+            store.add_mines(mines)
+            expected.update({(mine.x, mine.y): mine.id for mine in mines})
+        elif action < 0.83:
+            store.clear_mines()
+            expected = {}
+        for position in [(x, y)] + list(expected)[:5]:
+            assert store.mine_id_at(*position) == expected.get(position)
+    store.verify_consistency()
+    assert {(mine.x, mine.y): mine_id for mine_id, mine in store.mines.items()} == expected
+
+def test_next_mine_matches_a_walk():
+    rng = random.Random(8)
+    store = make_store(15, 15)
+    cells = rng.sample([(x, y) for x in range(15) for y in range(15)], 60)
+    store.add_mines([MineRecord(i + 1, x, y, f"N{i}") for i, (x, y) in enumerate(cells)])
+    mines = set(cells)
+    for _ in range(500):
+        x, y = rng.randrange(15), rng.randrange(15)
+        dx, dy = rng.choice([(1, 0), (-1, 0), (0, 1), (0, -1)])
+        limit = rng.randint(0, 20)
+        removed = set(rng.sample(cells, 10))
+        expected = next((step for step in range(1, limit + 1)
+                         if (x + step * dx, y + step * dy) in mines - removed), None)
+        assert store.next_mine(x, y, dx, dy, limit, removed) == expected
+
+def test_endpoints_keep_indexes_consistent(client):
+    db = fast_api_server.db
+    assert client.put("/map", json={"height": 8, "width": 8}).status_code == 200
+    ids = [client.post("/mines", json={"x": x, "y": x + 1, "serial_number": f"http-{x}"}).json()["id"]
+           for x in range(6)]
+    assert client.post("/mines", json={"x": 0, "y": 1, "serial_number": "taken"}).status_code == 400
+    assert client.put(f"/mines/{ids[0]}", json={"x": 7, "y": 0}).status_code == 200
+    assert db.mine_id_at(7, 0) == ids[0] and db.mine_id_at(0, 1) is None
+    assert client.delete(f"/mines/{ids[1]}").status_code == 204
+    assert db.mine_id_at(1, 2) is None
+    # (5, 6) is pruned by the resize
+    assert client.put("/map", json={"height": 6, "width": 6}).status_code == 200
+    assert ids[5] not in db.mines and db.mine_id_at(5, 6) is None
+    # Down to (2, 3), disarm it, and on until the map edge
+    rover = client.post("/rovers", json={"commands": "LMMRMMMDMMM"}).json()
+    dispatched = client.post(f"/rovers/{rover['id']}/dispatch").json()
+    assert dispatched["status"] == "Finished"
+    assert dispatched["position"] == {"x": 2, "y": 5, "facing": "S"}
+    assert ids[2] not in db.mines and db.mine_id_at(2, 3) is None
+    db.verify_consistency()